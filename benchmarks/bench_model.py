@@ -0,0 +1,134 @@
+"""
+Benchmark of the MAnorm model on synthetic peaks and reads.
+
+The column-based `MAmodel` pipeline (read counting, M-A model fitting and
+normalization) is compared with the per-peak pipeline, which calls the
+`ManormPeak` methods peak by peak on plain `ManormPeak` objects held in
+`GenomicRegions`, as peaks were stored before the columnar tables. The
+per-peak pipeline is timed on a subset of the peaks and extrapolated to all
+peaks.
+
+Usage::
+
+    python benchmarks/bench_model.py --peaks 500000
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from manorm.model import MAmodel
+from manorm.read import Reads
+from manorm.region import GenomicRegions, ManormPeak, ManormPeaks
+from manorm.stats import huber_fit, xy_to_ma
+
+
+def synthetic_peaks(rng, name, num, chroms, chrom_size):
+    """Generate non-overlapping peaks with random lengths and summits."""
+    peaks = ManormPeaks(name=name)
+    per_chrom = num // len(chroms)
+    for chrom in chroms:
+        gaps = rng.integers(200, 2 * chrom_size // per_chrom - 1500,
+                            size=per_chrom)
+        lengths = rng.integers(200, 1500, size=per_chrom)
+        starts = np.cumsum(gaps + np.r_[0, lengths[:-1]])
+        ends = starts + lengths
+        summits = starts + rng.integers(0, lengths)
+        peaks.add_many(chrom, starts, ends, summits)
+    return peaks
+
+
+def synthetic_reads(rng, name, num, chroms, chrom_size):
+    data = {}
+    for chrom in chroms:
+        data[chrom] = np.sort(rng.integers(0, chrom_size,
+                                           size=num // len(chroms)))
+    return Reads.from_sorted(data, name=name)
+
+
+def per_peak_pipeline(peaks_sets, reads1, reads2, window, cutoff):
+    """The per-peak pipeline working on `ManormPeak` objects."""
+    peak_lists = [[peak for chrom in peaks.chroms
+                   for peak in peaks.fetch(chrom)] for peaks in peaks_sets]
+    for peak_list in peak_lists:
+        for peak in peak_list:
+            peak.count_reads(reads1, reads2, window)
+    m_values = []
+    a_values = []
+    for peak in peak_lists[2]:
+        if peak.summit_dis <= cutoff:
+            m_values.append(peak.m_raw)
+            a_values.append(peak.a_raw)
+    m_values = np.array(m_values)
+    a_values = np.array(a_values)
+    mask = abs(m_values) <= 10
+    intercept, slope = huber_fit(a_values[mask], m_values[mask])
+    for peak_list in peak_lists:
+        for peak in peak_list:
+            peak.normalize(slope, intercept)
+    return sum(len(peak_list) for peak_list in peak_lists)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument("--peaks", type=int, default=500000,
+                        help="Number of peaks of each sample.")
+    parser.add_argument("--reads", type=int, default=20000000,
+                        help="Number of reads of each sample.")
+    parser.add_argument("--subset", type=int, default=20000,
+                        help="Number of peaks to time the per-peak pipeline.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    chroms = [f"chr{idx}" for idx in range(1, 11)]
+    chrom_size = max(args.peaks, args.subset) // len(chroms) * 4000
+    peaks1 = synthetic_peaks(rng, 'sample1', args.peaks, chroms, chrom_size)
+    peaks2 = synthetic_peaks(rng, 'sample2', args.peaks, chroms, chrom_size)
+    reads1 = synthetic_reads(rng, 'sample1', args.reads, chroms, chrom_size)
+    reads2 = synthetic_reads(rng, 'sample2', args.reads, chroms, chrom_size)
+    print(f"{peaks1.size:,} + {peaks2.size:,} peaks, "
+          f"{reads1.size:,} + {reads2.size:,} reads")
+
+    model = MAmodel(peaks1, peaks2, reads1, reads2)
+    t0 = time.perf_counter()
+    model.process_peaks()
+    t1 = time.perf_counter()
+    model.fit_model(window_size=2000, summit_dis_cutoff=500)
+    model.normalize()
+    t2 = time.perf_counter()
+    num_peaks = peaks1.size + peaks2.size + model.peaks_merged.size
+    print(f"Processing peaks: {t1 - t0:.2f}s")
+    print(f"Column-based counting/fitting/normalization: {t2 - t1:.2f}s "
+          f"({num_peaks:,} peaks)")
+
+    # time the per-peak pipeline on the first peaks of each peak set
+    subsets = []
+    size = args.subset // 3
+    for peaks in (model.peaks1, model.peaks2, model.peaks_merged):
+        subset = GenomicRegions(name=peaks.name)
+        chrom = peaks.chroms[0]
+        for start, end, summit, summit_dis in zip(
+                *(peaks.column(chrom, name)[:size].tolist()
+                  for name in ('start', 'end', 'summit', 'summit_dis'))):
+            peak = ManormPeak(chrom, start, end, summit)
+            peak.summit_dis = summit_dis
+            subset.add(peak)
+        subsets.append(subset)
+    t3 = time.perf_counter()
+    num_subset = per_peak_pipeline(subsets, reads1, reads2, 2000, 500)
+    t4 = time.perf_counter()
+    per_peak = (t4 - t3) / num_subset * num_peaks
+    print(f"Per-peak counting/fitting/normalization: {t4 - t3:.2f}s "
+          f"({num_subset:,} peaks), {per_peak:.2f}s extrapolated")
+    print(f"Speedup: {per_peak / (t2 - t1):.1f}x")
+
+    # sanity check of the column-based results
+    m_raw, _ = xy_to_ma(model.peaks1.concat_column('read_density1'),
+                        model.peaks1.concat_column('read_density2'))
+    assert np.allclose(m_raw, model.peaks1.concat_column('m_raw'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+manorm.chroms
+-------------
+
+Registry of chromosome names shared by reads and genomic regions.
+"""
+
+
+class ChromRegistry:
+    """Registry which maps chromosome names to dense integer IDs.
+
+    Chromosome names are registered once when reads and genomic regions are
+    loaded. Reads and regions are then stored by the integer IDs, and the
+    names are only resolved back when results are reported.
+    """
+
+    def __init__(self):
+        self._ids = {}
+        self._names = []
+
+    def __len__(self):
+        return len(self._names)
+
+    def __contains__(self, name):
+        return name in self._ids
+
+    def register(self, name):
+        """Returns the ID of a chromosome, registering it if not seen yet.
+
+        Parameters
+        ----------
+        name : str
+            The chromosome name.
+
+        Returns
+        -------
+        int
+            The ID of the chromosome.
+        """
+        try:
+            return self._ids[name]
+        except KeyError:
+            chrom_id = self._ids[name] = len(self._names)
+            self._names.append(name)
+            return chrom_id
+
+    def lookup(self, name):
+        """Returns the ID of a registered chromosome, or None if the
+        chromosome has not been registered."""
+        return self._ids.get(name)
+
+    def name(self, chrom_id):
+        """Returns the name of the chromosome with given ID."""
+        return self._names[chrom_id]
+
+    def sort(self, chrom_ids):
+        """Sort chromosome IDs by the chromosome names.
+
+        Parameters
+        ----------
+        chrom_ids : iterable of int
+            The chromosome IDs to sort.
+
+        Returns
+        -------
+        list of int
+            Chromosome IDs sorted by their names.
+        """
+        return sorted(chrom_ids, key=self._names.__getitem__)
+
+
+# the registry shared by all reads and genomic regions
+registry = ChromRegistry()
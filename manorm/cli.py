@@ -12,14 +12,17 @@ from textwrap import dedent
 
 from manorm import __version__
 from manorm.io import mk_dir, write_all_peaks, write_original_peaks, \
-    write_biased_peaks, write_wiggle_track
+    write_biased_peaks, write_wiggle_track, write_window_results
 from manorm.logging import setup_logger
-from manorm.model import MAmodel
+from manorm.model import FITTERS, MAmodel
 from manorm.plot import plt_figures
-from manorm.read import READ_FORMATS, load_reads
+from manorm.read import READ_BACKENDS, READ_FORMATS, ReadStream, \
+    load_reads
+from manorm.read.cache import ReadCache
 from manorm.region import REGION_FORMATS, load_manorm_peaks
-from manorm.region.utils import random_peak_overlap, count_common_peaks, \
-    count_unique_peaks
+from manorm.region.utils import random_peak_overlap, \
+    expected_peak_overlap, count_common_peaks, count_unique_peaks, \
+    merge_peak_windows
 
 logger = logging.getLogger(__name__)
 
@@ -43,6 +46,33 @@ def _pos_int(value):
     return value_int
 
 
+def _size(value):
+    """Check whether a passed argument is a valid size in bytes, with an
+    optional K/M/G/T suffix."""
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+    try:
+        value_str = value.strip().upper().rstrip('B')
+        if value_str and value_str[-1] in units:
+            size = float(value_str[:-1]) * units[value_str[-1]]
+        else:
+            size = float(value_str)
+        if size <= 0:
+            raise ValueError
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid size value: {value!r}")
+    return int(size)
+
+
+def _ratio(numerator, denominator):
+    """Returns the ratio of two numbers, which is inf or nan (as NumPy does)
+    instead of raising an error if the denominator is 0."""
+    if denominator == 0:
+        if numerator == 0:
+            return float('nan')
+        return float('inf') if numerator > 0 else float('-inf')
+    return numerator / denominator
+
+
 def configure_parser():
     """Configure the arguments parser for MAnorm."""
     description = dedent("""
@@ -117,6 +147,47 @@ def configure_parser():
         help="Paired-end mode. The middle point of each read pair is used to "
              "represent the genomic locus of the DNA fragment. If specified, "
              "`--s1` and `--s2` will be ignored.")
+    parser_reads.add_argument(
+        "--threads", metavar="N", dest="threads", type=_pos_int, default=1,
+        help="Number of processes/threads to load reads. Indexed BAM files "
+             "are loaded contig by contig in parallel, other SAM/BAM files "
+             "are decompressed with `N` threads. Random simulations are also "
+             "run in `N` processes. Default: 1")
+    parser_reads.add_argument(
+        "--peak-reads-only", dest="peak_reads_only", action="store_true",
+        default=False,
+        help="Only load the reads around the peaks (within half of the "
+             "window size) from indexed BAM files through the BAM index. "
+             "Reads in other formats are fully loaded.")
+    parser_reads.add_argument(
+        "--read-backend", dest="read_backend", choices=READ_BACKENDS,
+        default="array",
+        help="How reads are stored in memory. `compact` stores sorted read "
+             "positions as delta-encoded blocks, which takes 2-4x less "
+             "memory than plain arrays (`array`) at a small cost of counting "
+             "speed. Default: array")
+    parser_reads.add_argument(
+        "--sorted", dest="sorted", action="store_true", default=False,
+        help="Read files are sorted by coordinate. If specified, reads are "
+             "counted in a single streaming pass without being loaded into "
+             "memory, and `--peak-reads-only` and the read cache are not "
+             "used. Unsorted read files are detected and loaded into memory "
+             "as usual.")
+    parser_reads.add_argument(
+        "--read-cache", metavar="DIR", dest="read_cache", default=None,
+        help="Cache directory of the parsed reads. If specified, parsed reads "
+             "are cached and reused by later runs with the same read file "
+             "and options. Default: disabled")
+    parser_reads.add_argument(
+        "--read-cache-size", metavar="SIZE", dest="read_cache_size",
+        type=_size, default="10G",
+        help="Maximum size of the read cache, the least recently used "
+             "entries are evicted beyond this size. Default: 10G")
+    parser_reads.add_argument(
+        "--read-cache-checksum", dest="read_cache_checksum",
+        action="store_true", default=False,
+        help="Identify cached read files by the checksum of their content "
+             "instead of the modification time.")
 
     parser_model = parser.add_argument_group("Normalization Model Options")
     parser_model.add_argument(
@@ -125,6 +196,15 @@ def configure_parser():
         help="Window size to count reads and calculate read densities. Set to "
              "2000 is recommended for sharp histone marks like H3K4me3 or "
              "H3K27ac and 1000 for TFs or DNase-seq. Default: 2000")
+    parser_model.add_argument(
+        "--extra-windows", metavar="LENGTH", dest="extra_windows",
+        nargs="+", type=_pos_int, default=None,
+        help="Additional window sizes to count reads in the same pass and "
+             "fit a separate M-A model for. The results of each window size "
+             "and a summary of the model fit quality are written into "
+             "`output_windows`, which helps to choose the window size in a "
+             "single run. The main results always use `--window-size`. "
+             "Default: not set")
     parser_model.add_argument(
         "--summit-dis", metavar="DISTANCE", dest="summit_dis_cutoff",
         type=_pos_int,
@@ -136,6 +216,37 @@ def configure_parser():
         help="Number of random simulations to test the enrichment of peak "
              "overlap between the specified samples. Set to 0 to disable the "
              "testing. Default: 10")
+    parser_model.add_argument(
+        "--fitter", dest="fitter", default="builtin", choices=FITTERS,
+        help="Estimator of the robust M-A linear model. `builtin` is a "
+             "NumPy implementation of the Huber regression, `sklearn` uses "
+             "scikit-learn's HuberRegressor, which needs scikit-learn to be "
+             "installed. Default: builtin")
+    parser_model.add_argument(
+        "--fit-subsample", metavar="SIZE", dest="fit_subsample",
+        type=_pos_int, default=None,
+        help="Fit the M-A model on a random subsample of `SIZE` common "
+             "peaks stratified by A values, which is doubled until the "
+             "slope and intercept change no more than `--fit-tol`. "
+             "Recommended for very large common peak sets. Default: fit on "
+             "all common peaks")
+    parser_model.add_argument(
+        "--fit-tol", metavar="FLOAT", dest="fit_tol", type=float,
+        default=0.005,
+        help="Tolerance of the coefficient change to stop growing the "
+             "subsample of `--fit-subsample`. Default: 0.005")
+    parser_model.add_argument(
+        "--overlap-test", dest="overlap_test", default="simulation",
+        choices=["simulation", "analytic"],
+        help="Method to test the enrichment of peak overlap. `simulation` "
+             "counts the overlaps with random peaks in `--n-random` "
+             "simulations, `analytic` computes the expected overlap and its "
+             "variance in closed form, which is much faster for large peak "
+             "sets. Default: simulation")
+    parser_model.add_argument(
+        "--seed", metavar="INT", dest="seed", type=int, default=None,
+        help="Random seed of the simulations and the subsampled fitting, "
+             "set it to get reproducible results. Default: not set")
 
     parser_output = parser.add_argument_group("Output Options")
     parser_output.add_argument(
@@ -155,6 +266,11 @@ def configure_parser():
         default=False,
         help="Write two extra output files containing the results of the "
              "original (unmerged) peaks.")
+    parser_output.add_argument(
+        "--unclamped-p", dest="unclamped_p", action="store_true",
+        default=False,
+        help="Add a column of the unclamped -log10(P value) to the output "
+             "M-A value files. P values are floored at exp(-500) otherwise.")
 
     parser.add_argument(
         "--verbose", dest="verbose", action="store_true", default=False,
@@ -168,6 +284,8 @@ def preprocess_args(args):
     args.peak_file2 = os.path.abspath(args.peak_file2)
     args.read_file1 = os.path.abspath(args.read_file1)
     args.read_file2 = os.path.abspath(args.read_file2)
+    if args.read_cache:
+        args.read_cache = os.path.abspath(args.read_cache)
     args.summit_dis_cutoff = args.summit_dis_cutoff or args.window_size // 4
     args.name1 = args.name1 or os.path.splitext(
         os.path.basename(args.peak_file1))[0]
@@ -194,9 +312,27 @@ def log_args(args):
         logger.info("Paired-end mode: on")
     else:
         logger.info("Paired-end mode: off")
+    logger.info(f"Threads to load reads = {args.threads}")
+    logger.info(f"Read backend = {args.read_backend}")
+    if args.sorted:
+        logger.info("Stream sorted reads: on")
+    elif args.peak_reads_only:
+        logger.info("Load reads around peaks only: on")
+    if args.read_cache:
+        logger.info(f"Read cache = {args.read_cache} "
+                    f"[max size: {args.read_cache_size:,} bytes]")
     logger.info(f"Window size = {args.window_size}")
+    if args.extra_windows:
+        logger.info(f"Extra window sizes = "
+                    f"{', '.join(map(str, args.extra_windows))}")
     logger.info(f"Summit distance cutoff = {args.summit_dis_cutoff}")
+    logger.info(f"M-A model fitter = {args.fitter}")
+    if args.fit_subsample:
+        logger.info(f"Fit on subsamples of common peaks: initial size = "
+                    f"{args.fit_subsample}, tolerance = {args.fit_tol}")
     logger.info(f"Number of random simulation = {args.n_random}")
+    logger.info(f"Overlap enrichment test = {args.overlap_test}")
+    logger.info(f"Random seed = {args.seed}")
     logger.info(f"M-value cutoff = {args.m_cutoff}")
     logger.info(f"P-value cutoff = {args.p_cutoff}")
     logger.info(f"Output directory = {args.output_dir}")
@@ -210,14 +346,37 @@ def load_input_data(args):
     logger.info("Loading peaks of sample 2")
     peaks2 = load_manorm_peaks(path=args.peak_file2, format=args.peak_format,
                                name=args.name2)
+    if args.sorted:
+        logger.info("Reads of both samples will be streamed while counting")
+        reads1 = ReadStream(path=args.read_file1, format=args.read_format,
+                            paired=args.paired, shift=args.shift_size1,
+                            name=args.name1, threads=args.threads,
+                            backend=args.read_backend)
+        reads2 = ReadStream(path=args.read_file2, format=args.read_format,
+                            paired=args.paired, shift=args.shift_size2,
+                            name=args.name2, threads=args.threads,
+                            backend=args.read_backend)
+        return peaks1, peaks2, reads1, reads2
+    if args.read_cache:
+        cache = ReadCache(args.read_cache, max_size=args.read_cache_size,
+                          checksum=args.read_cache_checksum)
+    else:
+        cache = None
+    if args.peak_reads_only:
+        window_size = max([args.window_size] + (args.extra_windows or []))
+        regions = merge_peak_windows(peaks1, peaks2, window_size)
+    else:
+        regions = None
     logger.info("Loading reads of sample 1")
     reads1 = load_reads(path=args.read_file1, format=args.read_format,
                         paired=args.paired, shift=args.shift_size1,
-                        name=args.name1)
+                        name=args.name1, cache=cache, threads=args.threads,
+                        regions=regions, backend=args.read_backend)
     logger.info("Loading reads of sample 2")
     reads2 = load_reads(path=args.read_file2, format=args.read_format,
                         paired=args.paired, shift=args.shift_size2,
-                        name=args.name2)
+                        name=args.name2, cache=cache, threads=args.threads,
+                        regions=regions, backend=args.read_backend)
     return peaks1, peaks2, reads1, reads2
 
 
@@ -225,9 +384,10 @@ def output(args, ma_model):
     """Write output files and report stats."""
     mk_dir(args.output_dir)
     if args.write_all:
-        write_original_peaks(args.output_dir, ma_model.peaks1, ma_model.peaks2)
+        write_original_peaks(args.output_dir, ma_model.peaks1, ma_model.peaks2,
+                             unclamped_p=args.unclamped_p)
     write_all_peaks(args.output_dir, ma_model.peaks1, ma_model.peaks2,
-                    ma_model.peaks_merged)
+                    ma_model.peaks_merged, unclamped_p=args.unclamped_p)
     write_wiggle_track(args.output_dir, ma_model.peaks1, ma_model.peaks2,
                        ma_model.peaks_merged)
     num_biased1, num_biased2, num_unbiased = write_biased_peaks(
@@ -235,6 +395,11 @@ def output(args, ma_model):
         ma_model.peaks_merged, args.m_cutoff, args.p_cutoff)
     plt_figures(args.output_dir, ma_model.peaks1, ma_model.peaks2,
                 ma_model.peaks_merged, ma_model.ma_params)
+    if len(ma_model.window_results) > 1:
+        write_window_results(args.output_dir, ma_model.peaks1,
+                             ma_model.peaks2, ma_model.peaks_merged,
+                             ma_model.window_results, args.m_cutoff,
+                             args.p_cutoff, unclamped_p=args.unclamped_p)
 
     # report stats
     logger.info("==== Stats ====")
@@ -242,6 +407,8 @@ def output(args, ma_model):
         read_type_str = 'read pairs'
     else:
         read_type_str = 'single-end reads'
+    if args.peak_reads_only and not args.sorted:
+        read_type_str += ' around peaks'
     logger.info(f"Total {read_type_str} of sample 1: {ma_model.reads1.size:,}")
     logger.info(f"Total {read_type_str} of sample 2: {ma_model.reads2.size:,}")
     logger.info(
@@ -277,18 +444,40 @@ def run(args):
     ma_model.process_peaks()
 
     logger.info("Step 3: Testing the enrichment of peak overlap")
-    if args.n_random > 0:
-        mean, std = random_peak_overlap(peaks1, peaks2, args.n_random)
-        fc = count_common_peaks(ma_model.peaks1) / mean
+    if args.overlap_test == 'analytic':
+        n_common = count_common_peaks(ma_model.peaks1)
+        mean, std = expected_peak_overlap(peaks1, peaks2)
+        logger.info(f"Expected number of overlapping peaks in random: "
+                    f"mean={mean:.2f} std={std:.2f}")
+        logger.info(f"Fold change compared to random: "
+                    f"{_ratio(n_common, mean):.2f}")
+        logger.info(f"Z score of the overlap enrichment: "
+                    f"{_ratio(n_common - mean, std):.2f}")
+    elif args.n_random > 0:
+        n_overlap_rand = random_peak_overlap(
+            peaks1, peaks2, args.n_random, seed=args.seed,
+            processes=args.threads)
+        n_common = count_common_peaks(ma_model.peaks1)
+        mean = n_overlap_rand.mean()
+        std = n_overlap_rand.std()
         logger.info(f"Number of overlapping peaks in random: mean={mean:.2f} "
-                    f"std={std:.2f}")
-        logger.info(f"Fold change compared to random: {fc:.2f}")
+                    f"std={std:.2f} min={n_overlap_rand.min()} "
+                    f"max={n_overlap_rand.max()}")
+        logger.info(f"Fold change compared to random: "
+                    f"{_ratio(n_common, mean):.2f}")
+        n_extreme = int((n_overlap_rand >= n_common).sum())
+        p_value = (n_extreme + 1) / (args.n_random + 1)
+        logger.info(f"Empirical P value of the overlap enrichment: "
+                    f"{p_value:.3g}")
     else:
         logger.info("Skipped")
 
     logger.info("Step 4: Fitting M-A normalization model on common peaks")
     ma_model.fit_model(window_size=args.window_size,
-                       summit_dis_cutoff=args.summit_dis_cutoff)
+                       summit_dis_cutoff=args.summit_dis_cutoff,
+                       fitter=args.fitter, subsample=args.fit_subsample,
+                       tol=args.fit_tol, seed=args.seed,
+                       extra_window_sizes=args.extra_windows or ())
 
     logger.info("Step 5: Normalizing all peaks")
     ma_model.normalize()
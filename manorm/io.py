@@ -7,7 +7,11 @@ This module contains the input/output related functions.
 
 import os
 from collections import defaultdict
-from math import log10
+
+import numpy as np
+
+from manorm.chroms import registry
+from manorm.stats import MIN_LOG_P
 
 
 def mk_dir(root_dir):
@@ -21,79 +25,207 @@ def mk_dir(root_dir):
             os.makedirs(sub_dir)
 
 
-def _get_unique_and_merged_peaks(peaks1, peaks2, peaks_merged):
-    peaks = []
-    peak_groups = []
-    for chrom in peaks1.chroms:
-        for peak in peaks1.fetch(chrom):
-            if not peak.iscommon:
-                peaks.append(peak)
-                peak_groups.append(peaks1.name + '_unique')
-    for chrom in peaks_merged.chroms:
-        for peak in peaks_merged.fetch(chrom):
-            peaks.append(peak)
-            peak_groups.append('merged_common')
-    for chrom in peaks2.chroms:
-        for peak in peaks2.fetch(chrom):
-            if not peak.iscommon:
-                peaks.append(peak)
-                peak_groups.append(peaks2.name + '_unique')
-    return peaks, peak_groups
-
-
-def write_original_peaks(root_dir, peaks1, peaks2):
-    sample_names = [peaks1.name, peaks2.name]
-    peaks = [peaks1, peaks2]
+# the peak columns written into the output files
+_OUTPUT_COLUMNS = ('start', 'end', 'summit', 'm_normed', 'a_normed',
+                   'p_value', 'read_density1_normed', 'read_density2_normed')
+
+
+def _peak_table(peaks, iscommon=None, columns=None):
+    """Returns the output columns of the peaks concatenated over chromosomes,
+    keeping only the common (`iscommon` = True) or unique (False) peaks if
+    specified. Columns in `columns`, which are concatenated over chromosomes
+    in the order of `peaks.chroms`, take the place of the peak columns."""
+    names = ('chrom_id', 'iscommon', 'log_p_value') + _OUTPUT_COLUMNS
+    columns = columns or {}
+    parts = {name: [] for name in names}
+    head = 0
+    for chrom in peaks.chroms:
+        chrom_columns = {name: peaks.column(chrom, name)
+                         for name in _OUTPUT_COLUMNS}
+        chrom_columns['log_p_value'] = peaks.column(chrom, 'log_p_value')
+        chrom_columns['iscommon'] = peaks.column(chrom,
+                                                 'iscommon').astype(bool)
+        tail = head + chrom_columns['start'].size
+        for name, values in columns.items():
+            if name in chrom_columns:
+                chrom_columns[name] = values[head:tail]
+        head = tail
+        chrom_columns['chrom_id'] = np.full(chrom_columns['start'].size,
+                                            registry.lookup(chrom))
+        if iscommon is not None:
+            mask = chrom_columns['iscommon'] == iscommon
+            chrom_columns = {name: values[mask]
+                             for name, values in chrom_columns.items()}
+        for name in names:
+            parts[name].append(chrom_columns[name])
+    return {name: np.concatenate(values) if values else
+            np.array([], dtype=np.int64) for name, values in parts.items()}
+
+
+def _concat_tables(tables):
+    return {name: np.concatenate([table[name] for table in tables])
+            for name in tables[0]}
+
+
+def _rows(table, names):
+    """Iterate over the rows of the peak table as Python values."""
+    return zip(*(table[name].tolist() for name in names))
 
+
+def _neg_log10_p(log_p_values, clamp=True):
+    """Convert natural-log P values into -log10 P values, with the same floor
+    as the P values if `clamp` is True."""
+    if clamp:
+        log_p_values = np.maximum(log_p_values, MIN_LOG_P)
+    return -log_p_values / np.log(10)
+
+
+def _get_unique_and_merged_peaks(peaks1, peaks2, peaks_merged, tables=None):
+    """Returns the table of the unique and merged common peaks and their peak
+    groups. The columns in `tables` of peaks1, peaks2 and merged peaks take
+    the place of the peak columns if specified."""
+    columns1, columns2, columns_merged = tables or (None, None, None)
+    tables = [_peak_table(peaks1, iscommon=False, columns=columns1),
+              _peak_table(peaks_merged, columns=columns_merged),
+              _peak_table(peaks2, iscommon=False, columns=columns2)]
+    peak_groups = [peaks1.name + '_unique'] * tables[0]['start'].size + \
+        ['merged_common'] * tables[1]['start'].size + \
+        [peaks2.name + '_unique'] * tables[2]['start'].size
+    return _concat_tables(tables), peak_groups
+
+
+def _header(peaks1, peaks2, unclamped_p=False):
     header = f"chr\tstart\tend\tsummit\tM_value\tA_value\tP_value\t" \
              f"Peak_Group\tnormalized_read_density_in_{peaks1.name}\t" \
-             f"normalized_read_density_in_{peaks2.name}\n"
+             f"normalized_read_density_in_{peaks2.name}"
+    if unclamped_p:
+        header += "\t-log10(P_value)"
+    return header + "\n"
+
+
+def _extra_columns(table, unclamped_p=False):
+    """Returns the formatted optional columns of each peak."""
+    if not unclamped_p:
+        return [''] * table['start'].size
+    return [f"\t{value:.5f}" for value in
+            _neg_log10_p(table['log_p_value'], clamp=False).tolist()]
+
+
+def write_original_peaks(root_dir, peaks1, peaks2, unclamped_p=False):
+    sample_names = [peaks1.name, peaks2.name]
+    peaks = [peaks1, peaks2]
+
+    header = _header(peaks1, peaks2, unclamped_p)
 
     for temp_name, temp_peaks in zip(sample_names, peaks):
         temp_file = os.path.join(root_dir, temp_name + '_MAvalues.xls')
+        table = _peak_table(temp_peaks)
         with open(temp_file, 'w') as fout:
             fout.write(header)
-            for chrom in temp_peaks.chroms:
-                for peak in temp_peaks.fetch(chrom):
-                    if peak.iscommon:
-                        peak_group = temp_name + "_common"
-                    else:
-                        peak_group = temp_name + "_unique"
-                    fout.write(
-                        f"{peak.chrom}\t{peak.start + 1}\t{peak.end}\t"
-                        f"{peak.summit + 1}\t{peak.m_normed:.5f}\t"
-                        f"{peak.a_normed:.5f}\t{peak.p_value}\t{peak_group}\t"
-                        f"{peak.read_density1_normed:.5f}\t"
-                        f"{peak.read_density2_normed:.5f}\n")
-
-
-def write_all_peaks(root_dir, peaks1, peaks2, peaks_merged):
-    peaks, peak_groups = _get_unique_and_merged_peaks(peaks1, peaks2,
-                                                      peaks_merged)
-    header = f"chr\tstart\tend\tsummit\tM_value\tA_value\tP_value\t" \
-             f"Peak_Group\tnormalized_read_density_in_{peaks1.name}\t" \
-             f"normalized_read_density_in_{peaks2.name}\n"
-    path = os.path.join(
-        root_dir, peaks1.name + '_vs_' + peaks2.name + '_all_MAvalues.xls')
+            for (chrom_id, iscommon, start, end, summit, m_value, a_value,
+                 p_value, density1, density2), extra in zip(_rows(
+                    table, ('chrom_id', 'iscommon') + _OUTPUT_COLUMNS),
+                    _extra_columns(table, unclamped_p)):
+                if iscommon:
+                    peak_group = temp_name + "_common"
+                else:
+                    peak_group = temp_name + "_unique"
+                fout.write(
+                    f"{registry.name(chrom_id)}\t{start + 1}\t{end}\t"
+                    f"{summit + 1}\t{m_value:.5f}\t"
+                    f"{a_value:.5f}\t{p_value}\t{peak_group}\t"
+                    f"{density1:.5f}\t{density2:.5f}{extra}\n")
+
+
+def _write_ma_values(path, header, table, peak_groups, unclamped_p=False):
     with open(path, 'w') as fout:
         fout.write(header)
-        for peak, peak_group in zip(peaks, peak_groups):
+        for (chrom_id, start, end, summit, m_value, a_value, p_value,
+             density1, density2), peak_group, extra in zip(
+                _rows(table, ('chrom_id',) + _OUTPUT_COLUMNS), peak_groups,
+                _extra_columns(table, unclamped_p)):
             fout.write(
-                f"{peak.chrom}\t{peak.start + 1}\t{peak.end}\t"
-                f"{peak.summit + 1}\t{peak.m_normed:.5f}\t"
-                f"{peak.a_normed:.5f}\t{peak.p_value}\t{peak_group}\t"
-                f"{peak.read_density1_normed:.5f}\t"
-                f"{peak.read_density2_normed:.5f}\n")
+                f"{registry.name(chrom_id)}\t{start + 1}\t{end}\t"
+                f"{summit + 1}\t{m_value:.5f}\t"
+                f"{a_value:.5f}\t{p_value}\t{peak_group}\t"
+                f"{density1:.5f}\t{density2:.5f}{extra}\n")
+
+
+def write_all_peaks(root_dir, peaks1, peaks2, peaks_merged,
+                    unclamped_p=False):
+    table, peak_groups = _get_unique_and_merged_peaks(peaks1, peaks2,
+                                                      peaks_merged)
+    header = _header(peaks1, peaks2, unclamped_p)
+    path = os.path.join(
+        root_dir, peaks1.name + '_vs_' + peaks2.name + '_all_MAvalues.xls')
+    _write_ma_values(path, header, table, peak_groups, unclamped_p)
+
+
+def write_window_results(root_dir, peaks1, peaks2, peaks_merged,
+                         window_results, m_cutoff, p_cutoff,
+                         unclamped_p=False):
+    """Write the results of the M-A models fitted with different window
+    sizes into the `output_windows` directory.
+
+    For each window size, the normalized values of the unique and merged
+    common peaks are written in the format of the `all_MAvalues` file. A
+    summary table compares the window sizes by the fitted parameters, the
+    fit quality and the number of biased peaks.
+
+    Parameters
+    ----------
+    root_dir : str
+        The output directory.
+    peaks1, peaks2, peaks_merged : `ManormPeaks`
+        The peaks of sample 1, sample 2 and the merged common peaks.
+    window_results : dict
+        The results of each window size, see `MAmodel.window_results`.
+    m_cutoff : float
+        Absolute M value cutoff of the biased peaks.
+    p_cutoff : float
+        P value cutoff of the biased peaks.
+    unclamped_p : bool, optional
+        Whether to write the unclamped -log10 P values, default=False.
+    """
+    output_dir = os.path.join(root_dir, 'output_windows')
+    os.makedirs(output_dir, exist_ok=True)
+    output_prefix = peaks1.name + '_vs_' + peaks2.name
+    header = _header(peaks1, peaks2, unclamped_p)
+    m_cutoff = abs(m_cutoff)
+    path_summary = os.path.join(output_dir,
+                                output_prefix + '_window_summary.xls')
+    with open(path_summary, 'w') as fout_summary:
+        fout_summary.write("window_size\tfitted_peaks\tslope\tintercept\t"
+                           "residual_MAD\tpearson_r\tbiased_peaks\n")
+        for window_size in sorted(window_results):
+            result = window_results[window_size]
+            table, peak_groups = _get_unique_and_merged_peaks(
+                peaks1, peaks2, peaks_merged, tables=result['tables'])
+            path = os.path.join(
+                output_dir,
+                f"{output_prefix}_window_{window_size}_all_MAvalues.xls")
+            _write_ma_values(path, header, table, peak_groups, unclamped_p)
+            num_biased = int(np.count_nonzero(
+                (np.abs(table['m_normed']) >= m_cutoff) &
+                (table['p_value'] <= p_cutoff)))
+            intercept, slope = result['params']
+            quality = result['quality']
+            fout_summary.write(
+                f"{window_size}\t{quality['num_peaks']}\t{slope:.5f}\t"
+                f"{intercept:.5f}\t{quality['residual_mad']:.5f}\t"
+                f"{quality['pearson_r']:.5f}\t{num_biased}\n")
 
 
 def write_wiggle_track(root_dir, peaks1, peaks2, peaks_merged):
-    peaks, _ = _get_unique_and_merged_peaks(peaks1, peaks2, peaks_merged)
+    table, _ = _get_unique_and_merged_peaks(peaks1, peaks2, peaks_merged)
+    table['neg_log10_p'] = _neg_log10_p(table['log_p_value'])
     tracks = defaultdict(list)
-    for peak in peaks:
-        tracks[peak.chrom].append((peak.summit + 1, peak.m_normed,
-                                   peak.a_normed, peak.p_value))
-    for chrom in tracks:
-        tracks[chrom].sort(key=lambda x: x[0])
+    for chrom_id, summit, m_value, a_value, neg_log10_p in _rows(
+            table, ('chrom_id', 'summit', 'm_normed', 'a_normed',
+                    'neg_log10_p')):
+        tracks[chrom_id].append((summit + 1, m_value, a_value, neg_log10_p))
+    for chrom_id in tracks:
+        tracks[chrom_id].sort(key=lambda x: x[0])
 
     # write tracks for M values, A values and P values
     output_prefix = peaks1.name + '_vs_' + peaks2.name
@@ -117,22 +249,23 @@ def write_wiggle_track(root_dir, peaks1, peaks2, peaks_merged):
             f"track type=wiggle_0 name={output_prefix}_-log10(P_value) "
             f"visibility=full autoScale=on color=255,0,0 yLineMark=0 "
             f"yLineOnOff=on priority=10\n")
-        for chrom in tracks:
-            if len(tracks[chrom]) == 0:
+        for chrom_id in tracks:
+            if len(tracks[chrom_id]) == 0:
                 continue
+            chrom = registry.name(chrom_id)
             fout_m.write(f"variableStep chrom={chrom} span=100\n")
             fout_a.write(f"variableStep chrom={chrom} span=100\n")
             fout_p.write(f"variableStep chrom={chrom} span=100\n")
-            for summit, m_value, a_value, p_value in tracks[chrom]:
+            for summit, m_value, a_value, neg_log10_p in tracks[chrom_id]:
                 fout_m.write(f"{summit}\t{m_value:.5f}\n")
                 fout_a.write(f"{summit}\t{a_value:.5f}\n")
-                fout_p.write(f"{summit}\t{-log10(p_value)}\n")
+                fout_p.write(f"{summit}\t{neg_log10_p}\n")
 
 
 def write_biased_peaks(root_dir, peaks1, peaks2, peaks_merged, m_cutoff,
                        p_cutoff):
     m_cutoff = abs(m_cutoff)
-    peaks, peak_groups = _get_unique_and_merged_peaks(peaks1, peaks2,
+    table, peak_groups = _get_unique_and_merged_peaks(peaks1, peaks2,
                                                       peaks_merged)
     output_prefix = peaks1.name + '_vs_' + peaks2.name
     path_biased1 = os.path.join(root_dir, 'output_filters', output_prefix
@@ -145,17 +278,19 @@ def write_biased_peaks(root_dir, peaks1, peaks2, peaks_merged, m_cutoff,
     with open(path_biased1, 'w') as fout_biased1, \
             open(path_biased2, 'w') as fout_biased2, \
             open(path_unbiased, 'w') as fout_unbiased:
-        for peak, peak_group in zip(peaks, peak_groups):
-            line = f"{peak.chrom}\t{peak.start}\t{peak.end}\t{peak_group}\t" \
-                   f"{peak.m_normed:.5f}\n"
-            if abs(peak.m_normed) < m_cutoff:
+        for (chrom_id, start, end, m_value, p_value), peak_group in zip(
+                _rows(table, ('chrom_id', 'start', 'end', 'm_normed',
+                              'p_value')), peak_groups):
+            line = f"{registry.name(chrom_id)}\t{start}\t{end}\t" \
+                   f"{peak_group}\t{m_value:.5f}\n"
+            if abs(m_value) < m_cutoff:
                 num_unbiased += 1
                 fout_unbiased.write(line)
-            elif peak.p_value <= p_cutoff:
-                if peak.m_normed >= m_cutoff:
+            elif p_value <= p_cutoff:
+                if m_value >= m_cutoff:
                     num_biased1 += 1
                     fout_biased1.write(line)
-                elif peak.m_normed <= -m_cutoff:
+                elif m_value <= -m_cutoff:
                     num_biased2 += 1
                     fout_biased2.write(line)
     return num_biased1, num_biased2, num_unbiased
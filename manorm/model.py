@@ -5,11 +5,127 @@ manorm.model
 This module contains the core MAnorm model.
 """
 
+import logging
+
 import numpy as np
-from sklearn.linear_model import HuberRegressor
 
 from manorm.exceptions import ProcessNotReadyError
 from manorm.region.utils import classify_peaks_by_overlap, merge_common_peaks
+from manorm.stats import MIN_LOG_P, xy_to_ma, ma_to_xy, \
+    manorm_log_p_array, huber_fit
+
+FITTERS = ['builtin', 'sklearn']
+
+logger = logging.getLogger(__name__)
+
+
+def _fit_ma(a_values, m_values, fitter='builtin'):
+    """Fit the robust M-A line, returns the intercept and slope."""
+    if fitter == 'sklearn':
+        from sklearn.linear_model import HuberRegressor
+        huber = HuberRegressor()
+        huber.fit(a_values.reshape(-1, 1), m_values)
+        return huber.intercept_, huber.coef_[0]
+    return huber_fit(a_values, m_values)
+
+
+def _stratified_order(a_values, rng, n_strata=20):
+    """Returns a random order of the peaks, of which every prefix is a
+    subsample stratified by A values.
+
+    Peaks are grouped into `n_strata` equal-sized strata by A values and
+    shuffled within each stratum, then drawn from the strata in turn.
+    """
+    size = a_values.size
+    strata = np.empty(size, dtype=np.int64)
+    strata[np.argsort(a_values, kind='stable')] = \
+        np.arange(size) * n_strata // size
+    shuffled = rng.permutation(size)
+    grouped = shuffled[np.argsort(strata[shuffled], kind='stable')]
+    counts = np.bincount(strata, minlength=n_strata)
+    ranks = np.arange(size) - np.repeat(np.cumsum(counts) - counts, counts)
+    keys = ranks * n_strata + strata[grouped]
+    return grouped[np.argsort(keys, kind='stable')]
+
+
+def _fit_ma_subsample(a_values, m_values, fitter='builtin', size=10000,
+                      tol=5e-3, seed=None):
+    """Fit the robust M-A line on growing subsamples stratified by A values.
+
+    The model is first fitted on `size` peaks, then the subsample is doubled
+    until the slope and intercept change no more than `tol`.
+
+    Returns
+    -------
+    params : tuple of float
+        The intercept and slope.
+    size : int
+        The final subsample size.
+    change : float or None
+        The change of the coefficients in the last step, or None if all
+        peaks are fitted at once.
+    """
+    if size >= a_values.size:
+        return _fit_ma(a_values, m_values, fitter), a_values.size, None
+    order = _stratified_order(a_values, np.random.default_rng(seed))
+    params = _fit_ma(a_values[order[:size]], m_values[order[:size]], fitter)
+    change = None
+    while size < a_values.size:
+        size = min(size * 2, a_values.size)
+        params_new = _fit_ma(a_values[order[:size]], m_values[order[:size]],
+                             fitter)
+        change = max(abs(params_new[0] - params[0]),
+                     abs(params_new[1] - params[1]))
+        params = params_new
+        if change <= tol:
+            break
+    return params, size, change
+
+
+def _count_table(read_count1, read_count2, window_size):
+    """Returns the read counts, read densities and raw (M, A) values of the
+    peaks given the reads counted in windows of `window_size`."""
+    extend = window_size // 2
+    read_count1 = read_count1 + 1
+    read_count2 = read_count2 + 1
+    read_density1 = read_count1 * 1000 / (extend * 2)
+    read_density2 = read_count2 * 1000 / (extend * 2)
+    m_raw, a_raw = xy_to_ma(read_density1, read_density2)
+    return {'read_count1': read_count1, 'read_count2': read_count2,
+            'read_density1': read_density1, 'read_density2': read_density2,
+            'm_raw': m_raw, 'a_raw': a_raw}
+
+
+def _normalize_table(table, intercept, slope):
+    """Returns the normalized values and P values of the peaks given the raw
+    (M, A) values in the table and the fitted M-A model."""
+    m_normed = table['m_raw'] - (slope * table['a_raw'] + intercept)
+    x_normed, y_normed = ma_to_xy(m_normed, table['a_raw'])
+    log_p = manorm_log_p_array(x_normed, y_normed)
+    return {'m_normed': m_normed, 'a_normed': table['a_raw'],
+            'read_density1_normed': x_normed,
+            'read_density2_normed': y_normed, 'log_p_value': log_p,
+            'p_value': np.exp(np.maximum(log_p, MIN_LOG_P))}
+
+
+def _fit_quality(table, mask, intercept, slope):
+    """Returns the statistics of the M-A model fitted on the masked peaks:
+    the number of peaks, the robust (MAD) scale of the residuals and the
+    Pearson correlation of the log read densities."""
+    m_values = table['m_raw'][mask]
+    a_values = table['a_raw'][mask]
+    residuals = m_values - (slope * a_values + intercept)
+    if residuals.size < 2:
+        return {'num_peaks': int(residuals.size), 'residual_mad': np.nan,
+                'pearson_r': np.nan}
+    mad = 1.4826 * np.median(np.abs(residuals - np.median(residuals)))
+    # M and A are linear in log2 x and log2 y
+    log_x = a_values + m_values / 2
+    log_y = a_values - m_values / 2
+    with np.errstate(invalid='ignore', divide='ignore'):
+        pearson_r = np.corrcoef(log_x, log_y)[0, 1]
+    return {'num_peaks': int(residuals.size), 'residual_mad': float(mad),
+            'pearson_r': float(pearson_r)}
 
 
 class MAmodel(object):
@@ -20,6 +136,7 @@ class MAmodel(object):
         self.reads1 = reads1
         self.reads2 = reads2
         self.ma_params = None
+        self.window_results = {}
         self.processed = False
         self.fitted = False
         self.normalized = False
@@ -31,36 +148,132 @@ class MAmodel(object):
         self.peaks_merged = merge_common_peaks(self.peaks1, self.peaks2)
         self.processed = True
 
-    def _count_reads(self, window_size=2000):
-        """Calculate m values and a values of peaks."""
-        for chrom in self.peaks1.chroms:
-            for peak in self.peaks1.fetch(chrom):
-                peak.count_reads(self.reads1, self.reads2, window_size)
-        for chrom in self.peaks2.chroms:
-            for peak in self.peaks2.fetch(chrom):
-                peak.count_reads(self.reads1, self.reads2, window_size)
-        for chrom in self.peaks_merged.chroms:
-            for peak in self.peaks_merged.fetch(chrom):
-                peak.count_reads(self.reads1, self.reads2, window_size)
-
-    def fit_model(self, window_size=2000, summit_dis_cutoff=500):
-        """Fit M-A normalization model."""
+    def _count_reads(self, window_sizes=(2000,)):
+        """Count reads in the windows of given sizes around the summits of
+        all peaks in a single pass over the reads.
+
+        Returns
+        -------
+        list of list of dict
+            The count tables (see `_count_table`) of each peak set (peaks1,
+            peaks2 and merged peaks) for each window size. The columns are
+            concatenated over chromosomes in the order of `chroms`.
+        """
+        for window_size in window_sizes:
+            if window_size <= 0:
+                raise ValueError(f"expect window size > 0, got {window_size}")
+        peak_sets = (self.peaks1, self.peaks2, self.peaks_merged)
+        summits = {}
+        for peaks in peak_sets:
+            for chrom in peaks.chroms:
+                summits.setdefault(chrom, []).append(
+                    peaks.column(chrom, 'summit').astype(np.int64))
+        # windows of all sizes are laid out one size after another
+        windows = {}
+        for chrom, arrays in summits.items():
+            chrom_summits = np.concatenate(arrays)
+            extends = [window_size // 2 for window_size in window_sizes]
+            windows[chrom] = (
+                np.concatenate([chrom_summits - extend for extend in extends]),
+                np.concatenate([chrom_summits + extend for extend in extends]))
+        # count all peaks at once, so that streamed reads are read only once
+        counts1 = self.reads1.count_windows(windows)
+        counts2 = self.reads2.count_windows(windows)
+        sizes = {chrom: windows[chrom][0].size // len(window_sizes)
+                 for chrom in windows}
+        offsets = dict.fromkeys(windows, 0)
+        tables = [[] for _ in window_sizes]
+        for peaks in peak_sets:
+            slices = []
+            for chrom in peaks.chroms:
+                head = offsets[chrom]
+                num_peaks = len(peaks.column(chrom, 'summit'))
+                tail = offsets[chrom] = head + num_peaks
+                slices.append((chrom, head, tail))
+            for idx, window_size in enumerate(window_sizes):
+                parts1 = [np.array([], dtype=np.int64)]
+                parts2 = [np.array([], dtype=np.int64)]
+                for chrom, head, tail in slices:
+                    shift = idx * sizes[chrom]
+                    parts1.append(counts1[chrom][shift + head:shift + tail])
+                    parts2.append(counts2[chrom][shift + head:shift + tail])
+                tables[idx].append(_count_table(np.concatenate(parts1),
+                                                np.concatenate(parts2),
+                                                window_size))
+        return tables
+
+    def _fit(self, a_values, m_values, fitter, subsample, tol, seed,
+             window_size):
+        """Fit the M-A model on the given peaks, returns the intercept and
+        slope."""
+        if subsample is None:
+            return list(_fit_ma(a_values, m_values, fitter))
+        params, size, change = _fit_ma_subsample(
+            a_values, m_values, fitter=fitter, size=subsample, tol=tol,
+            seed=seed)
+        if change is None:
+            logger.info(f"Fitted the M-A model of window size {window_size} "
+                        f"on all {size:,} peaks")
+        elif change <= tol and size < a_values.size:
+            logger.info(f"Fitted the M-A model of window size {window_size} "
+                        f"on a subsample of {size:,}/{a_values.size:,} "
+                        f"peaks, coefficients stabilized within {change:.2g}")
+        elif change <= tol:
+            logger.info(f"Fitted the M-A model of window size {window_size} "
+                        f"on all {size:,} peaks, coefficients stabilized "
+                        f"within {change:.2g}")
+        else:
+            logger.info(f"Fitted the M-A model of window size {window_size} "
+                        f"on all {size:,} peaks, coefficients changed by "
+                        f"{change:.2g} in the last subsample step")
+        return list(params)
+
+    def fit_model(self, window_size=2000, summit_dis_cutoff=500,
+                  fitter='builtin', subsample=None, tol=5e-3, seed=None,
+                  extra_window_sizes=()):
+        """Fit M-A normalization model.
+
+        The robust M-A line is fitted with the builtin Huber estimator
+        (`fitter` = 'builtin') or scikit-learn's `HuberRegressor`
+        (`fitter` = 'sklearn'), which requires scikit-learn to be installed.
+
+        If `subsample` is specified, the model is fitted on a random
+        subsample of `subsample` common peaks stratified by A values, which
+        is doubled until the slope and intercept change no more than `tol`.
+
+        Reads are also counted in windows of `extra_window_sizes` in the same
+        pass, and a model is fitted for each of them on the same common
+        peaks. The peak columns and `ma_params` always refer to
+        `window_size`, while `window_results` holds the count tables, the
+        fitted parameters and the fit quality (see `_fit_quality`) of all
+        window sizes.
+        """
         if not self.processed:
             raise ProcessNotReadyError("fit the M-A model", 'process peaks')
-        self._count_reads(window_size=window_size)
-        m_values = []
-        a_values = []
-        for chrom in self.peaks_merged.chroms:
-            for peak in self.peaks_merged.fetch(chrom):
-                if peak.summit_dis <= summit_dis_cutoff:
-                    m_values.append(peak.m_raw)
-                    a_values.append(peak.a_raw)
-        m_values = np.array(m_values)
-        a_values = np.array(a_values)
-        mask = abs(m_values) <= 10
-        huber = HuberRegressor()
-        huber.fit(a_values[mask].reshape(-1, 1), m_values[mask])
-        self.ma_params = [huber.intercept_, huber.coef_[0]]
+        if fitter not in FITTERS:
+            raise ValueError(f"unknown fitter: {fitter!r}")
+        window_sizes = [window_size]
+        for extra_window_size in extra_window_sizes:
+            if extra_window_size not in window_sizes:
+                window_sizes.append(extra_window_size)
+        tables = self._count_reads(window_sizes)
+        summit_dis = self.peaks_merged.concat_column('summit_dis')
+        self.window_results = {}
+        for size, (table1, table2, table_merged) in zip(window_sizes, tables):
+            mask = (summit_dis <= summit_dis_cutoff) & (
+                    np.abs(table_merged['m_raw']) <= 10)
+            params = self._fit(table_merged['a_raw'][mask],
+                               table_merged['m_raw'][mask], fitter, subsample,
+                               tol, seed, size)
+            self.window_results[size] = {
+                'tables': [table1, table2, table_merged], 'params': params,
+                'quality': _fit_quality(table_merged, mask, *params)}
+        for peaks, table in zip((self.peaks1, self.peaks2, self.peaks_merged),
+                                self.window_results[window_size]['tables']):
+            for name, values in table.items():
+                peaks.set_concat_column(name, values)
+            peaks.set_concat_column('counted', True)
+        self.ma_params = self.window_results[window_size]['params']
         self.fitted = True
 
     def normalize(self):
@@ -69,13 +282,14 @@ class MAmodel(object):
             raise ProcessNotReadyError("normalize peaks", "fit the M-A model")
         intercept = self.ma_params[0]
         slope = self.ma_params[1]
-        for chrom in self.peaks1.chroms:
-            for peak in self.peaks1.fetch(chrom):
-                peak.normalize(slope=slope, intercept=intercept)
-        for chrom in self.peaks2.chroms:
-            for peak in self.peaks2.fetch(chrom):
-                peak.normalize(slope=slope, intercept=intercept)
-        for chrom in self.peaks_merged.chroms:
-            for peak in self.peaks_merged.fetch(chrom):
-                peak.normalize(slope=slope, intercept=intercept)
+        for peaks in (self.peaks1, self.peaks2, self.peaks_merged):
+            table = {'m_raw': peaks.concat_column('m_raw'),
+                     'a_raw': peaks.concat_column('a_raw')}
+            for name, values in _normalize_table(table, intercept,
+                                                 slope).items():
+                peaks.set_concat_column(name, values)
+            peaks.set_concat_column('normalized', True)
+        for result in self.window_results.values():
+            for table in result['tables']:
+                table.update(_normalize_table(table, *result['params']))
         self.normalized = True
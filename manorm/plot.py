@@ -7,27 +7,38 @@ This module contains the plot functions.
 
 import os
 
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
 import numpy as np
 
 
+_PLOT_COLUMNS = ('read_density1', 'read_density2', 'm_raw', 'a_raw',
+                 'm_normed', 'a_normed', 'log_p_value')
+
+
+def _peak_columns(peaks, unique_only=False):
+    """Returns the columns to plot of the peaks concatenated over
+    chromosomes, keeping only the unique peaks if specified."""
+    parts = {name: [] for name in _PLOT_COLUMNS}
+    for chrom in peaks.chroms:
+        if unique_only:
+            mask = ~peaks.column(chrom, 'iscommon').astype(bool)
+        else:
+            mask = slice(None)
+        for name in _PLOT_COLUMNS:
+            parts[name].append(
+                peaks.column(chrom, name).astype(np.float64)[mask])
+    return {name: np.concatenate(values) if values else np.array([])
+            for name, values in parts.items()}
+
+
 def plt_figures(root_dir, peaks1, peaks2, peaks_merged, ma_params):
-    peaks1_unique = []
-    for chrom in peaks1.chroms:
-        for peak in peaks1.fetch(chrom):
-            if not peak.iscommon:
-                peaks1_unique.append(peak)
-    peaks2_unique = []
-    for chrom in peaks2.chroms:
-        for peak in peaks2.fetch(chrom):
-            if not peak.iscommon:
-                peaks2_unique.append(peak)
-    merged_common_peaks = []
-    for chrom in peaks_merged.chroms:
-        for peak in peaks_merged.fetch(chrom):
-            merged_common_peaks.append(peak)
+    # matplotlib is slow to import, defer it until figures are produced
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    peaks1_unique = _peak_columns(peaks1, unique_only=True)
+    peaks2_unique = _peak_columns(peaks2, unique_only=True)
+    merged_common_peaks = _peak_columns(peaks_merged)
 
     output_prefix = peaks1.name + '_vs_' + peaks2.name
 
@@ -39,12 +50,8 @@ def plt_figures(root_dir, peaks1, peaks2, peaks_merged, ma_params):
 
     # plot the relationship of read densities
     fig, ax = plt.subplots(figsize=(4, 4))
-    reads_density1, reads_density2 = [], []
-    for peak in merged_common_peaks:
-        reads_density1.append(peak.read_density1)
-        reads_density2.append(peak.read_density2)
-    x = np.log2(reads_density1)
-    y = np.log2(reads_density2)
+    x = np.log2(merged_common_peaks['read_density1'])
+    y = np.log2(merged_common_peaks['read_density2'])
     x_max = max(x)
     x_min = min(x)
     ax.scatter(x, y, s=1, c="#566270", label=merged_peaks_name, alpha=0.8)
@@ -68,10 +75,10 @@ def plt_figures(root_dir, peaks1, peaks2, peaks_merged, ma_params):
     a_min = 999999999
     for idx, peaks in enumerate(
             [peaks1_unique, peaks2_unique, merged_common_peaks]):
-        m_values = [peak.m_raw for peak in peaks]
-        a_values = [peak.a_raw for peak in peaks]
-        a_max = max(max(a_values), a_max)
-        a_min = min(min(a_values), a_min)
+        m_values = peaks['m_raw']
+        a_values = peaks['a_raw']
+        a_max = max(a_values.max(), a_max)
+        a_min = min(a_values.min(), a_min)
         plt.scatter(a_values, m_values, s=1, c=colors[idx],
                     label=peaks_names[idx], alpha=0.8)
     ax.axhline(y=0, ls='--', color='lightgrey')
@@ -95,8 +102,8 @@ def plt_figures(root_dir, peaks1, peaks2, peaks_merged, ma_params):
     fig, ax = plt.subplots(figsize=(4, 3))
     for idx, peaks in enumerate(
             [peaks1_unique, peaks2_unique, merged_common_peaks]):
-        m_values = [peak.m_normed for peak in peaks]
-        a_values = [peak.a_normed for peak in peaks]
+        m_values = peaks['m_normed']
+        a_values = peaks['a_normed']
         plt.scatter(a_values, m_values, s=1, c=colors[idx],
                     label=peaks_names[idx], alpha=0.8)
     ax.axhline(y=0, ls='--', color='lightgrey')
@@ -115,19 +122,12 @@ def plt_figures(root_dir, peaks1, peaks2, peaks_merged, ma_params):
 
     # plot the MA plot after normalization colored by P value
     fig, ax = plt.subplots(figsize=(4, 3))
-    m_values = []
-    a_values = []
-    p_values = []
-    for idx, peaks in enumerate(
-            [peaks1_unique, peaks2_unique, merged_common_peaks]):
-        for peak in peaks:
-            m_values.append(peak.m_normed)
-            a_values.append(peak.a_normed)
-            p_values.append(peak.p_value)
-    colors = -np.log10(p_values)
-    for i, c in enumerate(colors):
-        if c > 50:
-            colors[i] = 50
+    all_peaks = [peaks1_unique, peaks2_unique, merged_common_peaks]
+    m_values = np.concatenate([peaks['m_normed'] for peaks in all_peaks])
+    a_values = np.concatenate([peaks['a_normed'] for peaks in all_peaks])
+    log_p_values = np.concatenate(
+        [peaks['log_p_value'] for peaks in all_peaks])
+    colors = np.minimum(-log_p_values / np.log(10), 50)
     scatter = ax.scatter(a_values, m_values, s=1, c=colors, cmap="coolwarm")
     ax.axhline(y=0, ls='--', color='lightgrey')
     ymin, ymax = ax.get_ylim()
@@ -7,16 +7,77 @@ Module for sequencing reads.
 
 import logging
 import os
-from bisect import bisect_left
+import time
 
+import numpy as np
+
+from manorm.chroms import registry
 from manorm.exceptions import FormatModeConflictError
-from manorm.read.parsers import get_read_parser
+from manorm.read.parsers import FETCH_FLANK, SamReadParser, get_read_parser
 
 READ_FORMATS = ['bed', 'bedpe', 'sam', 'bam']
+READ_BACKENDS = ['array', 'compact']
 
 logger = logging.getLogger(__name__)
 
 
+class _PositionBuffer:
+    """Growable buffer of read positions made up of fixed-size chunks.
+
+    Parameters
+    ----------
+    chunk_size : int, optional
+        Number of positions held by each chunk, default=65536.
+    """
+
+    def __init__(self, chunk_size=65536):
+        self._chunk_size = chunk_size
+        self._chunks = []
+        self._chunk = np.empty(chunk_size, dtype=np.int64)
+        self._fill = 0
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def _flush(self):
+        if self._fill > 0:
+            self._chunks.append(self._chunk[:self._fill])
+            self._chunk = np.empty(self._chunk_size, dtype=np.int64)
+            self._fill = 0
+
+    def append(self, pos):
+        """Append a single position."""
+        if self._fill == self._chunk_size:
+            self._flush()
+        self._chunk[self._fill] = pos
+        self._fill += 1
+        self._size += 1
+
+    def extend(self, positions):
+        """Append an array of positions."""
+        positions = np.asarray(positions, dtype=np.int64)
+        self._flush()
+        self._chunks.append(positions.copy())
+        self._size += positions.size
+
+    def to_array(self):
+        """Returns all buffered positions as a single int64 array."""
+        self._flush()
+        if len(self._chunks) == 1:
+            return self._chunks[0]
+        return np.concatenate(self._chunks)
+
+
+def _compact_positions(positions):
+    """Downcast sorted int64 positions to int32 if they fit in the range."""
+    info = np.iinfo(np.int32)
+    if positions.size == 0 or (
+            info.min < positions[0] and positions[-1] < info.max):
+        return positions.astype(np.int32)
+    return positions
+
+
 class Reads:
     """Class for reads generated from next-generation sequencing.
 
@@ -29,11 +90,42 @@ class Reads:
     ----------
     name : str or None
         The sample name of the sequencing reads.
+
+    Notes
+    -----
+    Read positions are buffered in chunks as they are added and then merged
+    into one sorted NumPy array per chromosome (int32 when the coordinates
+    fit, int64 otherwise) when the reads are sorted or first queried. The
+    arrays are keyed by the chromosome IDs in `manorm.chroms.registry`.
     """
 
     def __init__(self, name=None):
         self.name = name
         self._data = {}
+        self._buffers = {}
+        self._chroms = None
+
+    @classmethod
+    def from_sorted(cls, data, name=None):
+        """Create reads from sorted read positions.
+
+        Parameters
+        ----------
+        data : dict
+            Sorted read positions (NumPy arrays) keyed by chromosome names.
+            The arrays are used as is without copying.
+        name : str, optional
+            The sample name of the sequencing reads.
+
+        Returns
+        -------
+        reads : `Reads`
+            The created reads.
+        """
+        reads = cls(name=name)
+        for chrom, positions in data.items():
+            reads._data[registry.register(chrom)] = positions
+        return reads
 
     @property
     def chroms(self):
@@ -44,12 +136,30 @@ class Reads:
         list of str
             Chromosome names (sorted) of the sequencing reads.
         """
-        return sorted(self._data.keys())
+        if self._chroms is None:
+            chrom_ids = registry.sort(set(self._data) | set(self._buffers))
+            self._chroms = [registry.name(chrom_id) for chrom_id in chrom_ids]
+        return self._chroms
 
     @property
     def size(self):
         """Returns the number of sequencing reads."""
-        return sum(len(value) for value in self._data.values())
+        return sum(len(value) for value in self._data.values()) + sum(
+            len(value) for value in self._buffers.values())
+
+    @property
+    def nbytes(self):
+        """Returns the memory size of the sorted read positions in bytes."""
+        return sum(value.nbytes for value in self._data.values())
+
+    def _buffer(self, chrom):
+        """Returns the position buffer of given chromosome."""
+        chrom_id = registry.register(chrom)
+        if chrom_id not in self._buffers:
+            if chrom_id not in self._data:
+                self._chroms = None
+            self._buffers[chrom_id] = _PositionBuffer()
+        return self._buffers[chrom_id]
 
     def add(self, chrom, pos):
         """Add a read position.
@@ -61,13 +171,68 @@ class Reads:
         pos : int
             The representative genomic position of the read.
         """
-        self._data.setdefault(chrom, [])
-        self._data[chrom].append(pos)
+        self._buffer(chrom).append(pos)
+
+    def add_many(self, chrom, positions):
+        """Add an array of read positions on the same chromosome.
+
+        Parameters
+        ----------
+        chrom : str
+            The chromosome name of the reads.
+        positions : array_like of int
+            The representative genomic positions of the reads.
+        """
+        if len(positions) == 0:
+            return
+        self._buffer(chrom).extend(positions)
 
     def sort(self):
         """Sort reads."""
-        for chrom in self.chroms:
-            self._data[chrom].sort()
+        for chrom_id, buffer in self._buffers.items():
+            positions = buffer.to_array()
+            if chrom_id in self._data:
+                positions = np.concatenate(
+                    [self._data[chrom_id].astype(np.int64), positions])
+            positions.sort()
+            self._data[chrom_id] = _compact_positions(positions)
+        self._buffers = {}
+
+    def fetch(self, chrom):
+        """Fetch the sorted read positions on specified chromosome.
+
+        Parameters
+        ----------
+        chrom : str
+            The chromosome name to fetch reads from.
+
+        Returns
+        -------
+        numpy.ndarray
+            Sorted read positions on the specified chromosome.
+        """
+        if self._buffers:
+            self.sort()
+        chrom_id = registry.lookup(chrom)
+        if chrom_id in self._data:
+            return self._data[chrom_id]
+        else:
+            return np.array([], dtype=np.int32)
+
+    @staticmethod
+    def _cast(positions, values):
+        """Cast query values to the dtype of the position array, so that
+        `searchsorted` does not have to convert the whole array.
+        """
+        info = np.iinfo(positions.dtype)
+        return np.clip(values, info.min, info.max).astype(positions.dtype)
+
+    def _rank(self, chrom, values):
+        """Returns the number of reads located before each of the values."""
+        positions = self.fetch(chrom)
+        if positions.size == 0:
+            return np.zeros(values.shape, dtype=np.int64)
+        return positions.searchsorted(self._cast(positions, values))
 
     def count(self, chrom, start, end):
         """Count reads located in the given interval by binary search.
@@ -84,15 +249,379 @@ class Reads:
         if start >= end:
             raise ValueError(
                 f"expect start < end, got: start={start} end={end}")
-        try:
-            head = bisect_left(self._data[chrom], start)
-            tail = bisect_left(self._data[chrom], end)
-            return tail - head
-        except KeyError:
-            return 0
+        head, tail = self._rank(chrom, np.array([start, end], dtype=np.int64))
+        return int(tail - head)
+
+    def count_many(self, chrom, starts, ends):
+        """Count reads located in each of the given intervals.
+
+        Parameters
+        ----------
+        chrom : str
+            The chromosome name of the intervals.
+        starts : array_like of int
+            The start positions of the intervals.
+        ends : array_like of int
+            The end positions of the intervals.
+
+        Returns
+        -------
+        numpy.ndarray
+            The number of reads located in each interval.
+        """
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        if starts.shape != ends.shape:
+            raise ValueError(
+                f"expect starts and ends of the same shape, got: "
+                f"{starts.shape} and {ends.shape}")
+        if np.any(starts >= ends):
+            raise ValueError("expect start < end for all intervals")
+        idx = self._rank(chrom, np.stack([starts, ends]))
+        return (idx[1] - idx[0]).astype(np.int64)
+
+    def count_windows(self, windows):
+        """Count reads located in windows on multiple chromosomes.
+
+        Parameters
+        ----------
+        windows : dict
+            The starts and ends of the windows keyed by chromosome names.
+
+        Returns
+        -------
+        dict
+            The number of reads located in each window keyed by chromosome
+            names.
+        """
+        counts = {}
+        for chrom, (starts, ends) in windows.items():
+            counts[chrom] = self.count_many(chrom, starts, ends)
+        return counts
+
+
+class _DeltaBlocks:
+    """Sorted read positions encoded as deltas in fixed-size blocks.
+
+    The first position of each block is kept in a skip table and the other
+    positions are stored as the deltas to their preceding positions, which
+    take 2 bytes (uint16) per read unless a gap within the block exceeds
+    65535 bp, in which case the block is stored with wider deltas.
+
+    Parameters
+    ----------
+    positions : numpy.ndarray
+        Sorted read positions.
+    block_size : int, optional
+        Number of positions in each block, default=128.
+    """
+
+    def __init__(self, positions, block_size=128):
+        positions = np.asarray(positions, dtype=np.int64)
+        self.block_size = block_size
+        self.size = positions.size
+        num_blocks = -(-positions.size // block_size)
+        # pad the last block with the last position (zero deltas)
+        blocks = np.empty(num_blocks * block_size, dtype=np.int64)
+        blocks[:positions.size] = positions
+        blocks[positions.size:] = positions[-1] if positions.size else 0
+        blocks = blocks.reshape(num_blocks, block_size)
+        self.firsts = _compact_positions(blocks[:, 0])
+        deltas = np.diff(blocks, axis=1, prepend=blocks[:, :1])
+        max_deltas = deltas.max(axis=1, initial=0)
+        self.wide = max_deltas > np.iinfo(np.uint16).max
+        self.rows = np.where(self.wide, np.cumsum(self.wide) - 1,
+                             np.cumsum(~self.wide) - 1).astype(np.int32)
+        self.narrow = deltas[~self.wide].astype(np.uint16)
+        if max_deltas.max(initial=0) > np.iinfo(np.uint32).max:
+            self.overflow = deltas[self.wide].astype(np.uint64)
+        else:
+            self.overflow = deltas[self.wide].astype(np.uint32)
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def nbytes(self):
+        return (self.firsts.nbytes + self.wide.nbytes + self.rows.nbytes +
+                self.narrow.nbytes + self.overflow.nbytes)
+
+    def _decode(self, blocks):
+        """Decode the positions of the given blocks into a 2-D array."""
+        positions = np.empty((blocks.size, self.block_size), dtype=np.int64)
+        wide = self.wide[blocks]
+        positions[~wide] = self.narrow[self.rows[blocks[~wide]]]
+        positions[wide] = self.overflow[self.rows[blocks[wide]]]
+        np.cumsum(positions, axis=1, out=positions)
+        positions += self.firsts[blocks, np.newaxis]
+        return positions
+
+    def decode(self):
+        """Returns all positions as a single int64 array."""
+        blocks = np.arange(self.firsts.size)
+        return self._decode(blocks).ravel()[:self.size]
+
+    def rank(self, values, chunk_size=4096):
+        """Returns the number of positions less than each of the values."""
+        values = np.asarray(values, dtype=np.int64)
+        ranks = np.zeros(values.size, dtype=np.int64)
+        if self.size == 0:
+            return ranks.reshape(values.shape)
+        flat_values = values.ravel()
+        # decode a bounded number of blocks at a time
+        for head in range(0, flat_values.size, chunk_size):
+            chunk = flat_values[head:head + chunk_size]
+            # the last block starting before each value
+            blocks = self.firsts.searchsorted(
+                Reads._cast(self.firsts, chunk)) - 1
+            mask = blocks >= 0
+            needed, inverse = np.unique(blocks[mask], return_inverse=True)
+            # the decoded blocks are in ascending order, and the positions
+            # of blocks before/after the block of a value are all less
+            # than/no less than the value
+            idx = self._decode(needed).ravel().searchsorted(chunk[mask])
+            local = np.clip(idx - inverse.ravel() * self.block_size, 0,
+                            self.block_size)
+            ranks[head:head + chunk_size][mask] = np.minimum(
+                blocks[mask] * self.block_size + local, self.size)
+        return ranks.reshape(values.shape)
+
+
+class CompactReads(Reads):
+    """Reads with sorted positions stored in a compact delta encoding.
+
+    Sorted read positions of each chromosome are stored as uint16 deltas in
+    fixed-size blocks with a skip table of the first position of each block,
+    which takes about 2 bytes per read instead of 4-8 bytes for plain
+    arrays. Reads are counted by binary searching the skip table and only
+    decoding the blocks holding the interval boundaries.
+
+    Parameters
+    ----------
+    name : str, optional
+        The sample name of the sequencing reads.
+    block_size : int, optional
+        Number of positions in each block, default=128.
+    """
+
+    def __init__(self, name=None, block_size=128):
+        super().__init__(name=name)
+        self.block_size = block_size
+
+    @classmethod
+    def from_sorted(cls, data, name=None):
+        """Create reads from sorted read positions.
+
+        Parameters
+        ----------
+        data : dict
+            Sorted read positions (NumPy arrays) keyed by chromosome names.
+        name : str, optional
+            The sample name of the sequencing reads.
+
+        Returns
+        -------
+        reads : `CompactReads`
+            The created reads.
+        """
+        reads = cls(name=name)
+        for chrom, positions in data.items():
+            reads._data[registry.register(chrom)] = _DeltaBlocks(
+                positions, reads.block_size)
+        return reads
+
+    def sort(self):
+        """Sort reads."""
+        for chrom_id, buffer in self._buffers.items():
+            positions = buffer.to_array()
+            if chrom_id in self._data:
+                positions = np.concatenate(
+                    [self._data[chrom_id].decode(), positions])
+            positions.sort()
+            self._data[chrom_id] = _DeltaBlocks(positions, self.block_size)
+        self._buffers = {}
+
+    def fetch(self, chrom):
+        """Fetch the sorted read positions on specified chromosome.
+
+        Parameters
+        ----------
+        chrom : str
+            The chromosome name to fetch reads from.
+
+        Returns
+        -------
+        numpy.ndarray
+            Sorted read positions on the specified chromosome, which are
+            decoded into a new array.
+        """
+        if self._buffers:
+            self.sort()
+        chrom_id = registry.lookup(chrom)
+        if chrom_id in self._data:
+            return _compact_positions(self._data[chrom_id].decode())
+        else:
+            return np.array([], dtype=np.int32)
+
+    def _rank(self, chrom, values):
+        if self._buffers:
+            self.sort()
+        chrom_id = registry.lookup(chrom)
+        if chrom_id not in self._data:
+            return np.zeros(values.shape, dtype=np.int64)
+        return self._data[chrom_id].rank(values)
+
+
+class ReadStream:
+    """Sequencing reads streamed from a coordinate-sorted read file.
+
+    Reads are counted against the windows in a single pass over the read
+    file without being held in memory. If the reads turn out not to be
+    sorted by coordinate, they are loaded into memory by `load_reads` and
+    counted as usual.
+
+    Parameters
+    ----------
+    path : str
+        Path of the read file.
+    format : str, optional
+        File format, default='bed'.
+    paired : bool, optional
+        Whether the reads are paired-end or not, default=False.
+    shift : int, optional
+        Shift size for single-end reads, default=100.
+    name : str, optional
+        Sample name. If not specified, the basename of the file will be used.
+    threads : int, optional
+        Number of htslib threads to decompress SAM/BAM files, default=1.
+    backend : {'array', 'compact'}, optional
+        The backend of reads loaded into memory if the read file is not
+        sorted, default='array'.
+
+    Attributes
+    ----------
+    name : str
+        The sample name of reads.
+    size : int or None
+        The total number of reads, which is available after the reads have
+        been counted.
+    """
+
+    def __init__(self, path, format='bed', paired=False, shift=100, name=None,
+                 threads=1, backend='array'):
+        if format == 'bed' and paired:
+            raise FormatModeConflictError('bed', 'paired-end')
+        if format == 'bedpe' and not paired:
+            raise FormatModeConflictError('bedpe', 'single-end')
+        self.path = path
+        self.format = format
+        self.paired = paired
+        self.shift = shift
+        self.name = name or os.path.splitext(os.path.basename(path))[0]
+        self.threads = threads
+        self.backend = backend
+        self.size = None
+        self._reads = None
+
+    def _batches(self):
+        parser_cls = get_read_parser(self.format)
+        if issubclass(parser_cls, SamReadParser):
+            parser = parser_cls(self.path, threads=self.threads)
+        else:
+            parser = parser_cls(self.path)
+        return parser.parse_batches(paired=self.paired, shift=self.shift)
+
+    def _sweep(self, windows):
+        """Count reads in windows with a single pass over the read file.
+
+        Returns None if the reads are not sorted by coordinate.
+        """
+        index = {}
+        for chrom, (starts, ends) in windows.items():
+            starts = np.asarray(starts, dtype=np.int64)
+            ends = np.asarray(ends, dtype=np.int64)
+            if starts.shape != ends.shape:
+                raise ValueError(
+                    f"expect starts and ends of the same shape, got: "
+                    f"{starts.shape} and {ends.shape}")
+            if np.any(starts >= ends):
+                raise ValueError("expect start < end for all intervals")
+            order = np.argsort(starts, kind='stable')
+            starts, ends = starts[order], ends[order]
+            index[chrom] = (order, starts, ends, np.maximum.accumulate(ends),
+                            np.zeros(starts.size, dtype=np.int64))
+        # reads are sorted by their alignment starts, which the positions of
+        # reads may differ from by up to the shift size or fragment size
+        tolerance = FETCH_FLANK + abs(self.shift)
+        size = 0
+        finished = set()
+        current = last = None
+        for chrom, positions in self._batches():
+            if positions.size == 0:
+                continue
+            if chrom != current:
+                if chrom in finished:
+                    return None
+                if current is not None:
+                    finished.add(current)
+                current, last = chrom, None
+            size += positions.size
+            positions = np.sort(positions)
+            if last is not None and positions[0] < last - tolerance:
+                return None
+            last = positions[-1] if last is None else max(last, positions[-1])
+            if chrom not in index:
+                continue
+            _, starts, ends, max_ends, counts = index[chrom]
+            # only the windows within the span of this batch are updated
+            head = max_ends.searchsorted(positions[0], side='right')
+            tail = starts.searchsorted(positions[-1], side='right')
+            if head < tail:
+                counts[head:tail] += (
+                    positions.searchsorted(ends[head:tail]) -
+                    positions.searchsorted(starts[head:tail]))
+        self.size = size
+        result = {}
+        for chrom, (order, _, _, _, counts) in index.items():
+            result[chrom] = np.empty_like(counts)
+            result[chrom][order] = counts
+        return result
+
+    def count_windows(self, windows):
+        """Count reads located in windows on multiple chromosomes.
+
+        Parameters
+        ----------
+        windows : dict
+            The starts and ends of the windows keyed by chromosome names.
+
+        Returns
+        -------
+        dict
+            The number of reads located in each window keyed by chromosome
+            names.
+        """
+        if self._reads is None:
+            logger.info(f"Counting reads from {self.path} [{self.format}] "
+                        f"in a single pass")
+            start_time = time.perf_counter()
+            counts = self._sweep(windows)
+            if counts is not None:
+                elapsed = time.perf_counter() - start_time
+                logger.info(f"Counted {self.size:,} reads in {elapsed:.1f}s")
+                return counts
+            logger.warning(f"Reads in {self.path} are not sorted by "
+                           f"coordinate, loading them into memory instead")
+            self._reads = load_reads(self.path, format=self.format,
+                                     paired=self.paired, shift=self.shift,
+                                     name=self.name, threads=self.threads,
+                                     backend=self.backend)
+            self.size = self._reads.size
+        return self._reads.count_windows(windows)
 
 
-def load_reads(path, format='bed', paired=False, shift=100, name=None):
+def load_reads(path, format='bed', paired=False, shift=100, name=None,
+               cache=None, threads=1, regions=None, backend='array'):
     """Read reads from file.
 
     Parameters
@@ -107,23 +636,88 @@ def load_reads(path, format='bed', paired=False, shift=100, name=None):
         Shift size for single-end reads, default=100.
     name : str, optional
         Sample name. If not specified, the basename of the file will be used.
+    cache : `manorm.read.cache.ReadCache`, optional
+        If specified, the reads are loaded from the cache when available and
+        saved into it after being parsed otherwise.
+    threads : int, optional
+        Number of processes to parse indexed BAM files contig by contig, or
+        number of htslib threads to decompress SAM/BAM files which are parsed
+        sequentially, default=1.
+    regions : `manorm.region.GenomicRegions`, optional
+        If specified, only the reads located in the (non-overlapping)
+        regions are loaded from indexed BAM files through the index, and the
+        read cache is not used. Reads in other formats are fully loaded.
+    backend : {'array', 'compact'}, optional
+        How the sorted read positions are stored in memory, either as plain
+        arrays (`Reads`) or delta-encoded blocks (`CompactReads`) which take
+        2-4x less memory at a small cost of counting speed, default='array'.
 
     Returns
     -------
-    reads : `Reads`
+    reads : `Reads` or `CompactReads`
         Loaded sequencing reads.
     """
     logger.info(f"Loading reads from {path} [{format}]")
+    if backend not in READ_BACKENDS:
+        raise ValueError(f"unknown read backend: {backend!r}")
+    reads_cls = CompactReads if backend == 'compact' else Reads
     if format == 'bed' and paired:
         raise FormatModeConflictError('bed', 'paired-end')
     if format == 'bedpe' and not paired:
         raise FormatModeConflictError('bedpe', 'single-end')
     if name is None:
         name = os.path.splitext(os.path.basename(path))[0]
-    reads = Reads(name=name)
-    parser = get_read_parser(format)(path)
-    for chrom, pos in parser.parse(paired=paired, shift=shift):
-        reads.add(chrom, pos)
+    if regions is not None and format.lower() != 'bam':
+        logger.warning("Reads can only be loaded by regions from indexed BAM "
+                       "files, loading all reads instead")
+        regions = None
+    if regions is not None:
+        cache = None
+    if cache is not None:
+        reads = cache.load(path, format, paired, shift, name=name)
+        if reads is not None:
+            logger.info(f"Loaded {reads.size:,} reads from cache")
+            if reads_cls is not Reads:
+                reads = reads_cls.from_sorted(
+                    {chrom: reads.fetch(chrom) for chrom in reads.chroms},
+                    name=name)
+            return reads
+    start_time = time.perf_counter()
+    reads = reads_cls(name=name)
+    parser_cls = get_read_parser(format)
+    if issubclass(parser_cls, SamReadParser):
+        parser = parser_cls(path, threads=threads)
+    else:
+        parser = parser_cls(path)
+    indexed = getattr(parser, 'has_index', False)
+    if regions is not None and not indexed:
+        logger.warning("BAM file is not indexed, loading all reads instead")
+        regions = None
+    if regions is not None:
+        logger.debug(f"Parsing reads located in {regions.size:,} regions")
+        windows = {}
+        for chrom in regions.chroms:
+            windows[chrom] = (regions.column(chrom, 'start'),
+                              regions.column(chrom, 'end'))
+        batches = parser.parse_by_contig(paired=paired, shift=shift,
+                                         processes=threads, windows=windows)
+    elif threads > 1 and indexed:
+        logger.debug(f"Parsing reads by contig with {threads} processes")
+        batches = parser.parse_by_contig(paired=paired, shift=shift,
+                                         processes=threads)
+    else:
+        batches = parser.parse_batches(paired=paired, shift=shift)
+    for chrom, positions in batches:
+        reads.add_many(chrom, positions)
     reads.sort()
-    logger.info(f"Loaded {reads.size:,} reads")
+    elapsed = time.perf_counter() - start_time
+    if regions is not None:
+        logger.info(f"Loaded reads located in {regions.size:,} regions only")
+    logger.info(f"Loaded {reads.size:,} reads in {elapsed:.1f}s "
+                f"({reads.size / max(elapsed, 1e-6):,.0f} reads/s, "
+                f"threads={threads})")
+    logger.debug(f"Memory of sorted read positions: {reads.nbytes:,} bytes "
+                 f"[{backend}]")
+    if cache is not None:
+        cache.save(reads, path, format, paired, shift)
     return reads
@@ -0,0 +1,261 @@
+"""
+manorm.read.cache
+-----------------
+
+Persistent on-disk cache of the parsed sequencing reads.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+
+import numpy as np
+
+from manorm.read import Reads
+
+CACHE_VERSION = 1
+
+logger = logging.getLogger(__name__)
+
+
+def _file_checksum(path, block_size=1 << 20):
+    """Returns the SHA-1 checksum of the file content."""
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as fin:
+        for block in iter(lambda: fin.read(block_size), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def _dir_size(path):
+    """Returns the total size of the files under a directory."""
+    size = 0
+    for root, _, files in os.walk(path):
+        for filename in files:
+            size += os.path.getsize(os.path.join(root, filename))
+    return size
+
+
+class ReadCache:
+    """On-disk cache of the sorted read positions parsed from read files.
+
+    Each entry is a directory named by the fingerprint of the read file and
+    the parsing options, which holds one `.npy` file per chromosome and a
+    `meta.json` index. Cached positions are memory-mapped when loaded.
+
+    Parameters
+    ----------
+    root : str
+        The cache directory.
+    max_size : int, optional
+        The maximum total size of the cache in bytes. The least recently
+        used entries are evicted when it is exceeded. If not specified, the
+        cache size is unbounded.
+    checksum : bool, optional
+        Whether to fingerprint read files by the checksum of their content
+        instead of the modification time, default=False.
+
+    Attributes
+    ----------
+    root : str
+        The cache directory.
+    max_size : int or None
+        The maximum total size of the cache in bytes.
+    checksum : bool
+        Whether to fingerprint read files by their content.
+    """
+
+    def __init__(self, root, max_size=None, checksum=False):
+        self.root = os.path.abspath(root)
+        self.max_size = max_size
+        self.checksum = checksum
+        self._checksums = {}
+        os.makedirs(self.root, exist_ok=True)
+
+    def _fingerprint(self, path):
+        """Returns the fingerprint of the given read file."""
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        fingerprint = {'path': path, 'size': stat.st_size}
+        if self.checksum:
+            # avoid hashing the same unmodified file more than once
+            stat_key = (path, stat.st_size, stat.st_mtime_ns)
+            if stat_key not in self._checksums:
+                self._checksums[stat_key] = _file_checksum(path)
+            fingerprint['sha1'] = self._checksums[stat_key]
+        else:
+            fingerprint['mtime'] = stat.st_mtime_ns
+        return fingerprint
+
+    def key(self, path, format, paired, shift):
+        """Returns the cache key of the reads parsed with given options.
+
+        Parameters
+        ----------
+        path : str
+            Path of the read file.
+        format : str
+            File format of the read file.
+        paired : bool
+            Whether the reads are paired-end or not.
+        shift : int
+            Shift size for single-end reads.
+
+        Returns
+        -------
+        str
+            The cache key.
+        """
+        options = {'version': CACHE_VERSION,
+                   'source': self._fingerprint(path),
+                   'format': format.lower(),
+                   'paired': bool(paired),
+                   'shift': None if paired else int(shift)}
+        content = json.dumps(options, sort_keys=True).encode()
+        return hashlib.sha1(content).hexdigest()
+
+    def _entry_dir(self, key):
+        return os.path.join(self.root, key)
+
+    def _entries(self):
+        """Returns the keys of all cache entries."""
+        keys = []
+        for key in os.listdir(self.root):
+            if os.path.isfile(os.path.join(self.root, key, 'meta.json')):
+                keys.append(key)
+        return keys
+
+    def _read_meta(self, key):
+        with open(os.path.join(self._entry_dir(key), 'meta.json')) as fin:
+            return json.load(fin)
+
+    def load(self, path, format, paired, shift, name=None):
+        """Load cached reads if the read file has been cached.
+
+        Parameters
+        ----------
+        path : str
+            Path of the read file.
+        format : str
+            File format of the read file.
+        paired : bool
+            Whether the reads are paired-end or not.
+        shift : int
+            Shift size for single-end reads.
+        name : str, optional
+            Sample name of the reads.
+
+        Returns
+        -------
+        reads : `Reads` or None
+            The cached reads, or None if not found.
+        """
+        key = self.key(path, format, paired, shift)
+        entry_dir = self._entry_dir(key)
+        try:
+            meta = self._read_meta(key)
+            data = {}
+            for chrom, filename in meta['chroms'].items():
+                data[chrom] = np.load(os.path.join(entry_dir, filename),
+                                      mmap_mode='r')
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError):
+            logger.warning(f"Removing corrupted read cache entry: {key}")
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            return None
+        # update the access time for the LRU eviction
+        os.utime(os.path.join(entry_dir, 'meta.json'))
+        logger.debug(f"Read cache hit: {key}")
+        return Reads.from_sorted(data, name=name)
+
+    def save(self, reads, path, format, paired, shift):
+        """Save the reads into the cache.
+
+        Parameters
+        ----------
+        reads : `Reads`
+            The reads parsed from the read file.
+        path : str
+            Path of the read file.
+        format : str
+            File format of the read file.
+        paired : bool
+            Whether the reads are paired-end or not.
+        shift : int
+            Shift size for single-end reads.
+        """
+        key = self.key(path, format, paired, shift)
+        entry_dir = self._entry_dir(key)
+        if os.path.isdir(entry_dir):
+            return
+        # write into a temporary directory and rename it for atomicity
+        tmp_dir = f"{entry_dir}.tmp{os.getpid()}"
+        os.makedirs(tmp_dir, exist_ok=True)
+        meta = {'version': CACHE_VERSION,
+                'source': self._fingerprint(path),
+                'size': reads.size,
+                'chroms': {}}
+        for idx, chrom in enumerate(reads.chroms):
+            filename = f"{idx}.npy"
+            np.save(os.path.join(tmp_dir, filename), reads.fetch(chrom))
+            meta['chroms'][chrom] = filename
+        with open(os.path.join(tmp_dir, 'meta.json'), 'w') as fout:
+            json.dump(meta, fout)
+        try:
+            os.rename(tmp_dir, entry_dir)
+        except OSError:  # cached by another process in the meantime
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        logger.debug(f"Saved reads into cache: {key}")
+        self.evict(keep=key)
+
+    @staticmethod
+    def _is_stale(meta):
+        """Check whether the source read file of a cache entry has been
+        modified or removed."""
+        source = meta['source']
+        try:
+            stat = os.stat(source['path'])
+        except FileNotFoundError:
+            return True
+        if stat.st_size != source['size']:
+            return True
+        # content checksums are only verified on lookup
+        return 'mtime' in source and stat.st_mtime_ns != source['mtime']
+
+    def evict(self, keep=None):
+        """Remove stale entries and evict the least recently used entries
+        until the cache size is within `max_size`.
+
+        Parameters
+        ----------
+        keep : str, optional
+            The key of an entry which should never be evicted.
+        """
+        entries = []
+        for key in self._entries():
+            try:
+                meta = self._read_meta(key)
+                stale = key != keep and self._is_stale(meta)
+            except (OSError, ValueError, KeyError):
+                stale = True
+            if stale:
+                logger.debug(f"Removing stale read cache entry: {key}")
+                shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+                continue
+            atime = os.path.getmtime(
+                os.path.join(self._entry_dir(key), 'meta.json'))
+            entries.append((atime, key, _dir_size(self._entry_dir(key))))
+        if self.max_size is None:
+            return
+        total_size = sum(size for _, _, size in entries)
+        for _, key, size in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            if key == keep:
+                continue
+            logger.debug(f"Evicting read cache entry: {key}")
+            shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+            total_size -= size
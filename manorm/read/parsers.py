@@ -8,12 +8,128 @@ Parsers to parse the sequencing reads file.
 import gzip
 import logging
 
-import pysam
+import numpy as np
 
 from manorm.exceptions import FileFormatError
 
 logger = logging.getLogger(__name__)
 
+# reads starting within this distance (plus the shift size) of a window are
+# fetched to collect the reads whose representative positions are inside it,
+# the distance grows to the longest fragment seen for paired-end reads
+FETCH_FLANK = 1000
+
+_NEWLINE = ord('\n')
+_TAB = ord('\t')
+_WHITESPACES = np.frombuffer(b' \t\n\r\x0b\x0c', dtype=np.uint8)
+_DIGITS = ord('0')
+_POWERS_OF_TEN = 10 ** np.arange(18, dtype=np.int64)
+
+
+def _split_fields(buf, n_fields):
+    """Locate the first `n_fields` tab-separated fields of each line in a
+    block of complete lines (ending with a newline).
+
+    Returns
+    -------
+    starts, ends : numpy.ndarray or None
+        2-D arrays (n_fields x n_lines) of the start/end offsets of each
+        field, or None if some line is empty or has fewer fields.
+    """
+    # 32-bit offsets halve the memory traffic for blocks under 2GB
+    dtype = np.int32 if buf.size < 2 ** 31 else np.int64
+    line_ends = np.flatnonzero(buf == _NEWLINE).astype(dtype)
+    if line_ends.size == 0:
+        return None
+    line_starts = np.empty_like(line_ends)
+    line_starts[0] = 0
+    line_starts[1:] = line_ends[:-1] + 1
+    # leading whitespaces are stripped when parsing line by line
+    if np.any(np.isin(buf[line_starts], _WHITESPACES)):
+        return None
+    tabs = np.flatnonzero(buf == _TAB).astype(dtype)
+    # number of tabs before the end of each line
+    tabs_before = np.searchsorted(tabs, line_ends)
+    tab_counts = np.diff(tabs_before, prepend=0)
+    if tab_counts.min() < n_fields - 1:
+        return None
+    first_tabs = tabs_before - tab_counts
+    starts = np.empty((n_fields, line_ends.size), dtype=line_ends.dtype)
+    ends = np.empty((n_fields, line_ends.size), dtype=line_ends.dtype)
+    starts[0] = line_starts
+    for k in range(n_fields - 1):
+        ends[k] = tabs[first_tabs + k]
+        starts[k + 1] = ends[k] + 1
+    last_ends = np.where(tab_counts >= n_fields,
+                         tabs[np.minimum(first_tabs + n_fields - 1,
+                                         tabs.size - 1)], line_ends)
+    ends[n_fields - 1] = last_ends
+    return starts, ends
+
+
+def _gather(buf, starts, ends, width, align_right=False):
+    """Gather variable-length fields into a 2-D (n_lines x width) byte
+    array padded with zeros."""
+    lengths = ends - starts
+    offsets = np.arange(width, dtype=starts.dtype)
+    if align_right:
+        idx = ends[:, None] - width + offsets
+        valid = offsets >= width - lengths[:, None]
+    else:
+        idx = starts[:, None] + offsets
+        valid = offsets < lengths[:, None]
+    chars = buf.take(idx, mode='clip')
+    chars[~valid] = 0
+    return chars, valid
+
+
+def _parse_ints(buf, starts, ends):
+    """Parse non-negative integer fields, returns None if any field is not
+    a valid integer."""
+    lengths = ends - starts
+    if lengths.size == 0:
+        return np.array([], dtype=np.int64)
+    width = lengths.max()
+    if lengths.min() < 1 or width > _POWERS_OF_TEN.size:
+        return None
+    chars, valid = _gather(buf, starts, ends, width, align_right=True)
+    # padded zeros become 208 (uint8 wrap-around) and are masked out
+    digits = chars - np.uint8(_DIGITS)
+    if np.any(valid & (digits > 9)):
+        return None
+    digits[~valid] = 0
+    return digits @ _POWERS_OF_TEN[width - 1::-1]
+
+
+def _parse_strings(buf, starts, ends, width=None):
+    """Parse fields as fixed-width byte strings (numpy.bytes_)."""
+    if width is None:
+        width = max((ends - starts).max(), 1)
+    chars, _ = _gather(buf, starts, ends, width)
+    return np.ascontiguousarray(chars).view(f'S{width}').ravel()
+
+
+def _group_by_chrom(chroms, positions, max_runs=64):
+    """Split positions into per-chromosome batches."""
+    if chroms.size == 0:
+        return
+    # reads are usually grouped by chromosome, split them by runs directly
+    bounds = np.flatnonzero(chroms[1:] != chroms[:-1]) + 1
+    if bounds.size < max_runs:
+        bounds = np.concatenate([[0], bounds, [chroms.size]])
+        for head, tail in zip(bounds[:-1], bounds[1:]):
+            yield chroms[head].decode(), positions[head:tail]
+        return
+    names, first, codes = np.unique(chroms, return_index=True,
+                                    return_inverse=True)
+    order = np.argsort(codes, kind='stable')
+    sizes = np.bincount(codes, minlength=names.size)
+    tails = np.cumsum(sizes)
+    heads = tails - sizes
+    # keep chromosomes in the order of their first appearance
+    for idx in np.argsort(first):
+        yield names[idx].decode(), positions[order[heads[idx]:tails[idx]]]
+
 
 class BedReadParser:
     """Read parser for the BED format."""
@@ -60,7 +176,7 @@ class BedReadParser:
     def parse(self, *args, **kwargs):
         """Parse lines to get reads from the input read file."""
         if self.is_gzipped:
-            fin = gzip.open(self.path, 'rb')
+            fin = gzip.open(self.path, 'rt')
         else:
             fin = open(self.path, 'r')
         line_num = 0
@@ -87,6 +203,127 @@ class BedReadParser:
                                       line=line)
         fin.close()
 
+    def _skip_header(self, block, line_num):
+        """Skip the header and empty lines at the beginning of a block.
+
+        Returns the rest of the block, the number of skipped lines and whether
+        the header may continue in the next block.
+        """
+        offset = 0
+        n_skipped = 0
+        while offset < len(block):
+            end = block.find(b'\n', offset)
+            end = len(block) if end == -1 else end + 1
+            line = block[offset:end].decode().strip()
+            if line:
+                if not self._is_header(line):
+                    return block[offset:], n_skipped, False
+                logger.debug(f"Detected header at line "
+                             f"{line_num + n_skipped + 1}: {line!r}")
+            n_skipped += 1
+            offset = end
+        return b'', n_skipped, True
+
+    @staticmethod
+    def _parse_block(buf, shift=100):
+        """Parse a block of lines into arrays with vectorized operations.
+
+        Returns
+        -------
+        chroms : numpy.ndarray or None
+            Chromosome names (bytes) of the reads, or None if the block is
+            not strictly well-formed and has to be parsed line by line.
+        positions : numpy.ndarray or None
+            Representative positions of the reads.
+        """
+        fields = _split_fields(buf, 6)
+        if fields is None:
+            return None, None
+        starts, ends = fields
+        start = _parse_ints(buf, starts[1], ends[1])
+        end = _parse_ints(buf, starts[2], ends[2])
+        if start is None or end is None:
+            return None, None
+        strand = buf[starts[5]]
+        is_forward = strand == ord('+')
+        if np.any(ends[5] - starts[5] != 1) or not np.all(
+                is_forward | (strand == ord('-'))):
+            return None, None
+        positions = np.where(is_forward, start + shift, end - shift)
+        return _parse_strings(buf, starts[0], ends[0]), positions
+
+    def _parse_lines(self, block, line_num, shift=100):
+        """Parse a block line by line, which reports the malformed line."""
+        batches = {}
+        for line in block.decode().split('\n'):
+            line_num += 1
+            line = line.strip()
+            if not line:  # skip empty lines
+                continue
+            try:
+                chrom, pos = self._parse_line(line, shift=shift)
+            except (IndexError, ValueError, TypeError):
+                raise FileFormatError(format=self.format, line_num=line_num,
+                                      line=line)
+            if chrom is not None:
+                batches.setdefault(chrom, []).append(pos)
+        for chrom, positions in batches.items():
+            yield chrom, np.array(positions, dtype=np.int64)
+
+    def parse_batches(self, paired=False, shift=100, block_size=1 << 24):
+        """Parse the read file block by block into per-chromosome batches.
+
+        Parameters
+        ----------
+        paired : bool, optional
+            Whether the reads are paired-end or not, default=False.
+        shift : int, optional
+            Shift size for single-end reads, default=100.
+        block_size : int, optional
+            Number of bytes to read per block, default=16MB.
+
+        Yields
+        ------
+        chrom : str
+            The chromosome name.
+        positions : numpy.ndarray
+            Representative positions of a batch of reads on the chromosome.
+        """
+        if self.is_gzipped:
+            fin = gzip.open(self.path, 'rb')
+        else:
+            fin = open(self.path, 'rb')
+        with fin:
+            line_num = 0  # number of lines before the current block
+            expect_header = True
+            remainder = b''
+            while True:
+                data = fin.read(block_size)
+                if data:
+                    data = remainder + data
+                    cut = data.rfind(b'\n') + 1
+                    block, remainder = data[:cut], data[cut:]
+                    if not block:
+                        continue
+                elif remainder:
+                    block, remainder = remainder + b'\n', b''
+                else:
+                    break
+                if expect_header:
+                    block, n_skipped, expect_header = self._skip_header(
+                        block, line_num)
+                    line_num += n_skipped
+                    if not block:
+                        continue
+                buf = np.frombuffer(block, dtype=np.uint8)
+                chroms, positions = self._parse_block(buf, shift=shift)
+                if chroms is None:
+                    yield from self._parse_lines(block[:-1], line_num,
+                                                 shift=shift)
+                else:
+                    yield from _group_by_chrom(chroms, positions)
+                line_num += block.count(b'\n')
+
 
 class BedPeReadParser(BedReadParser):
     """Read parser for the BEDPE format."""
@@ -111,20 +348,87 @@ class BedPeReadParser(BedReadParser):
         else:
             return None, None
 
+    @staticmethod
+    def _parse_block(buf, *args, **kwargs):
+        fields = _split_fields(buf, 6)
+        if fields is None:
+            return None, None
+        starts, ends = fields
+        values = [_parse_ints(buf, starts[k], ends[k]) for k in (1, 2, 4, 5)]
+        if any(value is None for value in values):
+            return None, None
+        start1, end1, start2, end2 = values
+        width = max((ends[0] - starts[0]).max(), (ends[3] - starts[3]).max(),
+                    1)
+        chrom1 = _parse_strings(buf, starts[0], ends[0], width)
+        chrom2 = _parse_strings(buf, starts[3], ends[3], width)
+        positions = (np.minimum(start1, start2) + np.maximum(end1, end2)) // 2
+        same_chrom = chrom1 == chrom2
+        return chrom1[same_chrom], positions[same_chrom]
+
 
 class SamReadParser:
     """Read parser for the SAM format.
     Ref: http://samtools.sourceforge.net/SAM1.pdf
+
+    Parameters
+    ----------
+    path : str
+        Path of the read file.
+    threads : int, optional
+        Number of htslib threads to decompress BGZF-compressed input,
+        default=1.
     """
 
-    def __init__(self, path):
+    def __init__(self, path, threads=1):
+        # pysam is only imported when SAM/BAM files are parsed
+        import pysam
         self.path = path
         self.format = 'SAM'
-        self.handle = pysam.AlignmentFile(self.path, 'r')
+        self.threads = threads
+        self.handle = pysam.AlignmentFile(self.path, 'r', threads=threads)
 
     def parse(self, paired=False, shift=100):
         """Parse lines to get reads from the input read file."""
-        for read in self.handle:
+        yield from self._parse_reads(self.handle, paired=paired, shift=shift)
+        self.handle.close()
+
+    def parse_batches(self, paired=False, shift=100, batch_size=1 << 20):
+        """Parse reads into per-chromosome batches.
+
+        Parameters
+        ----------
+        paired : bool, optional
+            Whether the reads are paired-end or not, default=False.
+        shift : int, optional
+            Shift size for single-end reads, default=100.
+        batch_size : int, optional
+            Maximum number of reads to hold before yielding the batches.
+
+        Yields
+        ------
+        chrom : str
+            The chromosome name.
+        positions : numpy.ndarray
+            Representative positions of a batch of reads on the chromosome.
+        """
+        batches = {}
+        n_reads = 0
+        for chrom, pos in self.parse(paired=paired, shift=shift):
+            batches.setdefault(chrom, []).append(pos)
+            n_reads += 1
+            if n_reads >= batch_size:
+                for chrom_batch, positions in batches.items():
+                    yield chrom_batch, np.array(positions, dtype=np.int64)
+                batches = {}
+                n_reads = 0
+        for chrom, positions in batches.items():
+            yield chrom, np.array(positions, dtype=np.int64)
+
+    @staticmethod
+    def _parse_reads(reads, paired=False, shift=100):
+        """Get the representative position of the given aligned reads."""
+        for read in reads:
             if read.is_unmapped or read.is_qcfail or read.is_secondary \
                     or read.is_supplementary:
                 continue
@@ -170,16 +474,157 @@ class SamReadParser:
                     else:
                         pos = start + shift
                     yield chrom, pos
-        self.handle.close()
 
 
 class BamReadParser(SamReadParser):
     """Read parser for BAM format."""
 
-    def __init__(self, path):
+    def __init__(self, path, threads=1):
+        # pysam is only imported when SAM/BAM files are parsed
+        import pysam
         self.path = path
         self.format = 'BAM'
-        self.handle = pysam.AlignmentFile(self.path, 'rb')
+        self.threads = threads
+        self.handle = pysam.AlignmentFile(self.path, 'rb', threads=threads)
+
+    @property
+    def has_index(self):
+        """Whether the BAM file has an index (.bai/.csi) or not."""
+        return self.handle.has_index()
+
+    def _fetch_windows(self, contig, starts, ends, flank):
+        """Fetch the reads starting within `flank` bp of the given windows."""
+        starts = np.maximum(starts - flank, 0)
+        ends = ends + flank
+        heads = np.flatnonzero(np.r_[True, starts[1:] >= ends[:-1]])
+        tails = np.r_[heads[1:], starts.size] - 1
+        for start, end in zip(starts[heads], ends[tails]):
+            for read in self.handle.fetch(contig, int(start), int(end)):
+                # reads starting ahead are fetched by the previous region
+                if read.reference_start >= start:
+                    yield read
+
+    def _parse_windows(self, contig, starts, ends, paired, shift, flank):
+        """Parse the reads fetched within `flank` bp of the given windows,
+        returns their representative positions and the longest fragment
+        (absolute TLEN) of the fetched proper pairs."""
+        max_tlen = 0
+
+        def _reads():
+            nonlocal max_tlen
+            for read in self._fetch_windows(contig, starts, ends, flank):
+                if read.is_proper_pair:
+                    max_tlen = max(max_tlen, abs(read.template_length))
+                yield read
+
+        positions = np.fromiter(
+            (pos for _, pos in self._parse_reads(
+                _reads(), paired=paired, shift=shift)),
+            dtype=np.int64)
+        return positions, max_tlen
+
+    def parse_contig(self, contig, paired=False, shift=100, windows=None):
+        """Parse reads located on the given contig with the BAM index.
+
+        Parameters
+        ----------
+        contig : str
+            The contig name.
+        paired : bool, optional
+            Whether the reads are paired-end or not, default=False.
+        shift : int, optional
+            Shift size for single-end reads, default=100.
+        windows : tuple of numpy.ndarray, optional
+            The starts and ends of sorted, non-overlapping windows on the
+            contig. If specified, only the reads starting within
+            `FETCH_FLANK` + `shift` bp of the windows are fetched and the
+            reads located in the windows are kept. For paired-end reads, the
+            windows are fetched again with a flank of the longest fragment
+            seen if any fetched fragment is longer than the flank, since the
+            midpoint of a fragment can be far from its reads.
+
+        Returns
+        -------
+        numpy.ndarray
+            Sorted representative positions of the reads.
+        """
+        if windows is None:
+            positions = np.fromiter(
+                (pos for _, pos in self._parse_reads(
+                    self.handle.fetch(contig), paired=paired, shift=shift)),
+                dtype=np.int64)
+        else:
+            starts, ends = windows
+            flank = FETCH_FLANK + abs(shift)
+            while True:
+                positions, max_tlen = self._parse_windows(
+                    contig, starts, ends, paired, shift, flank)
+                if not paired or max_tlen <= flank:
+                    break
+                flank = max_tlen
+            idx = np.searchsorted(starts, positions, side='right') - 1
+            positions = positions[
+                (idx >= 0) & (positions < ends[np.maximum(idx, 0)])]
+        positions.sort()
+        return positions
+
+    def parse_by_contig(self, paired=False, shift=100, processes=1,
+                        windows=None):
+        """Parse reads contig by contig with the BAM index in parallel.
+
+        Parameters
+        ----------
+        paired : bool, optional
+            Whether the reads are paired-end or not, default=False.
+        shift : int, optional
+            Shift size for single-end reads, default=100.
+        processes : int, optional
+            Number of worker processes, default=1.
+        windows : dict, optional
+            The starts and ends of sorted, non-overlapping windows keyed by
+            contig names. If specified, only the reads located in the windows
+            are parsed.
+
+        Yields
+        ------
+        contig : str
+            The contig name.
+        positions : numpy.ndarray
+            Sorted representative positions of the reads on the contig.
+        """
+        # schedule the largest contigs first to balance the workload
+        stats = sorted(self.handle.get_index_statistics(),
+                       key=lambda x: x.total, reverse=True)
+        contigs = [stat.contig for stat in stats if stat.total > 0]
+        if windows is not None:
+            contigs = [contig for contig in contigs if contig in windows]
+        else:
+            windows = {}
+        if processes == 1:
+            for contig in contigs:
+                yield contig, self.parse_contig(
+                    contig, paired=paired, shift=shift,
+                    windows=windows.get(contig))
+            self.handle.close()
+            return
+        self.handle.close()
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            futures = [executor.submit(_parse_bam_contig, self.path, contig,
+                                       paired, shift, windows.get(contig))
+                       for contig in contigs]
+            for contig, future in zip(contigs, futures):
+                yield contig, future.result()
+
+
+def _parse_bam_contig(path, contig, paired, shift, windows):
+    """Worker function to parse the reads on a contig of an indexed BAM."""
+    parser = BamReadParser(path)
+    try:
+        return parser.parse_contig(contig, paired=paired, shift=shift,
+                                   windows=windows)
+    finally:
+        parser.handle.close()
 
 
 def get_read_parser(format):
@@ -7,9 +7,13 @@ Module for genomic regions and MAnorm peaks.
 
 import logging
 import os
+from math import exp
 
+import numpy as np
+
+from manorm.chroms import registry
 from manorm.region.parsers import get_region_parser
-from manorm.stats import xy_to_ma, ma_to_xy, manorm_p
+from manorm.stats import MIN_LOG_P, xy_to_ma, ma_to_xy, manorm_log_p
 
 logger = logging.getLogger(__name__)
 
@@ -43,6 +47,9 @@ class GenomicRegion:
     summit : int
         The summit coordinate of the region.
 
+    chrom_id : int
+        The ID of the chromosome in `manorm.chroms.registry`.
+
     Notes
     -----
     The coordinates are 0-based, which means the region range is [start, end)
@@ -50,7 +57,7 @@ class GenomicRegion:
     """
 
     def __init__(self, chrom, start, end, summit=None):
-        self.chrom = chrom
+        self.chrom_id = registry.register(chrom)
         self.start = int(start)
         self.end = int(end)
         if self.start >= self.end:
@@ -65,6 +72,11 @@ class GenomicRegion:
                 f"expect start <= summit < end, got start={start} "
                 f"summit={summit} end={end}")
 
+    @property
+    def chrom(self):
+        """Returns the chromosome name of the region."""
+        return registry.name(self.chrom_id)
+
     def __repr__(self):
         return f"GenomicRegion({self.chrom}:{self.start}-{self.end})"
 
@@ -119,7 +131,9 @@ class ManormPeak(GenomicRegion):
     a_normed : float or None
         Normalized A value.
     p_value : float or None
-        The P value of MAnorm.
+        The P value of MAnorm, floored at exp(-500).
+    log_p_value : float or None
+        The natural logarithm of the P value, without the floor.
     iscommon : bool
         Indicator to show whether the peak is a common peak.
     summit_dis : int or None
@@ -132,8 +146,8 @@ class ManormPeak(GenomicRegion):
     `read_count2`, `read_density1`, `read_density2`, `m_raw`, `a_raw` are set
     to proper values.
     After the normalization step, fields `read_density1_normed`,
-    `read_density2_normed`, `m_normed`, `a_normed`, `p_value` are set to
-    proper values.
+    `read_density2_normed`, `m_normed`, `a_normed`, `p_value`,
+    `log_p_value` are set to proper values.
     """
 
     def __init__(self, chrom, start, end, summit=None):
@@ -151,6 +165,7 @@ class ManormPeak(GenomicRegion):
         self.m_normed = None
         self.a_normed = None
         self.p_value = None
+        self.log_p_value = None
         self.iscommon = False
         self.summit_dis = None
 
@@ -169,10 +184,28 @@ class ManormPeak(GenomicRegion):
         if window <= 0:
             raise ValueError(f"expect window size > 0, got {window}")
         extend = window // 2
-        self.read_count1 = reads1.count(self.chrom, self.summit - extend,
-                                        self.summit + extend) + 1
-        self.read_count2 = reads2.count(self.chrom, self.summit - extend,
-                                        self.summit + extend) + 1
+        count1 = reads1.count(self.chrom, self.summit - extend,
+                              self.summit + extend)
+        count2 = reads2.count(self.chrom, self.summit - extend,
+                              self.summit + extend)
+        self.set_read_counts(count1, count2, window)
+
+    def set_read_counts(self, count1, count2, window=2000):
+        """Set the read counts of the peak and calculate the read densities
+        and raw (M, A) values.
+
+        Parameters
+        ----------
+        count1 : int
+            The number of reads of sample 1 in the window around the summit.
+        count2 : int
+            The number of reads of sample 2 in the window around the summit.
+        window : int, optional
+            The window size used to count reads, default=2000.
+        """
+        extend = window // 2
+        self.read_count1 = int(count1) + 1
+        self.read_count2 = int(count2) + 1
         self.read_density1 = self.read_count1 * 1000 / (extend * 2)
         self.read_density2 = self.read_count2 * 1000 / (extend * 2)
         self.m_raw, self.a_raw = xy_to_ma(self.read_density1,
@@ -196,11 +229,82 @@ class ManormPeak(GenomicRegion):
         self.a_normed = self.a_raw
         self.read_density1_normed, self.read_density2_normed = ma_to_xy(
             self.m_normed, self.a_normed)
-        self.p_value = manorm_p(self.read_density1_normed,
-                                self.read_density2_normed)
+        self.log_p_value = manorm_log_p(self.read_density1_normed,
+                                        self.read_density2_normed)
+        self.p_value = exp(max(self.log_p_value, MIN_LOG_P))
         self.normalized = True
 
 
+class _IntervalIndex:
+    """Index of the intervals on a chromosome for bulk overlap and nearest
+    queries.
+
+    The starts and the ends of the intervals are sorted separately for the
+    overlap queries. The order of the intervals by their starts along with
+    the running maximum of their ends, which the nearest queries need, is
+    built on the first nearest query.
+
+    Parameters
+    ----------
+    starts : array_like of int
+        The start coordinates of the intervals.
+    ends : array_like of int
+        The end coordinates of the intervals.
+    """
+
+    def __init__(self, starts, ends):
+        self._starts = np.asarray(starts, dtype=np.int64)
+        self._ends = np.asarray(ends, dtype=np.int64)
+        self.size = self._starts.size
+        self.starts = np.sort(self._starts)
+        self.sorted_ends = np.sort(self._ends)
+        self.order = self.max_ends = self.max_end_idx = None
+
+    def _sort_by_start(self):
+        """Sort the intervals by their starts for the nearest queries."""
+        self.order = np.argsort(self._starts, kind='stable')
+        ends_by_start = self._ends[self.order]
+        self.max_ends = np.maximum.accumulate(ends_by_start)
+        # the (sorted) index of the interval holding the running maximum end
+        self.max_end_idx = np.maximum.accumulate(
+            np.where(ends_by_start == self.max_ends, np.arange(self.size), 0))
+
+    def count_overlaps(self, starts, ends):
+        """Returns the number of intervals overlapping each query interval.
+        """
+        # intervals starting before the query end, except for those ending
+        # before the query start
+        return self.starts.searchsorted(ends, side='left') - \
+            self.sorted_ends.searchsorted(starts, side='right')
+
+    def nearest(self, positions):
+        """Returns the index of the nearest interval of each position and the
+        distance to it."""
+        positions = np.asarray(positions, dtype=np.int64)
+        indices = np.full(positions.shape, -1, dtype=np.int64)
+        distances = np.full(positions.shape, -1, dtype=np.int64)
+        if self.size == 0:
+            return indices, distances
+        if self.order is None:
+            self._sort_by_start()
+        # among the intervals starting before the position, the one with the
+        # largest end is the nearest, otherwise the next interval is
+        num = self.starts.searchsorted(positions, side='right')
+        left = num > 0
+        left_dis = np.full(positions.shape, np.iinfo(np.int64).max)
+        left_dis[left] = np.maximum(
+            positions[left] - self.max_ends[num[left] - 1] + 1, 0)
+        right = num < self.size
+        right_dis = np.full(positions.shape, np.iinfo(np.int64).max)
+        right_dis[right] = self.starts[num[right]] - positions[right]
+        use_right = right_dis < left_dis
+        sorted_idx = np.where(use_right, num,
+                              self.max_end_idx[np.maximum(num - 1, 0)])
+        indices[:] = self.order[np.minimum(sorted_idx, self.size - 1)]
+        distances[:] = np.minimum(left_dis, right_dis)
+        return indices, distances
+
+
 class GenomicRegions:
     """Class for a collection of genomic regions.
 
@@ -213,11 +317,20 @@ class GenomicRegions:
     ----------
     name : str or None
         The name of the genomic regions.
+
+    Notes
+    -----
+    Regions are stored by the chromosome IDs in `manorm.chroms.registry`,
+    and the sorted chromosome names are cached until new chromosomes are
+    added. The interval index used by the overlap and nearest queries is
+    built on first use and dropped when regions are added or sorted.
     """
 
     def __init__(self, name=None):
         self.name = name
         self._data = {}
+        self._chroms = None
+        self._indexes = {}
 
     @property
     def chroms(self):
@@ -228,7 +341,10 @@ class GenomicRegions:
         list of str
             Chromosome names (sorted) of the genomic regions.
         """
-        return sorted(self._data.keys())
+        if self._chroms is None:
+            self._chroms = [registry.name(chrom_id)
+                            for chrom_id in registry.sort(self._data)]
+        return self._chroms
 
     @property
     def size(self):
@@ -246,8 +362,11 @@ class GenomicRegions:
         if not isinstance(region, GenomicRegion):
             raise ValueError("requires a `GenomicRegion` object to be added")
         else:
-            self._data.setdefault(region.chrom, [])
-            self._data[region.chrom].append(region)
+            if region.chrom_id not in self._data:
+                self._data[region.chrom_id] = []
+                self._chroms = None
+            self._data[region.chrom_id].append(region)
+            self._indexes = {}
 
     def sort(self, by='start', ascending=True):
         """Sort genomic regions.
@@ -259,9 +378,9 @@ class GenomicRegions:
         ascending : bool, optional
             Sort ascendingly or not, default=True.
         """
-        for chrom in self.chroms:
-            self._data[chrom].sort(key=lambda x: getattr(x, by),
-                                   reverse=not ascending)
+        for regions in self._data.values():
+            regions.sort(key=lambda x: getattr(x, by), reverse=not ascending)
+        self._indexes = {}
 
     def fetch(self, chrom):
         """Fetch genomic regions on specified chromosome.
@@ -276,11 +395,526 @@ class GenomicRegions:
         list
             A list of genomic regions on the specified chromosome.
         """
-        if chrom in self._data:
-            return self._data[chrom]
+        chrom_id = registry.lookup(chrom)
+        if chrom_id in self._data:
+            return self._data[chrom_id]
         else:
             return []
 
+    def column(self, chrom, name):
+        """Returns an attribute of the regions on specified chromosome as an
+        array.
+
+        Parameters
+        ----------
+        chrom : str
+            The chromosome name to fetch regions from.
+        name : str
+            The attribute name, e.g. 'start' or 'summit'.
+
+        Returns
+        -------
+        numpy.ndarray
+            The attribute values of the regions.
+        """
+        return np.array([getattr(region, name)
+                         for region in self.fetch(chrom)])
+
+    def set_column(self, chrom, name, values):
+        """Set an attribute of the regions on specified chromosome.
+
+        Parameters
+        ----------
+        chrom : str
+            The chromosome name of the regions.
+        name : str
+            The attribute name, e.g. 'iscommon'.
+        values : array_like
+            The attribute values of the regions.
+        """
+        regions = self.fetch(chrom)
+        values = np.asarray(values)
+        if values.ndim == 0:
+            values = np.full(len(regions), values)
+        if values.size != len(regions):
+            raise ValueError(f"expect {len(regions)} values, got "
+                             f"{values.size}")
+        for region, value in zip(regions, values.tolist()):
+            setattr(region, name, value)
+        if name in ('start', 'end'):
+            self._indexes = {}
+
+    def concat_column(self, name):
+        """Returns an attribute of all regions as an array, concatenated over
+        chromosomes in the order of `chroms`.
+
+        Parameters
+        ----------
+        name : str
+            The attribute name, e.g. 'm_raw'.
+
+        Returns
+        -------
+        numpy.ndarray
+            The attribute values of all regions.
+        """
+        columns = [self.column(chrom, name) for chrom in self.chroms]
+        if not columns:
+            return np.array([])
+        return np.concatenate(columns)
+
+    def set_concat_column(self, name, values):
+        """Set an attribute of all regions with values concatenated over
+        chromosomes in the order of `chroms`, or a scalar for all regions.
+
+        Parameters
+        ----------
+        name : str
+            The attribute name, e.g. 'm_normed'.
+        values : array_like
+            The attribute values.
+        """
+        values = np.asarray(values)
+        if values.ndim > 0 and values.size != self.size:
+            raise ValueError(f"expect {self.size} values, got {values.size}")
+        head = 0
+        for chrom in self.chroms:
+            size = len(self.fetch(chrom))
+            if values.ndim > 0:
+                self.set_column(chrom, name, values[head:head + size])
+            else:
+                self.set_column(chrom, name, values)
+            head += size
+
+    def _index(self, chrom):
+        """Returns the interval index of the regions on given chromosome."""
+        chrom_id = registry.lookup(chrom)
+        if chrom_id not in self._indexes:
+            self._indexes[chrom_id] = _IntervalIndex(
+                self.column(chrom, 'start'), self.column(chrom, 'end'))
+        return self._indexes[chrom_id]
+
+    def count_overlaps(self, chrom, starts, ends):
+        """Count the regions overlapping each of the given intervals.
+
+        Parameters
+        ----------
+        chrom : str
+            The chromosome name of the intervals.
+        starts : array_like of int
+            The start positions of the intervals.
+        ends : array_like of int
+            The end positions of the intervals.
+
+        Returns
+        -------
+        numpy.ndarray
+            The number of regions overlapping each interval (by at least
+            1bp).
+        """
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        if starts.shape != ends.shape:
+            raise ValueError(
+                f"expect starts and ends of the same shape, got: "
+                f"{starts.shape} and {ends.shape}")
+        if np.any(starts >= ends):
+            raise ValueError("expect start < end for all intervals")
+        return self._index(chrom).count_overlaps(starts, ends)
+
+    def overlaps(self, other):
+        """Check whether the regions overlap with the other regions.
+
+        Parameters
+        ----------
+        other : `GenomicRegions`
+            The other genomic regions.
+
+        Returns
+        -------
+        dict
+            Boolean arrays keyed by chromosome names, indicating whether each
+            region (in the order of `fetch`) overlaps with any of the other
+            regions.
+        """
+        flags = {}
+        for chrom in self.chroms:
+            flags[chrom] = other.count_overlaps(
+                chrom, self.column(chrom, 'start'),
+                self.column(chrom, 'end')) > 0
+        return flags
+
+    def nearest(self, chrom, positions):
+        """Find the nearest region of each position.
+
+        Parameters
+        ----------
+        chrom : str
+            The chromosome name of the positions.
+        positions : array_like of int
+            The genomic positions.
+
+        Returns
+        -------
+        indices : numpy.ndarray
+            The index (in the order of `fetch`) of the nearest region of each
+            position, or -1 if there is no region on the chromosome.
+        distances : numpy.ndarray
+            The distance from each position to its nearest region, which is 0
+            for positions inside the region, or -1 if there is no region on
+            the chromosome.
+        """
+        return self._index(chrom).nearest(positions)
+
+
+# columns of `ManormPeaks` with their dtypes and the values standing for None
+_PEAK_COLUMNS = {
+    'start': (np.int64, None),
+    'end': (np.int64, None),
+    'summit': (np.int64, None),
+    'iscommon': (np.bool_, None),
+    'summit_dis': (np.int64, -1),
+    'counted': (np.bool_, None),
+    'read_count1': (np.int64, -1),
+    'read_count2': (np.int64, -1),
+    'read_density1': (np.float64, np.nan),
+    'read_density2': (np.float64, np.nan),
+    'm_raw': (np.float64, np.nan),
+    'a_raw': (np.float64, np.nan),
+    'normalized': (np.bool_, None),
+    'read_density1_normed': (np.float64, np.nan),
+    'read_density2_normed': (np.float64, np.nan),
+    'm_normed': (np.float64, np.nan),
+    'a_normed': (np.float64, np.nan),
+    'p_value': (np.float64, np.nan),
+    'log_p_value': (np.float64, np.nan),
+}
+
+
+def _empty_peak_table(size=0):
+    """Returns a peak table of given size filled with missing values."""
+    table = {}
+    for name, (dtype, missing) in _PEAK_COLUMNS.items():
+        table[name] = np.full(size, False if missing is None else missing,
+                              dtype=dtype)
+    return table
+
+
+def _column_property(name):
+    """Returns a property reading/writing a column of the peak table."""
+    missing = _PEAK_COLUMNS[name][1]
+
+    def fget(self):
+        value = self._peaks._table(self.chrom_id)[name][self._index].item()
+        if missing is not None and (value == missing or value != value):
+            return None
+        return value
+
+    def fset(self, value):
+        if value is None:
+            value = missing
+        self._peaks._table(self.chrom_id)[name][self._index] = value
+
+    return property(fget, fset)
+
+
+class ManormPeakView(ManormPeak):
+    """Row view of a peak stored in `ManormPeaks`.
+
+    The attributes of the view read and write the columns of the peak table,
+    so that code working with `ManormPeak` objects works on columnar peaks
+    as well. A view refers to the row position of the peak, which changes
+    when the peaks are sorted.
+
+    Parameters
+    ----------
+    peaks : `ManormPeaks`
+        The peak collection.
+    chrom_id : int
+        The chromosome ID of the peak.
+    index : int
+        The row index of the peak on the chromosome.
+    """
+
+    def __init__(self, peaks, chrom_id, index):
+        self._peaks = peaks
+        self.chrom_id = chrom_id
+        self._index = index
+
+
+for _name in _PEAK_COLUMNS:
+    setattr(ManormPeakView, _name, _column_property(_name))
+
+
+class ManormPeaks(GenomicRegions):
+    """Class for a columnar collection of MAnorm peaks.
+
+    Parameters
+    ----------
+    name : str, optional
+        The name of the peaks.
+
+    Attributes
+    ----------
+    name : str or None
+        The name of the peaks.
+
+    Notes
+    -----
+    The peaks on each chromosome are stored as a table of NumPy arrays, one
+    column per attribute of `ManormPeak` (start, end, summit, iscommon,
+    summit_dis, read counts, read densities, M/A values, P value, etc.).
+    Missing values are stored as NaN (float columns) or -1 (`summit_dis` and
+    read counts). Use `column` and `set_column` to work on whole columns,
+    while `fetch` returns row views (`ManormPeakView`) for compatibility.
+    """
+
+    def __init__(self, name=None):
+        super().__init__(name=name)
+        self._pending = {}
+
+    @property
+    def chroms(self):
+        """Returns sorted chromosome names of the peaks.
+
+        Returns
+        -------
+        list of str
+            Chromosome names (sorted) of the peaks.
+        """
+        if self._chroms is None:
+            chrom_ids = registry.sort(set(self._data) | set(self._pending))
+            self._chroms = [registry.name(chrom_id) for chrom_id in chrom_ids]
+        return self._chroms
+
+    @property
+    def size(self):
+        """Returns the number of peaks."""
+        return sum(table['start'].size for table in self._data.values()) + \
+            sum(len(peaks) for peaks in self._pending.values())
+
+    def add(self, region):
+        """Add a peak into the collection.
+
+        Parameters
+        ----------
+        region : ManormPeak
+            The peak to be added into the collection.
+        """
+        if not isinstance(region, ManormPeak):
+            raise ValueError("requires a `ManormPeak` object to be added")
+        if region.chrom_id not in self._pending:
+            if region.chrom_id not in self._data:
+                self._chroms = None
+            self._pending[region.chrom_id] = []
+        self._pending[region.chrom_id].append(region)
+        self._indexes = {}
+
+    def add_many(self, chrom, starts, ends, summits=None):
+        """Add peaks on the same chromosome.
+
+        Parameters
+        ----------
+        chrom : str
+            The chromosome name of the peaks.
+        starts : array_like of int
+            The start coordinates of the peaks.
+        ends : array_like of int
+            The end coordinates of the peaks.
+        summits : array_like of int, optional
+            The summit coordinates of the peaks. If not specified, the middle
+            points will be taken as the summits.
+        """
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        if summits is None:
+            summits = (starts + ends) // 2
+        else:
+            summits = np.asarray(summits, dtype=np.int64)
+        if not starts.shape == ends.shape == summits.shape:
+            raise ValueError("expect starts, ends and summits of the same "
+                             "shape")
+        invalid = np.flatnonzero(starts >= ends)
+        if invalid.size > 0:
+            idx = invalid[0]
+            raise ValueError(f"expect start < end, got: start={starts[idx]} "
+                             f"end={ends[idx]}")
+        invalid = np.flatnonzero((summits < starts) | (summits >= ends))
+        if invalid.size > 0:
+            idx = invalid[0]
+            raise ValueError(
+                f"expect start <= summit < end, got start={starts[idx]} "
+                f"summit={summits[idx]} end={ends[idx]}")
+        table = _empty_peak_table(starts.size)
+        table['start'] = starts
+        table['end'] = ends
+        table['summit'] = summits
+        self._append(registry.register(chrom), table)
+
+    def _append(self, chrom_id, table):
+        """Append a peak table after the peaks on the chromosome."""
+        if chrom_id in self._pending:
+            self._flush()
+        if chrom_id in self._data:
+            table = {name: np.concatenate([self._data[chrom_id][name],
+                                           table[name]])
+                     for name in _PEAK_COLUMNS}
+        else:
+            self._chroms = None
+        self._data[chrom_id] = table
+        self._indexes = {}
+
+    def _flush(self):
+        """Move the peaks added one by one into the peak tables."""
+        pending, self._pending = self._pending, {}
+        for chrom_id, peaks in pending.items():
+            table = _empty_peak_table(len(peaks))
+            for name, (_, missing) in _PEAK_COLUMNS.items():
+                values = [getattr(peak, name) for peak in peaks]
+                if missing is not None:
+                    values = [missing if value is None else value
+                              for value in values]
+                table[name][:] = values
+            self._append(chrom_id, table)
+
+    def _table(self, chrom_id):
+        if self._pending:
+            self._flush()
+        return self._data[chrom_id]
+
+    def sort(self, by='start', ascending=True):
+        """Sort peaks.
+
+        Parameters
+        ----------
+        by : str, optional
+            Which column is used to sort by, default='start'.
+        ascending : bool, optional
+            Sort ascendingly or not, default=True.
+        """
+        if self._pending:
+            self._flush()
+        for table in self._data.values():
+            keys = table[by].astype(np.float64)
+            if not ascending:
+                keys = -keys
+            order = np.argsort(keys, kind='stable')
+            for name in _PEAK_COLUMNS:
+                table[name] = table[name][order]
+        self._indexes = {}
+
+    def fetch(self, chrom):
+        """Fetch peaks on specified chromosome.
+
+        Parameters
+        ----------
+        chrom : str
+             The chromosome name to fetch peaks from.
+
+        Returns
+        -------
+        list of `ManormPeakView`
+            Row views of the peaks on the specified chromosome.
+        """
+        chrom_id = registry.lookup(chrom)
+        if chrom_id not in self._data and chrom_id not in self._pending:
+            return []
+        size = self._table(chrom_id)['start'].size
+        return [ManormPeakView(self, chrom_id, idx) for idx in range(size)]
+
+    def column(self, chrom, name):
+        """Returns a column of the peaks on specified chromosome.
+
+        Parameters
+        ----------
+        chrom : str
+            The chromosome name to fetch peaks from.
+        name : str
+            The column name, e.g. 'summit' or 'm_normed'.
+
+        Returns
+        -------
+        numpy.ndarray
+            The column array, which is modified in place when written.
+        """
+        if name not in _PEAK_COLUMNS:
+            raise ValueError(f"unknown peak column: {name!r}")
+        chrom_id = registry.lookup(chrom)
+        if chrom_id not in self._data and chrom_id not in self._pending:
+            dtype, _ = _PEAK_COLUMNS[name]
+            return np.array([], dtype=dtype)
+        return self._table(chrom_id)[name]
+
+    def set_column(self, chrom, name, values):
+        """Set a column of the peaks on specified chromosome.
+
+        Parameters
+        ----------
+        chrom : str
+            The chromosome name of the peaks.
+        name : str
+            The column name, e.g. 'iscommon'.
+        values : array_like
+            The column values, missing values can be given as None.
+        """
+        column = self.column(chrom, name)
+        missing = _PEAK_COLUMNS[name][1]
+        if missing is not None and np.ndim(values) > 0 and any(
+                value is None for value in values):
+            values = [missing if value is None else value for value in values]
+        values = np.asarray(values)
+        if values.ndim > 0 and values.size != column.size:
+            raise ValueError(f"expect {column.size} values, got "
+                             f"{values.size}")
+        column[:] = values
+        if name in ('start', 'end'):
+            self._indexes = {}
+
+    def concat_column(self, name):
+        """Returns a column of all peaks, concatenated over chromosomes in
+        the order of `chroms`.
+
+        Parameters
+        ----------
+        name : str
+            The column name, e.g. 'm_raw'.
+
+        Returns
+        -------
+        numpy.ndarray
+            The concatenated column, which is a copy of the peak table.
+        """
+        columns = [self.column(chrom, name) for chrom in self.chroms]
+        if not columns:
+            dtype, _ = _PEAK_COLUMNS[name]
+            return np.array([], dtype=dtype)
+        return np.concatenate(columns)
+
+    def set_concat_column(self, name, values):
+        """Set a column of all peaks with values concatenated over
+        chromosomes in the order of `chroms`, or a scalar for all peaks.
+
+        Parameters
+        ----------
+        name : str
+            The column name, e.g. 'm_normed'.
+        values : array_like
+            The column values.
+        """
+        values = np.asarray(values)
+        if values.ndim > 0 and values.size != self.size:
+            raise ValueError(f"expect {self.size} values, got {values.size}")
+        head = 0
+        for chrom in self.chroms:
+            column = self.column(chrom, name)
+            if values.ndim > 0:
+                column[:] = values[head:head + column.size]
+            else:
+                column[:] = values
+            head += column.size
+        if name in ('start', 'end'):
+            self._indexes = {}
+
 
 def load_genomic_regions(path, format='bed', name=None):
     """Read genomic regions from the specified path.
@@ -327,16 +961,24 @@ def load_manorm_peaks(path, format='bed', name=None):
 
     Returns
     -------
-    peaks : GenomicRegions
+    peaks : ManormPeaks
         Loaded peaks.
     """
     logger.info(f"Loading peaks from {path} [{format}]")
     if name is None:
         name = os.path.splitext(os.path.basename(path))[0]
     parser = get_region_parser(format)()
-    peaks = GenomicRegions(name)
+    peaks = ManormPeaks(name)
+    columns = {}
     for chrom, start, end, summit in parser.parse(path):
-        peaks.add(ManormPeak(chrom, start, end, summit))
+        if summit is None:
+            summit = (start + end) // 2
+        chrom_columns = columns.setdefault(chrom, ([], [], []))
+        chrom_columns[0].append(start)
+        chrom_columns[1].append(end)
+        chrom_columns[2].append(summit)
+    for chrom, (starts, ends, summits) in columns.items():
+        peaks.add_many(chrom, starts, ends, summits)
     peaks.sort()
     logger.info(f"Loaded {peaks.size} peaks")
     return peaks
@@ -6,28 +6,59 @@ Support functions for operations on MAnorm peaks.
 """
 
 import logging
-import random
 
 import numpy as np
 
-from manorm.region import GenomicRegion, ManormPeak, GenomicRegions
+from manorm.region import ManormPeaks, _IntervalIndex
 
 logger = logging.getLogger(__name__)
 
 
+def _merge_intervals(starts, ends):
+    """Merge overlapping intervals, returns the sorted starts and ends of the
+    merged intervals. Intervals only touching each other are not merged."""
+    order = np.argsort(starts, kind='stable')
+    starts = np.asarray(starts)[order]
+    ends = np.asarray(ends)[order]
+    max_ends = np.maximum.accumulate(ends)
+    # a new interval begins where the start is beyond all previous ends
+    heads = np.flatnonzero(np.r_[True, starts[1:] >= max_ends[:-1]])
+    tails = np.r_[heads[1:], starts.size] - 1
+    return starts[heads], max_ends[tails]
+
+
+def merge_peak_windows(peaks1, peaks2, window=2000):
+    """Returns the merged regions covering the read counting windows of the
+    specified peak sets.
+
+    Each peak is extended by half of the window size on both sides, which
+    covers the window around its summit and the windows around the summits
+    of the merged common peaks located in it.
+    """
+    extend = window // 2
+    # stored as columns, the windows are only accessed by `column`
+    windows = ManormPeaks(name='peak_windows')
+    for chrom in sorted(set(peaks1.chroms) | set(peaks2.chroms)):
+        starts = np.concatenate([peaks1.column(chrom, 'start'),
+                                 peaks2.column(chrom, 'start')])
+        ends = np.concatenate([peaks1.column(chrom, 'end'),
+                               peaks2.column(chrom, 'end')])
+        starts = np.maximum(starts.astype(np.int64) - extend, 0)
+        ends = ends.astype(np.int64) + extend
+        windows.add_many(chrom, *_merge_intervals(starts, ends))
+    return windows
+
+
 def overlap_on_same_chrom(regions1, regions2):
     """Given two sets of genomic regions(peaks) located on the same chromosome,
     returns the region overlap indicators of them.
     """
-    overlap_flag1 = np.zeros(len(regions1), dtype=bool)
-    overlap_flag2 = np.zeros(len(regions2), dtype=bool)
-    for i, region_i in enumerate(regions1):
-        for j, region_j in enumerate(regions2):
-            if (region_i.end - region_j.start) * (
-                    region_j.end - region_i.start) > 0:
-                overlap_flag1[i] = True
-                overlap_flag2[j] = True
-    return overlap_flag1, overlap_flag2
+    starts1 = [region.start for region in regions1]
+    ends1 = [region.end for region in regions1]
+    starts2 = [region.start for region in regions2]
+    ends2 = [region.end for region in regions2]
+    return (_IntervalIndex(starts2, ends2).count_overlaps(starts1, ends1) > 0,
+            _IntervalIndex(starts1, ends1).count_overlaps(starts2, ends2) > 0)
 
 
 def classify_peaks_by_overlap(peaks1, peaks2):
@@ -35,123 +66,310 @@ def classify_peaks_by_overlap(peaks1, peaks2):
     for every individual peak.
     """
     logger.debug("Classifying unique/common peaks by overlap")
-    for chrom in set(peaks1.chroms) | set(peaks2.chroms):
-        logger.debug(f"Classifying peaks on {chrom}")
-        peaks1_chrom = peaks1.fetch(chrom)
-        peaks2_chrom = peaks2.fetch(chrom)
-        overlap_flag1, overlap_flag2 = overlap_on_same_chrom(
-            peaks1_chrom, peaks2_chrom)
-        for peak, flag in zip(peaks1_chrom, overlap_flag1):
-            peak.iscommon = flag
-        for peak, flag in zip(peaks2_chrom, overlap_flag2):
-            peak.iscommon = flag
+    for chrom, overlap_flag in peaks1.overlaps(peaks2).items():
+        peaks1.set_column(chrom, 'iscommon', overlap_flag)
+    for chrom, overlap_flag in peaks2.overlaps(peaks1).items():
+        peaks2.set_column(chrom, 'iscommon', overlap_flag)
     return peaks1, peaks2
 
 
+def _merge_clusters(starts, ends, summits):
+    """Merge overlapping peaks into clusters, returns the starts, ends,
+    summits and summit distances of the merged peaks.
+
+    The summit of a merged peak is the middle of its two nearest adjacent
+    summits, and the summit distance is the distance between them.
+    """
+    order = np.argsort(starts, kind='stable')
+    starts, ends, summits = starts[order], ends[order], summits[order]
+    max_ends = np.maximum.accumulate(ends)
+    # a new cluster begins where the start is beyond all previous ends
+    is_head = np.r_[True, starts[1:] >= max_ends[:-1]]
+    cluster_ids = np.cumsum(is_head) - 1
+    heads = np.flatnonzero(is_head)
+    tails = np.r_[heads[1:], starts.size] - 1
+    # sort the summits within each cluster
+    order = np.lexsort((summits, cluster_ids))
+    summits = summits[order]
+    # adjacent summit pairs within the same cluster, the first pair of the
+    # minimum distance is taken for each cluster
+    pairs = np.flatnonzero(cluster_ids[1:] == cluster_ids[:-1])
+    pair_dis = summits[pairs + 1] - summits[pairs]
+    pair_order = np.lexsort((pairs, pair_dis, cluster_ids[pairs]))
+    pair_clusters, first = np.unique(cluster_ids[pairs][pair_order],
+                                     return_index=True)
+    best = pairs[pair_order[first]]
+    # single peaks keep their own summits
+    merged_summits = summits[heads].copy()
+    summit_dis = np.zeros(heads.size, dtype=np.int64)
+    merged_summits[pair_clusters] = (summits[best] + summits[best + 1]) // 2
+    summit_dis[pair_clusters] = summits[best + 1] - summits[best]
+    return starts[heads], max_ends[tails], merged_summits, summit_dis
+
+
 def merge_common_peaks(peaks1, peaks2):
     """Merge common (overlapping) peaks of the specified peak sets and
     returns the merged peaks.
     """
-
-    def _merge_peak(chrom, start, end, summits):
-        # take the middle of two nearest neighbour peaks as new summit
-        summits.sort()
-        min_dis = None
-        for i, head in enumerate(summits[:-1]):
-            tail = summits[i + 1]
-            if min_dis is None or min_dis > (tail - head):
-                min_dis = tail - head
-                summit = (head + tail) // 2
-        peak = ManormPeak(chrom, start, end, summit)
-        peak.iscommon = True
-        peak.summit_dis = min_dis
-        return peak
-
     logger.debug("Merging common peaks")
-    peaks_merged = GenomicRegions(name='merged_common_peaks')
-    for chrom in set(peaks1.chroms) & set(peaks2.chroms):
+    peaks_merged = ManormPeaks(name='merged_common_peaks')
+    for chrom in sorted(set(peaks1.chroms) & set(peaks2.chroms)):
         logger.debug(f"Merging peaks on {chrom}")
-        peaks_mixed = []
-        for peak in peaks1.fetch(chrom):
-            if peak.iscommon:
-                peaks_mixed.append(peak)
-        for peak in peaks2.fetch(chrom):
-            if peak.iscommon:
-                peaks_mixed.append(peak)
-        if len(peaks_mixed) == 0:
+        columns = {'start': [], 'end': [], 'summit': []}
+        for peaks in (peaks1, peaks2):
+            iscommon = peaks.column(chrom, 'iscommon').astype(bool)
+            for name, values in columns.items():
+                values.append(peaks.column(chrom, name)[iscommon])
+        starts, ends, summits = (np.concatenate(values).astype(np.int64)
+                                 for values in columns.values())
+        if starts.size == 0:
             continue
-        peaks_mixed.sort(key=lambda x: x.start)
-
-        idx = 0
-        peak = peaks_mixed[idx]
-        start = peak.start  # the left-most pos of continuous overlapping peaks
-        end = peak.end  # the right-most pos of continuous overlapping peaks
-        summits = [peak.summit]
-        while True:
-            idx += 1
-            if idx < len(peaks_mixed):
-                peak = peaks_mixed[idx]
-                if peak.start < end:  # current peak overlaps with the last one
-                    end = max(end, peak.end)
-                    summits.append(peak.summit)
-                else:  # not overlap
-                    peaks_merged.add(_merge_peak(chrom, start, end, summits))
-                    start = peak.start
-                    end = peak.end
-                    summits = [peak.summit]
-            else:  # add the final one
-                peaks_merged.add(_merge_peak(chrom, start, end, summits))
-                break
+        starts, ends, summits, summit_dis = _merge_clusters(starts, ends,
+                                                            summits)
+        peaks_merged.add_many(chrom, starts, ends, summits)
+        peaks_merged.set_column(chrom, 'iscommon', True)
+        peaks_merged.set_column(chrom, 'summit_dis', summit_dis)
     return peaks_merged
 
 
-def generate_random_regions(ref_regions):
+def _random_starts(rng, starts):
+    """Draw random starts uniformly between the minimum and maximum of the
+    template starts."""
+    return rng.integers(starts.min(), starts.max(), endpoint=True,
+                        size=starts.size)
+
+
+def _count_random_overlaps(starts, ends, rand_starts, rand_ends):
+    """Count the intervals overlapping with any of the random intervals for
+    each simulation (row) of the random intervals."""
+    num_sim, num_rand = rand_starts.shape
+    if num_rand == 0 or starts.size == 0:
+        return np.zeros(num_sim, dtype=np.int64)
+    # offset the rows into disjoint ranges, so that all simulations are
+    # queried at once with a single interval index
+    low = min(rand_starts.min(), starts.min())
+    span = max(rand_ends.max(), ends.max()) - low + 1
+    offsets = np.arange(num_sim, dtype=np.int64)[:, np.newaxis] * span - low
+    index = _IntervalIndex((rand_starts + offsets).ravel(),
+                           (rand_ends + offsets).ravel())
+    counts = index.count_overlaps(starts + offsets, ends + offsets)
+    return np.count_nonzero(counts, axis=1)
+
+
+def generate_random_regions(ref_regions, seed=None):
     """Generate random control regions from the given reference regions.
     The length and chromosome distribution for each region are controlled to
     match the reference regions.
+
+    `seed` can be an int or a `numpy.random.Generator` to draw from.
     """
-    regions_random = GenomicRegions(name='random')
+    rng = np.random.default_rng(seed)
+    regions_random = ManormPeaks(name='random')
     for chrom in ref_regions.chroms:
-        templates = ref_regions.fetch(chrom)
-        if len(templates) == 0:
+        starts = ref_regions.column(chrom, 'start').astype(np.int64)
+        if starts.size == 0:
             continue
-        starts = [region.start for region in templates]
-        lengths = [region.end - region.start for region in templates]
-        start_min = min(starts)
-        start_max = max(starts)
-        for length in lengths:
-            tmp_start = random.randint(start_min, start_max)
-            regions_random.add(
-                GenomicRegion(chrom, tmp_start, tmp_start + length))
+        lengths = ref_regions.column(chrom, 'end') - starts
+        rand_starts = _random_starts(rng, starts)
+        regions_random.add_many(chrom, rand_starts, rand_starts + lengths)
     return regions_random
 
 
-def random_peak_overlap(peaks1, peaks2, n_random):
+def _pack_peaks(peaks1, peaks2):
+    """Pack the peak intervals used in the random simulations into a single
+    int64 array, returns the array and the (offset, size) of the starts and
+    ends of peaks1, and the starts and lengths of peaks2 on each chromosome.
+    """
+    arrays = []
+    layout = []
+    offset = 0
+    for chrom in peaks2.chroms:
+        starts1 = peaks1.column(chrom, 'start')
+        starts2 = peaks2.column(chrom, 'start')
+        if starts1.size == 0 or starts2.size == 0:
+            continue
+        chrom_arrays = [starts1, peaks1.column(chrom, 'end'), starts2,
+                        peaks2.column(chrom, 'end') - starts2]
+        chrom_layout = []
+        for values in chrom_arrays:
+            chrom_layout.append((offset, values.size))
+            offset += values.size
+        arrays.extend(chrom_arrays)
+        layout.append(chrom_layout)
+    if not arrays:
+        return np.zeros(0, dtype=np.int64), layout
+    return np.concatenate(arrays).astype(np.int64), layout
+
+
+def _simulate_overlaps(data, layout, seeds, batch_size):
+    """Run the random simulations with given seeds, returns the number of
+    overlapping peaks in each simulation."""
+    rngs = [np.random.default_rng(seed) for seed in seeds]
+    n_overlap = np.zeros(len(rngs), dtype=np.int64)
+    for chrom_layout in layout:
+        starts1, ends1, starts2, lengths = [
+            data[offset:offset + size] for offset, size in chrom_layout]
+        batch = max(1, batch_size // max(starts1.size, starts2.size))
+        for head in range(0, len(rngs), batch):
+            rand_starts = np.stack([_random_starts(rng, starts2)
+                                    for rng in rngs[head:head + batch]])
+            n_overlap[head:head + batch] += _count_random_overlaps(
+                starts1, ends1, rand_starts, rand_starts + lengths)
+    return n_overlap
+
+
+# peak intervals attached from the shared memory in worker processes
+_worker_peaks = {}
+
+
+def _init_simulation_worker(shm_name, size, layout):
+    from multiprocessing import shared_memory
+    shm = shared_memory.SharedMemory(name=shm_name)
+    _worker_peaks['shm'] = shm
+    _worker_peaks['data'] = np.ndarray(size, dtype=np.int64, buffer=shm.buf)
+    _worker_peaks['layout'] = layout
+
+
+def _import_shared_memory():
+    """Returns the `multiprocessing.shared_memory` module, or None if it is
+    not available (Python < 3.8)."""
+    try:
+        from multiprocessing import shared_memory
+    except ImportError:
+        return None
+    return shared_memory
+
+
+def _simulation_worker(seeds, batch_size):
+    """Worker function to run random simulations on the shared peaks."""
+    return _simulate_overlaps(_worker_peaks['data'], _worker_peaks['layout'],
+                              seeds, batch_size)
+
+
+def random_peak_overlap(peaks1, peaks2, n_random, seed=None, processes=1,
+                        batch_size=1 << 22):
     """Calculate the number of overlapping peaks between peaks1 and
     random control peaks generated based on peaks2.
+
+    Each simulation draws from an independent random stream spawned from the
+    `seed`, so the results are reproducible given the `seed` regardless of
+    the number of processes. Random starts are drawn as 2-D arrays in batches
+    of at most about `batch_size` intervals.
+
+    Parameters
+    ----------
+    peaks1 : `ManormPeaks`
+        The peaks to count the overlaps.
+    peaks2 : `ManormPeaks`
+        The template peaks to generate the random peaks.
+    n_random : int
+        Number of random simulations.
+    seed : int, optional
+        The random seed.
+    processes : int, optional
+        Number of worker processes, default=1. The peak intervals are shared
+        with workers via shared memory, or sent with each task if shared
+        memory is not supported (Python < 3.8).
+    batch_size : int, optional
+        The maximum number of random intervals drawn at once.
+
+    Returns
+    -------
+    numpy.ndarray
+        The number of overlapping peaks in each simulation.
+    """
+    seeds = np.random.SeedSequence(seed).spawn(n_random)
+    data, layout = _pack_peaks(peaks1, peaks2)
+    processes = min(processes, n_random)
+    if processes <= 1 or data.size == 0:
+        return _simulate_overlaps(data, layout, seeds, batch_size)
+    from concurrent.futures import ProcessPoolExecutor
+    # split into more chunks than workers to balance the workload
+    chunk_size = -(-n_random // (processes * 4))
+    chunks = [seeds[head:head + chunk_size]
+              for head in range(0, n_random, chunk_size)]
+    shared_memory = _import_shared_memory()
+    if shared_memory is None:
+        # the peaks are pickled with each task instead
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            futures = [executor.submit(_simulate_overlaps, data, layout, chunk,
+                                       batch_size) for chunk in chunks]
+            return np.concatenate([future.result() for future in futures])
+    shm = shared_memory.SharedMemory(create=True, size=data.nbytes)
+    try:
+        np.ndarray(data.size, dtype=np.int64, buffer=shm.buf)[:] = data
+        with ProcessPoolExecutor(
+                max_workers=processes, initializer=_init_simulation_worker,
+                initargs=(shm.name, data.size, layout)) as executor:
+            futures = [executor.submit(_simulation_worker, chunk, batch_size)
+                       for chunk in chunks]
+            return np.concatenate([future.result() for future in futures])
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def expected_peak_overlap(peaks1, peaks2, chunk_size=1 << 22):
+    """Calculate the expected number of overlapping peaks between peaks1 and
+    the random control peaks generated based on peaks2 analytically.
+
+    Random peaks start uniformly between the minimum and maximum starts of
+    peaks2 on each chromosome, as in `generate_random_regions`, so the
+    probability that a peak in peaks1 overlaps with none of the random peaks
+    can be computed in closed form from the lengths of peaks2. The variance
+    ignores the weak dependence between nearby peaks in peaks1.
+
+    Parameters
+    ----------
+    peaks1 : `ManormPeaks`
+        The peaks to count the overlaps.
+    peaks2 : `ManormPeaks`
+        The template peaks to generate the random peaks.
+    chunk_size : int, optional
+        The maximum number of peak/length pairs computed at once.
+
+    Returns
+    -------
+    mean : float
+        The expected number of overlapping peaks.
+    std : float
+        The standard deviation of the number of overlapping peaks.
     """
-    n_overlap_rand = []
-    for _ in range(n_random):
-        peak_rand = generate_random_regions(peaks2)
-        n_overlap = 0
-        for chrom in set(peaks1.chroms) & set(peak_rand.chroms):
-            flag_overlap, _ = overlap_on_same_chrom(peaks1.fetch(chrom),
-                                                    peak_rand.fetch(chrom))
-            n_overlap += flag_overlap.sum()
-        n_overlap_rand.append(n_overlap)
-    n_overlap_rand = np.array(n_overlap_rand)
-    n_overlap_mean = n_overlap_rand.mean()
-    n_overlap_std = n_overlap_rand.std()
-    return n_overlap_mean, n_overlap_std
+    mean = 0.0
+    var = 0.0
+    for chrom in peaks2.chroms:
+        starts1 = peaks1.column(chrom, 'start').astype(np.int64)
+        starts2 = peaks2.column(chrom, 'start').astype(np.int64)
+        if starts1.size == 0 or starts2.size == 0:
+            continue
+        ends1 = peaks1.column(chrom, 'end').astype(np.int64)
+        low = starts2.min()
+        high = starts2.max()
+        width = high - low + 1
+        lengths, counts = np.unique(peaks2.column(chrom, 'end') - starts2,
+                                    return_counts=True)
+        # random peaks starting in [start - length + 1, end - 1] overlap
+        last_starts = np.minimum(ends1 - 1, high)
+        step = max(1, chunk_size // lengths.size)
+        for head in range(0, starts1.size, step):
+            first_starts = np.maximum(
+                starts1[head:head + step, np.newaxis] - lengths + 1, low)
+            n_starts = np.clip(
+                last_starts[head:head + step, np.newaxis] - first_starts + 1,
+                0, width)
+            with np.errstate(divide='ignore'):
+                log_miss = (counts * np.log1p(-n_starts / width)).sum(axis=1)
+            prob = -np.expm1(log_miss)
+            mean += prob.sum()
+            var += (prob * (1 - prob)).sum()
+    return float(mean), float(np.sqrt(var))
 
 
 def count_common_peaks(peaks):
     """Returns the number of common peaks."""
     n_common = 0
     for chrom in peaks.chroms:
-        for peak in peaks.fetch(chrom):
-            if peak.iscommon:
-                n_common += 1
+        n_common += int(np.count_nonzero(peaks.column(chrom, 'iscommon')))
     return n_common
 
 
@@ -159,7 +377,6 @@ def count_unique_peaks(peaks):
     """Returns the number of unique peaks."""
     n_unique = 0
     for chrom in peaks.chroms:
-        for peak in peaks.fetch(chrom):
-            if not peak.iscommon:
-                n_unique += 1
+        iscommon = peaks.column(chrom, 'iscommon').astype(bool)
+        n_unique += int(iscommon.size - np.count_nonzero(iscommon))
     return n_unique
@@ -5,7 +5,17 @@ manorm.stats
 This module contains mathmatical and statistical functions used in MAnorm.
 """
 
-from math import exp, log
+from math import exp, lgamma, log
+
+import numpy as np
+
+# P values are floored at exp(MIN_LOG_P)
+MIN_LOG_P = -500
+
+# exact log-factorials of small integers, Stirling's series is used beyond
+_LOG_FACTORIAL_TABLE_SIZE = 256
+_LOG_FACTORIALS = np.array([lgamma(n + 1) for n in
+                            range(_LOG_FACTORIAL_TABLE_SIZE)])
 
 
 def xy_to_ma(x, y):
@@ -13,47 +23,171 @@ def xy_to_ma(x, y):
     :math:`M = log_2(\frac{x}{y})`
     :math:`A = \frac{log_2(x * y)}{2}`
 
+    Both scalars and arrays are accepted, and arrays are converted
+    element-wise.
+
     Parameters
     ----------
-    x : int or float
+    x : int, float or array_like
         Read count/density in sample 1.
-    y : int or float
+    y : int, float or array_like
         Read count/density in sample 2.
 
     Returns
     -------
-    m_value : float
+    m_value : float or numpy.ndarray
         Calculated M value.
-    a_value : float
+    a_value : float or numpy.ndarray
         Calculated A value.
     """
-    m_value = log(x, 2) - log(y, 2)
-    a_value = (log(x, 2) + log(y, 2)) / 2
+    log2_x = np.log2(x)
+    log2_y = np.log2(y)
+    m_value = log2_x - log2_y
+    a_value = (log2_x + log2_y) / 2
     return m_value, a_value
 
 
 def ma_to_xy(m, a):
     """Convert (M, A) value back to read counts/densities of two samples.
 
+    Both scalars and arrays are accepted, and arrays are converted
+    element-wise.
+
     Parameters
     ----------
-    m : float
+    m : float or array_like
         M value.
-    a : float
+    a : float or array_like
         A vlaue.
 
     Returns
     -------
-    x : float
+    x : float or numpy.ndarray
         Converted read count/density in sample 1.
-    y : float
+    y : float or numpy.ndarray
         Converted read count/density in sample 2.
     """
-    x = 2 ** (a + m / 2)
-    y = 2 ** (a - m / 2)
+    m = np.asarray(m, dtype=np.float64)
+    a = np.asarray(a, dtype=np.float64)
+    x = np.exp2(a + m / 2)
+    y = np.exp2(a - m / 2)
     return x, y
 
 
+def huber_fit(x, y, epsilon=1.35, alpha=0.0001, max_iter=1000, tol=1e-10):
+    """Fit a robust line `y = slope * x + intercept` with Huber loss.
+
+    The objective is the same as `sklearn.linear_model.HuberRegressor`,
+    which estimates the scale `sigma` of the residuals jointly with the
+    coefficients and penalizes the slope with L2 regularization. It is
+    minimized by iteratively reweighted least squares, alternating with the
+    closed-form update of `sigma`.
+
+    Parameters
+    ----------
+    x : array_like
+        The values of the independent variable.
+    y : array_like
+        The values of the dependent variable.
+    epsilon : float, optional
+        The threshold of the scaled residuals beyond which the loss is
+        linear, default=1.35.
+    alpha : float, optional
+        The L2 regularization strength of the slope, default=0.0001.
+    max_iter : int, optional
+        The maximum number of iterations, default=1000.
+    tol : float, optional
+        The convergence tolerance of the coefficients and the scale,
+        default=1e-10.
+
+    Returns
+    -------
+    intercept : float
+        The fitted intercept.
+    slope : float
+        The fitted slope.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if x.size < 2 or x.size != y.size:
+        raise ValueError(f"expect at least 2 paired samples, got x of size "
+                         f"{x.size} and y of size {y.size}")
+    if np.all(x == x[0]):
+        raise ValueError("expect at least 2 distinct values of x")
+    intercept, slope, sigma = 0.0, 0.0, 1.0
+    for _ in range(max_iter):
+        abs_residuals = np.abs(y - intercept - slope * x)
+        inliers = abs_residuals <= epsilon * sigma
+        # the scale minimizing the objective given the coefficients
+        denominator = x.size - (x.size - inliers.sum()) * epsilon ** 2
+        if denominator > 0:
+            sigma_new = np.sqrt(
+                (abs_residuals[inliers] ** 2).sum() / denominator)
+            sigma_new = max(sigma_new, np.finfo(np.float64).tiny)
+        else:
+            sigma_new = sigma
+        inliers = abs_residuals <= epsilon * sigma_new
+        # weighted least squares with the Huber weights
+        weights = np.where(
+            inliers, 1 / sigma_new,
+            epsilon / np.maximum(abs_residuals, np.finfo(np.float64).tiny))
+        sw, swx, swy = weights.sum(), (weights * x).sum(), (weights * y).sum()
+        swxx = (weights * x * x).sum() + alpha
+        swxy = (weights * x * y).sum()
+        det = sw * swxx - swx * swx
+        if det == 0:
+            raise ValueError("singular weighted least squares in the Huber "
+                             "fit")
+        slope_new = (sw * swxy - swx * swy) / det
+        intercept_new = (swy - slope_new * swx) / sw
+        delta = max(abs(slope_new - slope), abs(intercept_new - intercept),
+                    abs(sigma_new - sigma))
+        intercept, slope, sigma = intercept_new, slope_new, sigma_new
+        if delta < tol:
+            break
+    return float(intercept), float(slope)
+
+
+def _log_factorial(n):
+    """Calculate log(n!) of an array of non-negative integers."""
+    n = np.asarray(n, dtype=np.int64)
+    small = n < _LOG_FACTORIAL_TABLE_SIZE
+    result = _LOG_FACTORIALS[np.where(small, n, 0)]
+    if not small.all():
+        large = n[~small].astype(np.float64)
+        # Stirling's series, the truncation error is below 1e-20 here
+        inv = 1 / large
+        inv2 = inv * inv
+        result[~small] = (large * np.log(large) - large +
+                          0.5 * np.log(2 * np.pi * large) +
+                          inv * (1 / 12 - inv2 * (1 / 360 - inv2 / 1260)))
+    return result
+
+
+def manorm_log_p(x, y):
+    """Calculate the natural logarithm of MAnorm P value with given read
+    counts/densities, without clamping.
+
+    Parameters
+    ----------
+    x : int or float
+        Read count/density in sample 1.
+    y : int or float
+        Read count/density in sample 2.
+
+    Returns
+    -------
+    log_p : float
+        The natural logarithm of the P value.
+    """
+    if x < 0 or y < 0:
+        raise ValueError(f"expect x, y >= 0, got: x={x} y={y}")
+    x = max(int(round(x)), 1)
+    y = max(int(round(y)), 1)
+    return lgamma(x + y + 1) - lgamma(x + 1) - lgamma(y + 1) - (
+            x + y + 1) * log(2)
+
+
 def manorm_p(x, y):
     """Calculate MAnorm P value with given read counts/densities.
 
@@ -70,21 +204,56 @@ def manorm_p(x, y):
         The probabilty of observe (`x`, `y`) given the sum `x` + `y`.
         Please refer to the manuscript of MAnorm for more information.
     """
-
-    def _log_factorial(n):
-        num = 0
-        for i in range(1, n + 1):
-            num += log(i)
-        return num
-
-    if x < 0 or y < 0:
-        raise ValueError(f"expect x, y >= 0, got: x={x} y={y}")
-    x = max(int(round(x)), 1)
-    y = max(int(round(y)), 1)
-    # use the log-transform to calculate p
-    log_p = _log_factorial(x + y) - _log_factorial(x) - _log_factorial(y) - (
-                x + y + 1) * log(2)
-    if log_p < -500:
-        log_p = -500
+    log_p = max(manorm_log_p(x, y), MIN_LOG_P)
     p = exp(log_p)
     return p
+
+
+def manorm_log_p_array(x, y):
+    """Calculate the natural logarithm of MAnorm P values of arrays of read
+    counts/densities, without clamping.
+
+    This is the vectorized version of `manorm_log_p`.
+
+    Parameters
+    ----------
+    x : array_like
+        Read counts/densities in sample 1.
+    y : array_like
+        Read counts/densities in sample 2.
+
+    Returns
+    -------
+    log_p : numpy.ndarray
+        The natural logarithm of the P values.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if (x < 0).any() or (y < 0).any():
+        raise ValueError("expect x, y >= 0, got negative values")
+    # np.rint rounds half to even as the builtin round
+    x = np.maximum(np.rint(x), 1).astype(np.int64)
+    y = np.maximum(np.rint(y), 1).astype(np.int64)
+    return _log_factorial(x + y) - _log_factorial(x) - _log_factorial(y) - (
+            x + y + 1) * log(2)
+
+
+def manorm_p_array(x, y):
+    """Calculate MAnorm P values of arrays of read counts/densities.
+
+    This is the vectorized version of `manorm_p`, with the same rounding and
+    clamping of the read counts/densities and the P values.
+
+    Parameters
+    ----------
+    x : array_like
+        Read counts/densities in sample 1.
+    y : array_like
+        Read counts/densities in sample 2.
+
+    Returns
+    -------
+    p : numpy.ndarray
+        The P values.
+    """
+    return np.exp(np.maximum(manorm_log_p_array(x, y), MIN_LOG_P))
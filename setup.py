@@ -21,15 +21,16 @@ with open(os.path.join(pkg_dir, 'README.rst')) as fin:
 
 
 install_requires = [
-    "numpy",
+    "numpy>=1.17.0",
     "pysam>=0.15.0",
     "matplotlib>=3.0.0",
-    "scikit-learn>=0.21.0",
 ]
 
 extras_require = {
+    "sklearn": ["scikit-learn>=0.21.0"],
     "test": ["pytest>=4.0.0",
-             "pytest-cov>=2.8.0"],
+             "pytest-cov>=2.8.0",
+             "scikit-learn>=0.21.0"],
     "docs": ["sphinx>=2.0.0",
              "sphinx_rtd_theme"]
 }
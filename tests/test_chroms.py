@@ -0,0 +1,16 @@
+from manorm.chroms import ChromRegistry
+
+
+def test_chrom_registry():
+    chroms = ChromRegistry()
+    assert len(chroms) == 0
+    assert chroms.register('chr2') == 0
+    assert chroms.register('chr10') == 1
+    assert chroms.register('chr2') == 0
+    assert len(chroms) == 2
+    assert 'chr10' in chroms
+    assert 'chr1' not in chroms
+    assert chroms.lookup('chr10') == 1
+    assert chroms.lookup('chr1') is None
+    assert chroms.name(0) == 'chr2'
+    assert chroms.sort([0, 1]) == [1, 0]
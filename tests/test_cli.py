@@ -1,9 +1,11 @@
 import os
+import subprocess
+import sys
 from argparse import Namespace
 
 import pytest
 
-from manorm.cli import configure_parser, preprocess_args, run
+from manorm.cli import _ratio, configure_parser, preprocess_args, run
 
 
 def test_configure_parser(data_dir):
@@ -20,7 +22,19 @@ def test_configure_parser(data_dir):
     assert args.output_dir == os.getcwd()
 
 
-def test_run(data_dir, tmp_dir):
+def test_ratio():
+    assert _ratio(3, 2) == 1.5
+    assert _ratio(3, 0.0) == float('inf')
+    assert _ratio(-3, 0) == float('-inf')
+    assert _ratio(0, 0.0) != _ratio(0, 0.0)  # nan
+
+
+# the reference output was generated with scikit-learn's HuberRegressor,
+# the builtin fitter agrees with it within the tolerance
+@pytest.mark.parametrize('fitter, tol', [('sklearn', 1e-5), ('builtin', 1e-4)])
+def test_run(data_dir, tmp_dir, fitter, tol):
+    if fitter == 'sklearn':
+        pytest.importorskip('sklearn')
     args = Namespace(**dict(
         peak_file1=os.path.join(data_dir, 'H1hescH3k4me3Rep1_peaks.xls'),
         peak_file2=os.path.join(data_dir, 'K562H3k4me3Rep1_peaks.xls'),
@@ -28,9 +42,13 @@ def test_run(data_dir, tmp_dir):
         read_file2=os.path.join(data_dir, 'K562H3k4me3Rep1_reads.bed'),
         peak_format='macs', read_format='bed',
         name1='H1_H3K4me3', name2='K562_H3K4me3',
-        shift_size1=100, shift_size2=100, paired=False,
-        window_size=2000, summit_dis_cutoff=500, n_random=5,
-        m_cutoff=1, p_cutoff=0.01, write_all=True, output_dir=tmp_dir))
+        shift_size1=100, shift_size2=100, paired=False, threads=1,
+        read_backend='array', peak_reads_only=False, sorted=False,
+        read_cache=None, read_cache_size=None, read_cache_checksum=False,
+        window_size=2000, extra_windows=None, summit_dis_cutoff=500,
+        fitter=fitter, fit_subsample=None, fit_tol=0.005, n_random=5,
+        overlap_test='simulation', seed=None, m_cutoff=1, p_cutoff=0.01,
+        write_all=True, unclamped_p=False, output_dir=tmp_dir))
     run(args)
     fn1 = os.path.join(data_dir, 'H1_H3K4me3_vs_K562_H3K4me3_all_MAvalues.xls')
     fn2 = os.path.join(tmp_dir, 'H1_H3K4me3_vs_K562_H3K4me3_all_MAvalues.xls')
@@ -44,13 +62,32 @@ def test_run(data_dir, tmp_dir):
             tmp_line2 = tmp_line2.strip().split('\t')
             assert tmp_line1[:4] == tmp_line2[:4]
             assert float(tmp_line1[4]) == pytest.approx(
-                float(tmp_line2[4]), abs=1e-5)
+                float(tmp_line2[4]), abs=tol)
             assert float(tmp_line1[5]) == pytest.approx(
-                float(tmp_line2[5]), abs=1e-5)
+                float(tmp_line2[5]), abs=tol)
             assert float(tmp_line1[6]) == pytest.approx(
-                float(tmp_line2[6]), abs=1e-5)
+                float(tmp_line2[6]), abs=tol)
             assert tmp_line1[7] == tmp_line2[7]
             assert float(tmp_line1[8]) == pytest.approx(
-                float(tmp_line2[8]), abs=1e-5)
+                float(tmp_line2[8]), abs=tol)
             assert float(tmp_line1[9]) == pytest.approx(
-                float(tmp_line2[9]), abs=1e-5)
+                float(tmp_line2[9]), abs=tol)
+
+
+@pytest.mark.skipif(sys.version_info < (3, 7),
+                    reason="-X importtime requires Python 3.7+")
+def test_import_time():
+    # heavy dependencies are only imported by the stages that need them
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import manorm.cli'],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    import_times = {}
+    for line in result.stderr.splitlines():
+        fields = line.split('|')
+        if line.startswith('import time:') and fields[1].strip().isdigit():
+            import_times[fields[2].strip()] = int(fields[1])
+    for name in import_times:
+        assert name.split('.')[0] not in ('pysam', 'matplotlib', 'sklearn')
+    # cumulative import time in microseconds
+    assert import_times['manorm.cli'] < 1000000
@@ -0,0 +1,130 @@
+import os
+
+import numpy as np
+import pytest
+
+from manorm.io import mk_dir, write_all_peaks
+from manorm.model import MAmodel, _fit_ma, _fit_ma_subsample, \
+    _stratified_order
+from manorm.read import Reads
+from manorm.region import GenomicRegions, ManormPeak, ManormPeaks
+
+
+def _synthetic_model(seed=0):
+    rng = np.random.default_rng(seed)
+    peaks = []
+    for name, shift in (('sample1', 0), ('sample2', 150)):
+        sample_peaks = ManormPeaks(name=name)
+        starts = np.arange(400) * 5000 + 1000 + shift
+        sample_peaks.add_many('chr1', starts, starts + 600, starts + 300)
+        peaks.append(sample_peaks)
+    reads = []
+    for name in ('sample1', 'sample2'):
+        reads.append(Reads.from_sorted(
+            {'chr1': np.sort(rng.integers(0, 2000000, size=200000))},
+            name=name))
+    return MAmodel(peaks[0], peaks[1], reads[0], reads[1])
+
+
+def test_stratified_order():
+    rng = np.random.default_rng(0)
+    a_values = rng.gamma(4, 1, 10000)
+    order = _stratified_order(a_values, np.random.default_rng(1), n_strata=10)
+    assert sorted(order.tolist()) == list(range(10000))
+    # every prefix takes the peaks from the A-value strata evenly
+    deciles = np.quantile(a_values, np.linspace(0, 1, 11)[1:-1])
+    strata = np.searchsorted(deciles, a_values[order[:200]])
+    assert np.bincount(strata, minlength=10).tolist() == [20] * 10
+
+
+def test_fit_ma_subsample():
+    rng = np.random.default_rng(0)
+    a_values = rng.gamma(4, 1, 100000) + 2
+    m_values = 0.2 * a_values - 0.5 + rng.normal(0, 0.6, 100000)
+    outliers = rng.random(100000) < 0.1
+    m_values[outliers] += rng.normal(0, 4, outliers.sum())
+    intercept, slope = _fit_ma(a_values, m_values)
+    params, size, change = _fit_ma_subsample(a_values, m_values, size=5000,
+                                             tol=5e-3, seed=1)
+    assert 5000 < size <= 100000
+    assert change <= 5e-3 or size == 100000
+    assert params[0] == pytest.approx(intercept, abs=0.05)
+    assert params[1] == pytest.approx(slope, abs=0.01)
+    assert _fit_ma_subsample(a_values, m_values, size=5000, tol=5e-3,
+                             seed=1) == (params, size, change)
+    params, size, change = _fit_ma_subsample(a_values, m_values,
+                                             size=200000)
+    assert params == (intercept, slope)
+    assert size == 100000
+    assert change is None
+
+
+def test_fit_model_extra_windows():
+    model = _synthetic_model()
+    model.process_peaks()
+    model.fit_model(window_size=2000, summit_dis_cutoff=500)
+    model.normalize()
+    model_multi = _synthetic_model()
+    model_multi.process_peaks()
+    model_multi.fit_model(window_size=2000, summit_dis_cutoff=500,
+                          extra_window_sizes=[1000, 2000, 3000])
+    model_multi.normalize()
+    assert list(model_multi.window_results) == [2000, 1000, 3000]
+    assert model_multi.ma_params == model.ma_params
+    for name in ('read_count1', 'm_raw', 'm_normed', 'p_value'):
+        assert np.array_equal(model_multi.peaks_merged.concat_column(name),
+                              model.peaks_merged.concat_column(name))
+    result = model_multi.window_results[2000]
+    assert result['params'] == model.ma_params
+    assert np.array_equal(result['tables'][0]['p_value'],
+                          model.peaks1.concat_column('p_value'))
+    assert result['quality']['num_peaks'] == model.peaks_merged.size
+    for window_size in (1000, 3000):
+        table1, table2, table_merged = \
+            model_multi.window_results[window_size]['tables']
+        assert table1['m_raw'].size == model.peaks1.size
+        assert table2['m_normed'].size == model.peaks2.size
+        summits = model.peaks1.concat_column('summit')
+        positions = model.reads1.fetch('chr1')
+        counts = np.searchsorted(positions, summits + window_size // 2) - \
+            np.searchsorted(positions, summits - window_size // 2)
+        assert np.array_equal(table1['read_count1'], counts + 1)
+    with pytest.raises(ValueError):
+        model.fit_model(window_size=2000, extra_window_sizes=[0])
+
+
+def test_ma_model_on_genomic_regions(tmp_dir):
+    # peaks held as `ManormPeak` objects in `GenomicRegions`
+    model = _synthetic_model()
+    peak_sets = []
+    for peaks in (model.peaks1, model.peaks2):
+        regions = GenomicRegions(name=peaks.name)
+        for start, end, summit in zip(peaks.column('chr1', 'start').tolist(),
+                                      peaks.column('chr1', 'end').tolist(),
+                                      peaks.column('chr1', 'summit').tolist()):
+            regions.add(ManormPeak('chr1', start, end, summit))
+        peak_sets.append(regions)
+    model_regions = MAmodel(peak_sets[0], peak_sets[1], model.reads1,
+                            model.reads2)
+    for ma_model in (model, model_regions):
+        ma_model.process_peaks()
+        ma_model.fit_model(window_size=2000, summit_dis_cutoff=500)
+        ma_model.normalize()
+    assert model_regions.ma_params == model.ma_params
+    for name in ('read_count1', 'm_raw', 'm_normed', 'p_value'):
+        assert np.array_equal(model_regions.peaks1.concat_column(name),
+                              model.peaks1.concat_column(name))
+        assert np.array_equal(model_regions.peaks2.concat_column(name),
+                              model.peaks2.concat_column(name))
+    peak = model_regions.peaks1.fetch('chr1')[0]
+    assert peak.counted and peak.normalized
+    contents = []
+    for idx, ma_model in enumerate((model, model_regions)):
+        output_dir = os.path.join(tmp_dir, str(idx))
+        mk_dir(output_dir)
+        write_all_peaks(output_dir, ma_model.peaks1, ma_model.peaks2,
+                        ma_model.peaks_merged)
+        with open(os.path.join(output_dir, 'sample1_vs_sample2_all_MAvalues'
+                                           '.xls')) as fin:
+            contents.append(fin.read())
+    assert contents[0] == contents[1]
@@ -0,0 +1,58 @@
+import os
+import shutil
+
+import numpy as np
+
+from manorm.read import load_reads
+from manorm.read.cache import ReadCache
+
+
+def test_read_cache(data_dir, tmp_dir):
+    os.makedirs(tmp_dir)
+    path = os.path.join(tmp_dir, 'test_reads.bed')
+    shutil.copy(os.path.join(data_dir, 'test_reads.bed'), path)
+    cache = ReadCache(os.path.join(tmp_dir, 'cache'))
+    assert cache.load(path, 'bed', False, 100) is None
+    reads = load_reads(path, format='bed', paired=False, shift=100,
+                       cache=cache)
+    cached = cache.load(path, 'bed', False, 100, name='cached')
+    assert cached.name == 'cached'
+    assert cached.chroms == reads.chroms
+    assert cached.size == reads.size
+    assert isinstance(cached.fetch('chr1'), np.memmap)
+    assert cached.fetch('chr1').tolist() == [101, 400]
+    assert cached.count('chr1', 1, 200) == 1
+    # options are part of the cache key
+    assert cache.load(path, 'bed', False, 50) is None
+    reads = load_reads(path, format='bed', paired=False, shift=50,
+                       cache=cache)
+    assert reads.fetch('chr1').tolist() == [51, 450]
+    assert len(cache._entries()) == 2
+    # modified read files are invalidated
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert cache.load(path, 'bed', False, 100) is None
+    cache.evict()
+    assert len(cache._entries()) == 0
+
+
+def test_read_cache_checksum(data_dir, tmp_dir):
+    os.makedirs(tmp_dir)
+    path = os.path.join(tmp_dir, 'test_reads.bed')
+    shutil.copy(os.path.join(data_dir, 'test_reads.bed'), path)
+    cache = ReadCache(os.path.join(tmp_dir, 'cache'), checksum=True)
+    load_reads(path, format='bed', paired=False, shift=100, cache=cache)
+    os.utime(path)
+    assert cache.load(path, 'bed', False, 100).size == 4
+
+
+def test_read_cache_eviction(data_dir, tmp_dir):
+    cache = ReadCache(os.path.join(tmp_dir, 'cache'), max_size=1)
+    path_bed = os.path.join(data_dir, 'test_reads.bed')
+    path_bam = os.path.join(data_dir, 'test_reads.bam')
+    load_reads(path_bed, format='bed', paired=False, shift=100, cache=cache)
+    assert cache.load(path_bed, 'bed', False, 100) is not None
+    # the least recently used entry is evicted
+    load_reads(path_bam, format='bam', paired=False, shift=100, cache=cache)
+    assert cache.load(path_bed, 'bed', False, 100) is None
+    assert cache.load(path_bam, 'bam', False, 100) is not None
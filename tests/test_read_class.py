@@ -1,6 +1,7 @@
+import numpy as np
 import pytest
 
-from manorm.read import Reads
+from manorm.read import CompactReads, Reads
 
 
 def test_reads_init():
@@ -15,7 +16,7 @@ def test_reads_add():
     reads.add('chr1', 100)
     assert reads.size == 1
     assert reads.chroms == ['chr1']
-    assert reads._data['chr1'] == [100]
+    assert reads.fetch('chr1').tolist() == [100]
 
 
 def test_reads_sort():
@@ -26,7 +27,7 @@ def test_reads_sort():
     reads.sort()
     assert reads.size == 3
     assert reads.chroms == ['chr1']
-    assert reads._data['chr1'] == [1, 100, 102]
+    assert reads.fetch('chr1').tolist() == [1, 100, 102]
 
 
 def test_reads_count():
@@ -43,3 +44,57 @@ def test_reads_count():
     assert reads.count('chr1', 1, 100) == 1
     assert reads.count('chr1', 1, 101) == 2
     assert reads.count('chr1', 1, 200) == 3
+
+
+def test_reads_add_many():
+    reads = Reads(name='test')
+    reads.add_many('chr1', [300, 5])
+    reads.add('chr1', 100)
+    reads.add_many('chr2', [7])
+    assert reads.size == 4
+    assert reads.chroms == ['chr1', 'chr2']
+    assert reads.fetch('chr1').tolist() == [5, 100, 300]
+    reads.add_many('chr1', [200])
+    assert reads.fetch('chr1').tolist() == [5, 100, 200, 300]
+    assert reads.fetch('chr3').tolist() == []
+    reads.add('chr2', 2 ** 40)
+    assert reads.fetch('chr2').tolist() == [7, 2 ** 40]
+    assert reads.count('chr2', 0, 2 ** 41) == 2
+
+
+def test_reads_count_many():
+    reads = Reads(name='test')
+    reads.add_many('chr1', [100, 102, 1])
+    counts = reads.count_many('chr1', [-100, 1, 1, 1, 1],
+                              [0, 2, 100, 101, 200])
+    assert counts.tolist() == [0, 1, 1, 2, 3]
+    assert reads.count_many('chr11', [1, 5], [200, 10]).tolist() == [0, 0]
+    assert reads.count_many('chr1', [], []).tolist() == []
+    with pytest.raises(ValueError):
+        reads.count_many('chr1', [1, 2], [1, 3])
+    with pytest.raises(ValueError):
+        reads.count_many('chr1', [1, 2], [3])
+
+
+def test_compact_reads():
+    reads = CompactReads(name='test', block_size=4)
+    positions = [1, 2, 2, 3, 70000, 70001, 2 ** 40, 2 ** 40 + 5, 2 ** 40 + 9]
+    reads.add_many('chr1', positions[::-1])
+    reads.add('chr2', 5)
+    assert reads.chroms == ['chr1', 'chr2']
+    assert reads.size == 10
+    assert reads.fetch('chr1').tolist() == positions
+    assert reads.fetch('chr3').tolist() == []
+    array_reads = Reads.from_sorted({'chr1': reads.fetch('chr1')})
+    starts = [-5, 0, 2, 3, 69999, 2 ** 40, 2 ** 40 + 6, 2 ** 41]
+    ends = [0, 2, 3, 70001, 2 ** 40, 2 ** 40 + 6, 2 ** 40 + 9, 2 ** 42]
+    assert reads.count_many('chr1', starts, ends).tolist() == \
+        array_reads.count_many('chr1', starts, ends).tolist()
+    assert reads.count('chr1', 2, 3) == 2
+    assert reads.count('chr2', 0, 10) == 1
+    assert reads.count('chr3', 0, 10) == 0
+    # positions added after sorting are merged
+    reads.add('chr1', 4)
+    assert reads.count('chr1', 0, 10) == 5
+    reads = CompactReads.from_sorted({'chr1': np.arange(0, 10 ** 6, 7)})
+    assert reads.nbytes * 3 < reads.fetch('chr1').nbytes * 2
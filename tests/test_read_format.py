@@ -28,3 +28,21 @@ def test_invalid_format(data_dir):
     with pytest.raises(FileFormatError):
         load_reads(os.path.join(data_dir, 'test_reads.bed'), format='bedpe',
                    paired=True)
+
+
+def test_invalid_line_num(tmp_dir):
+    os.makedirs(tmp_dir)
+    path = os.path.join(tmp_dir, 'invalid_reads.bed')
+    with open(path, 'w') as fout:
+        fout.write("# header\n")
+        for _ in range(5):
+            fout.write("chr1\t100\t200\tread\t0\t+\n")
+        fout.write("chr1\t100\t200\tread\t0\t.\n")
+    with pytest.raises(FileFormatError, match='at line 7'):
+        load_reads(path, format='bed', paired=False)
+
+
+def test_unsupported_backend(data_dir):
+    with pytest.raises(ValueError):
+        load_reads(os.path.join(data_dir, 'test_reads.bed'), format='bed',
+                   backend='unknown_backend')
@@ -1,6 +1,11 @@
+import gzip
 import os
 
-from manorm.read import load_reads
+import pysam
+
+from manorm.read import CompactReads, ReadStream, load_reads
+from manorm.read.parsers import BedReadParser
+from manorm.region import GenomicRegion, GenomicRegions
 
 
 def test_bed(data_dir):
@@ -8,9 +13,19 @@ def test_bed(data_dir):
                        paired=False, shift=100)
     assert reads.chroms == ['chr1', 'chr2', 'chr9']
     assert reads.size == 4
-    assert reads._data['chr1'] == [101, 400]
-    assert reads._data['chr2'] == [12445]
-    assert reads._data['chr9'] == [12245]
+    assert reads.fetch('chr1').tolist() == [101, 400]
+    assert reads.fetch('chr2').tolist() == [12445]
+    assert reads.fetch('chr9').tolist() == [12245]
+
+
+def test_bed_compact(data_dir):
+    reads = load_reads(os.path.join(data_dir, 'test_reads.bed'), format='bed',
+                       paired=False, shift=100, backend='compact')
+    assert isinstance(reads, CompactReads)
+    assert reads.chroms == ['chr1', 'chr2', 'chr9']
+    assert reads.size == 4
+    assert reads.fetch('chr1').tolist() == [101, 400]
+    assert reads.count('chr1', 101, 400) == 1
 
 
 def test_bedpe(data_dir):
@@ -18,8 +33,8 @@ def test_bedpe(data_dir):
                        format='bedpe', paired=True)
     assert reads.chroms == ['chr1', 'chr9']
     assert reads.size == 2
-    assert reads._data['chr1'] == [200]
-    assert reads._data['chr9'] == [2400]
+    assert reads.fetch('chr1').tolist() == [200]
+    assert reads.fetch('chr9').tolist() == [2400]
 
 
 def test_sam(data_dir):
@@ -27,9 +42,9 @@ def test_sam(data_dir):
                        paired=False, shift=100)
     assert reads.chroms == ['chr1', 'chr2', 'chr9']
     assert reads.size == 4
-    assert reads._data['chr1'] == [101, 400]
-    assert reads._data['chr2'] == [12445]
-    assert reads._data['chr9'] == [12245]
+    assert reads.fetch('chr1').tolist() == [101, 400]
+    assert reads.fetch('chr2').tolist() == [12445]
+    assert reads.fetch('chr9').tolist() == [12245]
 
 
 def test_bam(data_dir):
@@ -37,9 +52,17 @@ def test_bam(data_dir):
                        paired=False, shift=100)
     assert reads.chroms == ['chr1', 'chr2', 'chr9']
     assert reads.size == 4
-    assert reads._data['chr1'] == [101, 400]
-    assert reads._data['chr2'] == [12445]
-    assert reads._data['chr9'] == [12245]
+    assert reads.fetch('chr1').tolist() == [101, 400]
+    assert reads.fetch('chr2').tolist() == [12445]
+    assert reads.fetch('chr9').tolist() == [12245]
+
+
+def test_bam_threads(data_dir):
+    reads = load_reads(os.path.join(data_dir, 'test_reads.bam'), format='bam',
+                       paired=False, shift=100, threads=2)
+    assert reads.chroms == ['chr1', 'chr2', 'chr9']
+    assert reads.size == 4
+    assert reads.fetch('chr1').tolist() == [101, 400]
 
 
 def test_bam_pe(data_dir):
@@ -47,5 +70,152 @@ def test_bam_pe(data_dir):
                        format='bam', paired=True)
     assert reads.chroms == ['chr1', 'chr9']
     assert reads.size == 2
-    assert reads._data['chr1'] == [150]
-    assert reads._data['chr9'] == [2000]
+    assert reads.fetch('chr1').tolist() == [150]
+    assert reads.fetch('chr9').tolist() == [2000]
+
+
+def test_bam_by_contig(data_dir, tmp_dir):
+    os.makedirs(tmp_dir)
+    for filename, paired in [('test_reads.bam', False),
+                             ('test_reads_pe.bam', True)]:
+        path = os.path.join(tmp_dir, filename)
+        pysam.sort('-o', path, os.path.join(data_dir, filename))
+        pysam.index(path)
+        reads_serial = load_reads(path, format='bam', paired=paired,
+                                  threads=1)
+        reads_parallel = load_reads(path, format='bam', paired=paired,
+                                    threads=2)
+        assert reads_parallel.chroms == reads_serial.chroms
+        assert reads_parallel.size == reads_serial.size
+        for chrom in reads_serial.chroms:
+            assert reads_parallel.fetch(chrom).tolist() == reads_serial.fetch(
+                chrom).tolist()
+
+
+def test_bed_batches(data_dir, tmp_dir):
+    os.makedirs(tmp_dir)
+    with open(os.path.join(data_dir, 'test_reads.bed')) as fin:
+        content = fin.read()
+    path = os.path.join(tmp_dir, 'test_reads.bed.gz')
+    with gzip.open(path, 'wt') as fout:
+        fout.write("track name=test\n\n" + content * 3)
+    for block_size in [16, 1 << 20]:
+        batches = {}
+        for chrom, positions in BedReadParser(path).parse_batches(
+                shift=100, block_size=block_size):
+            batches.setdefault(chrom, []).extend(positions.tolist())
+        assert sorted(batches) == ['chr1', 'chr2', 'chr9']
+        assert sorted(batches['chr1']) == [101] * 3 + [400] * 3
+        assert batches['chr2'] == [12445] * 3
+        assert batches['chr9'] == [12245] * 3
+    reads = load_reads(path, format='bed', paired=False, shift=100)
+    assert reads.size == 12
+    assert reads.fetch('chr9').tolist() == [12245] * 3
+
+
+def test_bam_by_regions(data_dir, tmp_dir):
+    os.makedirs(tmp_dir)
+    path = os.path.join(tmp_dir, 'test_reads.bam')
+    pysam.sort('-o', path, os.path.join(data_dir, 'test_reads.bam'))
+    pysam.index(path)
+    regions = GenomicRegions()
+    regions.add(GenomicRegion('chr1', 0, 150))
+    regions.add(GenomicRegion('chr2', 12000, 13000))
+    regions.add(GenomicRegion('chr5', 0, 1000))
+    for threads in [1, 2]:
+        reads = load_reads(path, format='bam', paired=False, shift=100,
+                           threads=threads, regions=regions)
+        assert reads.chroms == ['chr1', 'chr2']
+        assert reads.size == 2
+        assert reads.fetch('chr1').tolist() == [101]
+        assert reads.fetch('chr2').tolist() == [12445]
+    # regions are ignored for other formats
+    reads = load_reads(os.path.join(data_dir, 'test_reads.bed'),
+                       format='bed', paired=False, shift=100, regions=regions)
+    assert reads.size == 4
+
+
+def _write_pairs(path, pairs):
+    """Write proper pairs given as (start of the forward mate, fragment
+    length, whether read1 is reverse) into a sorted and indexed BAM."""
+    header = {'HD': {'VN': '1.6', 'SO': 'coordinate'},
+              'SQ': [{'SN': 'chr1', 'LN': 100000}]}
+    segments = []
+    for idx, (start, length, read1_reverse) in enumerate(pairs):
+        mate_start = start + length - 50
+        for is_read1 in (True, False):
+            segment = pysam.AlignedSegment()
+            segment.query_name = f"pair{idx}"
+            segment.query_sequence = 'A' * 50
+            segment.query_qualities = pysam.qualitystring_to_array('I' * 50)
+            segment.cigarstring = '50M'
+            segment.reference_id = segment.next_reference_id = 0
+            segment.mapping_quality = 60
+            is_reverse = is_read1 == read1_reverse
+            segment.reference_start = mate_start if is_reverse else start
+            segment.next_reference_start = start if is_reverse else \
+                mate_start
+            segment.template_length = -length if is_reverse else length
+            segment.flag = 0x1 | 0x2 | (0x40 if is_read1 else 0x80) | (
+                0x10 if is_reverse else 0x20)
+            segments.append(segment)
+    segments.sort(key=lambda x: x.reference_start)
+    with pysam.AlignmentFile(path, 'wb', header=header) as fout:
+        for segment in segments:
+            fout.write(segment)
+    pysam.index(path)
+
+
+def test_bam_pe_by_regions(tmp_dir):
+    os.makedirs(tmp_dir)
+    path = os.path.join(tmp_dir, 'test_reads_pe.bam')
+    # the long fragment has its midpoint 11300 at the last base of a window,
+    # while its read1 starts beyond the default fetch flank
+    _write_pairs(path, [(10000, 2600, True), (5000, 300, False),
+                        (10500, 200, True), (30000, 400, False)])
+    reads = load_reads(path, format='bam', paired=True)
+    assert reads.fetch('chr1').tolist() == [5150, 10600, 11300, 30200]
+    regions = GenomicRegions()
+    regions.add(GenomicRegion('chr1', 9000, 11301))
+    for threads in [1, 2]:
+        reads = load_reads(path, format='bam', paired=True, threads=threads,
+                           regions=regions)
+        assert reads.fetch('chr1').tolist() == [10600, 11300]
+
+
+def test_read_stream(data_dir, tmp_dir):
+    os.makedirs(tmp_dir)
+    windows = {'chr1': ([0, 100, 400], [200, 500, 401]),
+               'chr2': ([12000], [13000]),
+               'chr3': ([0], [1000])}
+    path = os.path.join(data_dir, 'test_reads.bed')
+    reads = load_reads(path, format='bed', paired=False, shift=100)
+    stream = ReadStream(path, format='bed', paired=False, shift=100)
+    assert stream.size is None
+    counts = stream.count_windows(windows)
+    assert stream.size == 4
+    assert stream._reads is None
+    for chrom, expected in reads.count_windows(windows).items():
+        assert counts[chrom].tolist() == expected.tolist()
+    assert counts['chr1'].tolist() == [1, 2, 1]
+    # unsorted reads are loaded into memory instead
+    unsorted_path = os.path.join(tmp_dir, 'unsorted_reads.bed')
+    with open(path) as fin, open(unsorted_path, 'w') as fout:
+        lines = fin.readlines()
+        fout.writelines([lines[2], lines[0], lines[3], lines[1]])
+    stream = ReadStream(unsorted_path, format='bed', paired=False, shift=100)
+    counts = stream.count_windows(windows)
+    assert stream._reads is not None
+    assert stream.size == 4
+    assert counts['chr1'].tolist() == [1, 2, 1]
+    assert counts['chr2'].tolist() == [1]
+    # sorted BAM files
+    bam_path = os.path.join(tmp_dir, 'test_reads.bam')
+    pysam.sort('-o', bam_path, os.path.join(data_dir, 'test_reads.bam'))
+    reads = load_reads(bam_path, format='bam', paired=False, shift=100)
+    stream = ReadStream(bam_path, format='bam', paired=False, shift=100)
+    counts = stream.count_windows(windows)
+    assert stream._reads is None
+    assert stream.size == reads.size
+    for chrom, expected in reads.count_windows(windows).items():
+        assert counts[chrom].tolist() == expected.tolist()
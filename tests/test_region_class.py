@@ -1,5 +1,8 @@
+import random
+
 import pytest
-from manorm.region import GenomicRegion, ManormPeak, GenomicRegions
+from manorm.region import GenomicRegion, ManormPeak, ManormPeaks, \
+    GenomicRegions
 
 
 def test_region_init():
@@ -30,12 +33,12 @@ def test_regions_add():
     regions.add(region)
     assert regions.size == 1
     assert regions.chroms == ['chr1']
-    assert regions._data['chr1'] == [region]
+    assert regions._data[region.chrom_id] == [region]
     peak = ManormPeak(chrom='chr1', start=1, end=100)
     regions.add(peak)
     assert regions.size == 2
     assert regions.chroms == ['chr1']
-    assert regions._data['chr1'] == [region, peak]
+    assert regions._data[region.chrom_id] == [region, peak]
     with pytest.raises(ValueError):
         regions.add(123)
 
@@ -76,3 +79,126 @@ def test_regions_sort():
     regions.sort(by='summit', ascending=False)
     assert regions.fetch(chrom='chr1')[0] == region1
     assert regions.fetch(chrom='chr1')[1] == region2
+
+
+def test_regions_column():
+    regions = GenomicRegions(name='test')
+    regions.add(ManormPeak(chrom='chr1', start=1, end=100))
+    regions.add(ManormPeak(chrom='chr1', start=10, end=50))
+    assert regions.column('chr1', 'start').tolist() == [1, 10]
+    assert regions.column('chr2', 'start').tolist() == []
+    regions.set_column('chr1', 'iscommon', [True, False])
+    assert regions.fetch('chr1')[0].iscommon
+    assert not regions.fetch('chr1')[1].iscommon
+    with pytest.raises(ValueError):
+        regions.set_column('chr1', 'iscommon', [True])
+
+
+def test_manorm_peaks():
+    peaks = ManormPeaks(name='test')
+    assert peaks.size == 0
+    assert peaks.chroms == []
+    peaks.add_many('chr2', [100, 1], [200, 50], [150, 30])
+    peaks.add_many('chr1', [10], [30])
+    peak = ManormPeak(chrom='chr2', start=20, end=80)
+    peak.iscommon = True
+    peak.summit_dis = 5
+    peaks.add(peak)
+    assert peaks.size == 4
+    assert peaks.chroms == ['chr1', 'chr2']
+    assert peaks.column('chr1', 'summit').tolist() == [20]
+    assert peaks.column('chr2', 'start').tolist() == [100, 1, 20]
+    assert peaks.column('chr2', 'summit_dis').tolist() == [-1, -1, 5]
+    assert peaks.column('chr3', 'start').tolist() == []
+    peaks.sort()
+    assert peaks.column('chr2', 'start').tolist() == [1, 20, 100]
+    peaks.sort(by='summit', ascending=False)
+    assert peaks.column('chr2', 'summit').tolist() == [150, 50, 30]
+    # row views read and write the columns
+    views = peaks.fetch('chr2')
+    assert len(views) == 3
+    assert isinstance(views[0], ManormPeak)
+    assert views[1].chrom == 'chr2'
+    assert views[1].iscommon
+    assert views[1].summit_dis == 5
+    assert views[0].summit_dis is None
+    assert views[0].m_raw is None
+    views[0].set_read_counts(9, 19, window=2000)
+    assert peaks.column('chr2', 'read_count1').tolist() == [10, -1, -1]
+    assert views[0].read_density2 == 10.0
+    assert views[0].m_raw == pytest.approx(-1)
+    peaks.set_column('chr2', 'iscommon', [True, False, False])
+    assert [view.iscommon for view in views] == [True, False, False]
+    peaks.set_column('chr2', 'summit_dis', [None, 1, 2])
+    assert views[0].summit_dis is None
+    with pytest.raises(ValueError):
+        peaks.column('chr2', 'unknown_column')
+    with pytest.raises(ValueError):
+        peaks.set_column('chr2', 'iscommon', [True])
+    with pytest.raises(ValueError):
+        peaks.add(GenomicRegion(chrom='chr1', start=1, end=100))
+    with pytest.raises(ValueError):
+        peaks.add_many('chr1', [10, 20], [30, 20])
+    with pytest.raises(ValueError):
+        peaks.add_many('chr1', [10], [30], [30])
+    # whole columns concatenated over chromosomes
+    assert peaks.concat_column('summit').tolist() == [20, 150, 50, 30]
+    peaks.set_concat_column('m_raw', [1.0, 2.0, 3.0, 4.0])
+    assert peaks.column('chr2', 'm_raw').tolist() == [2.0, 3.0, 4.0]
+    peaks.set_concat_column('counted', True)
+    assert peaks.concat_column('counted').all()
+    assert ManormPeaks().concat_column('start').tolist() == []
+    with pytest.raises(ValueError):
+        peaks.set_concat_column('m_raw', [1.0, 2.0])
+
+
+def test_regions_index():
+    regions = GenomicRegions(name='test')
+    regions.add(GenomicRegion(chrom='chr1', start=100, end=200))
+    regions.add(GenomicRegion(chrom='chr1', start=10, end=50))
+    regions.add(GenomicRegion(chrom='chr1', start=120, end=150))
+    counts = regions.count_overlaps('chr1', [0, 50, 49, 130, 200],
+                                    [10, 100, 101, 140, 300])
+    assert counts.tolist() == [0, 0, 2, 2, 0]
+    assert regions.count_overlaps('chr2', [0], [10]).tolist() == [0]
+    with pytest.raises(ValueError):
+        regions.count_overlaps('chr1', [10], [10])
+    indices, distances = regions.nearest('chr1', [0, 10, 60, 90, 130, 250])
+    assert indices.tolist() == [1, 1, 1, 0, 0, 0]
+    assert distances.tolist() == [10, 0, 11, 10, 0, 51]
+    indices, distances = regions.nearest('chr2', [0])
+    assert indices.tolist() == [-1]
+    assert distances.tolist() == [-1]
+    # the index is rebuilt after new regions are added
+    regions.add(GenomicRegion(chrom='chr1', start=0, end=5))
+    assert regions.count_overlaps('chr1', [0], [10]).tolist() == [1]
+    assert regions.nearest('chr1', [0, 7])[1].tolist() == [0, 3]
+    others = ManormPeaks(name='others')
+    others.add_many('chr1', [45, 300], [60, 400])
+    others.add_many('chr3', [45], [60])
+    flags = regions.overlaps(others)
+    assert list(flags) == ['chr1']
+    assert flags['chr1'].tolist() == [False, True, False, False]
+    assert others.overlaps(regions)['chr1'].tolist() == [True, False]
+    others.set_column('chr1', 'start', [55, 300])
+    assert others.overlaps(regions)['chr1'].tolist() == [False, False]
+
+
+def test_regions_nearest():
+    def _distance(region, pos):
+        return max(region.start - pos, pos - region.end + 1, 0)
+
+    rng = random.Random(1)
+    for _ in range(100):
+        regions = GenomicRegions(name='test')
+        for _ in range(rng.randint(1, 30)):
+            start = rng.randint(0, 1000)
+            regions.add(GenomicRegion('chr1', start,
+                                      start + rng.randint(1, 200)))
+        positions = [rng.randint(0, 1300) for _ in range(50)]
+        indices, distances = regions.nearest('chr1', positions)
+        fetched = regions.fetch('chr1')
+        for pos, idx, dis in zip(positions, indices.tolist(),
+                                 distances.tolist()):
+            assert dis == min(_distance(region, pos) for region in fetched)
+            assert _distance(fetched[idx], pos) == dis
@@ -1,7 +1,15 @@
-from manorm.region import GenomicRegion, ManormPeak, GenomicRegions
+import os
+import random
+
+import numpy as np
+
+from manorm.region import GenomicRegion, ManormPeak, ManormPeaks, \
+    GenomicRegions, load_manorm_peaks
+from manorm.region import utils as region_utils
 from manorm.region.utils import overlap_on_same_chrom, \
     classify_peaks_by_overlap, merge_common_peaks, generate_random_regions, \
-    count_common_peaks, count_unique_peaks
+    count_common_peaks, count_unique_peaks, merge_peak_windows, \
+    random_peak_overlap, expected_peak_overlap, _count_random_overlaps
 
 
 def test_region_overlap_on_same_chrom():
@@ -16,6 +24,40 @@ def test_region_overlap_on_same_chrom():
     assert not flag2[1]
 
 
+def _brute_force_overlap(regions1, regions2):
+    overlap_flag1 = np.zeros(len(regions1), dtype=bool)
+    overlap_flag2 = np.zeros(len(regions2), dtype=bool)
+    for i, region_i in enumerate(regions1):
+        for j, region_j in enumerate(regions2):
+            if (region_i.end - region_j.start) * (
+                    region_j.end - region_i.start) > 0:
+                overlap_flag1[i] = True
+                overlap_flag2[j] = True
+    return overlap_flag1, overlap_flag2
+
+
+def _random_regions(rng, num, max_pos, max_len):
+    regions = []
+    for _ in range(num):
+        start = rng.randint(0, max_pos)
+        regions.append(GenomicRegion('chr1', start,
+                                     start + rng.randint(1, max_len)))
+    return regions
+
+
+def test_overlap_on_same_chrom_random():
+    rng = random.Random(1)
+    for _ in range(200):
+        max_pos = rng.choice([10, 100, 10000])
+        max_len = rng.choice([1, 5, 50, 500])
+        regions1 = _random_regions(rng, rng.randint(0, 60), max_pos, max_len)
+        regions2 = _random_regions(rng, rng.randint(0, 60), max_pos, max_len)
+        flag1, flag2 = overlap_on_same_chrom(regions1, regions2)
+        expected1, expected2 = _brute_force_overlap(regions1, regions2)
+        assert flag1.tolist() == expected1.tolist()
+        assert flag2.tolist() == expected2.tolist()
+
+
 def test_classify_peak_overlap():
     peaks1 = GenomicRegions(name='test1')
     peaks2 = GenomicRegions(name='test2')
@@ -73,6 +115,49 @@ def test_merge_common_peaks():
     assert peaks_merged.fetch('chr2')[0].summit == 65
 
 
+def _merge_common_peaks_loop(peaks1, peaks2, chrom):
+    peaks_mixed = [peak for peak in peaks1.fetch(chrom) + peaks2.fetch(chrom)
+                   if peak.iscommon]
+    peaks_mixed.sort(key=lambda x: x.start)
+    clusters = []
+    for peak in peaks_mixed:
+        if clusters and peak.start < clusters[-1][1]:
+            clusters[-1][1] = max(clusters[-1][1], peak.end)
+            clusters[-1][2].append(peak.summit)
+        else:
+            clusters.append([peak.start, peak.end, [peak.summit]])
+    merged = []
+    for start, end, summits in clusters:
+        summits.sort()
+        min_dis = None
+        for head, tail in zip(summits[:-1], summits[1:]):
+            if min_dis is None or min_dis > (tail - head):
+                min_dis = tail - head
+                summit = (head + tail) // 2
+        merged.append((start, end, summit, min_dis))
+    return merged
+
+
+def test_merge_common_peaks_random():
+    rng = random.Random(1)
+    for _ in range(100):
+        peaks1 = ManormPeaks(name='test1')
+        peaks2 = ManormPeaks(name='test2')
+        for peaks in (peaks1, peaks2):
+            for _ in range(rng.randint(0, 40)):
+                start = rng.randint(0, 2000)
+                end = start + rng.randint(1, 200)
+                peaks.add(ManormPeak('chr1', start, end,
+                                     rng.randint(start, end - 1)))
+            peaks.sort()
+        classify_peaks_by_overlap(peaks1, peaks2)
+        peaks_merged = merge_common_peaks(peaks1, peaks2)
+        merged = [(peak.start, peak.end, peak.summit, peak.summit_dis)
+                  for peak in peaks_merged.fetch('chr1')]
+        assert merged == _merge_common_peaks_loop(peaks1, peaks2, 'chr1')
+        assert all(peak.iscommon for peak in peaks_merged.fetch('chr1'))
+
+
 def test_generate_random_peaks():
     peaks_ref = GenomicRegions(name='test1')
     peak1 = ManormPeak(chrom='chr1', start=1, end=100, summit=50)
@@ -93,11 +178,71 @@ def test_generate_random_peaks():
     peaks_ref.add(peak8)
     peaks_rand = generate_random_regions(peaks_ref)
     assert peaks_rand.size == 8
+    peaks_rand1 = generate_random_regions(peaks_ref, seed=1)
+    peaks_rand2 = generate_random_regions(peaks_ref, seed=1)
+    assert peaks_rand1.column('chr1', 'start').tolist() == \
+        peaks_rand2.column('chr1', 'start').tolist()
     assert len(peaks_rand.fetch('chr1')) == 4
     assert len(peaks_rand.fetch('chr2')) == 3
     assert len(peaks_rand.fetch('chr22')) == 1
 
 
+def test_random_peak_overlap():
+    rng = np.random.default_rng(1)
+    starts = np.sort(rng.integers(0, 2000, size=50))
+    ends = starts + rng.integers(1, 80, size=50)
+    rand_starts = rng.integers(0, 2000, size=(20, 30))
+    rand_ends = rand_starts + rng.integers(1, 80, size=30)
+    counts = _count_random_overlaps(starts, ends, rand_starts, rand_ends)
+    regions1 = [GenomicRegion('chr1', start, end)
+                for start, end in zip(starts.tolist(), ends.tolist())]
+    for row, count in enumerate(counts):
+        regions2 = [GenomicRegion('chr1', start, end) for start, end in
+                    zip(rand_starts[row].tolist(), rand_ends[row].tolist())]
+        flag1, _ = _brute_force_overlap(regions1, regions2)
+        assert count == flag1.sum()
+
+    peaks1 = ManormPeaks(name='test1')
+    peaks2 = ManormPeaks(name='test2')
+    peaks1.add_many('chr1', starts, ends)
+    peaks2.add_many('chr1', rand_starts[0], rand_ends[0])
+    peaks2.add_many('chr2', rand_starts[1], rand_ends[1])
+    result1 = random_peak_overlap(peaks1, peaks2, 50, seed=3)
+    result2 = random_peak_overlap(peaks1, peaks2, 50, seed=3,
+                                  batch_size=100)
+    result3 = random_peak_overlap(peaks1, peaks2, 50, seed=3, processes=3)
+    assert result1.shape == (50,)
+    assert result1.tolist() == result2.tolist() == result3.tolist()
+    assert 0 < result1.mean() <= 50
+
+
+def test_random_peak_overlap_without_shared_memory(monkeypatch):
+    peaks1 = ManormPeaks(name='test1')
+    peaks2 = ManormPeaks(name='test2')
+    peaks1.add_many('chr1', [10, 200, 500], [100, 300, 600])
+    peaks2.add_many('chr1', [0, 400], [50, 450])
+    result1 = random_peak_overlap(peaks1, peaks2, 20, seed=3, processes=2)
+    monkeypatch.setattr(region_utils, '_import_shared_memory', lambda: None)
+    result2 = random_peak_overlap(peaks1, peaks2, 20, seed=3, processes=2)
+    assert result1.tolist() == result2.tolist()
+
+
+def test_expected_peak_overlap(data_dir):
+    peaks1 = load_manorm_peaks(
+        os.path.join(data_dir, 'H1hescH3k4me3Rep1_peaks.xls'), 'macs')
+    peaks2 = load_manorm_peaks(
+        os.path.join(data_dir, 'K562H3k4me3Rep1_peaks.xls'), 'macs')
+    mean, std = expected_peak_overlap(peaks1, peaks2, chunk_size=1000)
+    n_overlap_rand = random_peak_overlap(peaks1, peaks2, 2000, seed=1)
+    # agree within the standard error of the simulated mean
+    assert abs(mean - n_overlap_rand.mean()) < 4 * std / np.sqrt(2000)
+    assert abs(std - n_overlap_rand.std()) < 0.05 * std
+    # no chromosome in common
+    peaks3 = ManormPeaks(name='test3')
+    peaks3.add_many('chrUn', [100], [200])
+    assert expected_peak_overlap(peaks1, peaks3) == (0.0, 0.0)
+
+
 def test_peaks_count_n_unique_common():
     peaks = GenomicRegions(name='test')
     peak1 = ManormPeak(chrom='chr1', start=1, end=100)
@@ -118,3 +263,19 @@ def test_peaks_count_n_unique_common():
     peaks.add(peak4)
     assert count_unique_peaks(peaks) == 2
     assert count_common_peaks(peaks) == 2
+
+
+def test_merge_peak_windows():
+    peaks1 = GenomicRegions(name='test1')
+    peaks2 = GenomicRegions(name='test2')
+    peaks1.add(ManormPeak(chrom='chr1', start=50, end=150))
+    peaks1.add(ManormPeak(chrom='chr1', start=500, end=600))
+    peaks1.add(ManormPeak(chrom='chr2', start=1000, end=1100))
+    peaks2.add(ManormPeak(chrom='chr1', start=300, end=400))
+    peaks2.add(ManormPeak(chrom='chr1', start=900, end=1000))
+    windows = merge_peak_windows(peaks1, peaks2, window=200)
+    assert windows.chroms == ['chr1', 'chr2']
+    assert [(region.start, region.end) for region in
+            windows.fetch('chr1')] == [(0, 700), (800, 1100)]
+    assert [(region.start, region.end) for region in
+            windows.fetch('chr2')] == [(900, 1200)]
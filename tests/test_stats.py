@@ -0,0 +1,92 @@
+from math import exp, log
+
+import numpy as np
+import pytest
+
+from manorm.stats import xy_to_ma, ma_to_xy, manorm_p, manorm_p_array, \
+    manorm_log_p, manorm_log_p_array, huber_fit
+
+
+def _manorm_p_loop(x, y):
+    def _log_factorial(n):
+        return sum(log(i) for i in range(1, n + 1))
+
+    x = max(int(round(x)), 1)
+    y = max(int(round(y)), 1)
+    log_p = _log_factorial(x + y) - _log_factorial(x) - _log_factorial(y) - (
+            x + y + 1) * log(2)
+    return exp(max(log_p, -500))
+
+
+def test_manorm_p():
+    assert manorm_p(1, 1) == pytest.approx(0.25)
+    assert manorm_p(0, 0.4) == manorm_p(1, 1)
+    assert manorm_p(2.5, 3) == manorm_p(2, 3)
+    assert manorm_p(5000, 10) == exp(-500)
+    for x, y in [(3, 7), (40.2, 13.6), (255.5, 256.5), (1200, 1500)]:
+        assert manorm_p(x, y) == pytest.approx(_manorm_p_loop(x, y),
+                                               rel=1e-9)
+    with pytest.raises(ValueError):
+        manorm_p(-1, 2)
+
+
+def test_manorm_p_array():
+    rng = np.random.default_rng(0)
+    x = np.r_[rng.uniform(0, 30, 200), rng.uniform(0, 3000, 200), 0.5, 2.5]
+    y = np.r_[rng.uniform(0, 30, 200), rng.uniform(0, 3000, 200), 1.5, 300]
+    p_values = manorm_p_array(x, y)
+    assert p_values.shape == x.shape
+    expected = [manorm_p(x_i, y_i) for x_i, y_i in zip(x, y)]
+    assert p_values == pytest.approx(expected, rel=1e-9)
+    assert manorm_p_array([], []).shape == (0,)
+    with pytest.raises(ValueError):
+        manorm_p_array([1, 2], [3, -1])
+
+
+def test_xy_to_ma():
+    m_value, a_value = xy_to_ma(8, 2)
+    assert m_value == pytest.approx(2)
+    assert a_value == pytest.approx(2)
+    x, y = ma_to_xy(m_value, a_value)
+    assert x == pytest.approx(8)
+    assert y == pytest.approx(2)
+    rng = np.random.default_rng(0)
+    x = rng.uniform(0.1, 100, 50)
+    y = rng.uniform(0.1, 100, 50)
+    m_values, a_values = xy_to_ma(x, y)
+    assert m_values.shape == a_values.shape == (50,)
+    for idx in range(50):
+        m_value, a_value = xy_to_ma(x[idx], y[idx])
+        assert m_values[idx] == pytest.approx(m_value)
+        assert a_values[idx] == pytest.approx(a_value)
+    x_back, y_back = ma_to_xy(m_values.tolist(), a_values.tolist())
+    assert x_back == pytest.approx(x)
+    assert y_back == pytest.approx(y)
+
+
+def test_manorm_log_p():
+    assert manorm_log_p(3, 7) == pytest.approx(log(manorm_p(3, 7)))
+    assert manorm_log_p(5000, 10) < -500
+    log_p_values = manorm_log_p_array([3, 5000], [7, 10])
+    assert log_p_values[0] == pytest.approx(manorm_log_p(3, 7))
+    assert log_p_values[1] == pytest.approx(manorm_log_p(5000, 10))
+    assert manorm_p_array([5000], [10])[0] == exp(-500)
+
+
+def test_huber_fit():
+    rng = np.random.default_rng(0)
+    x = rng.uniform(2, 8, 500)
+    y = 0.3 * x - 1 + rng.normal(0, 0.5, 500)
+    outliers = rng.random(500) < 0.15
+    y[outliers] += rng.normal(0, 5, outliers.sum())
+    intercept, slope = huber_fit(x, y)
+    assert slope == pytest.approx(0.3, abs=0.05)
+    assert intercept == pytest.approx(-1, abs=0.25)
+    with pytest.raises(ValueError):
+        huber_fit([1], [2])
+    with pytest.raises(ValueError):
+        huber_fit([3, 3, 3], [1, 2, 3])
+    sklearn_linear = pytest.importorskip('sklearn.linear_model')
+    huber = sklearn_linear.HuberRegressor().fit(x.reshape(-1, 1), y)
+    assert intercept == pytest.approx(huber.intercept_, abs=1e-4)
+    assert slope == pytest.approx(huber.coef_[0], abs=1e-4)